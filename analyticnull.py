@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+'''
+Module to implement the analytic null distribution in randomoverlaps.py
+
+Under the placement model of random_interval, a UCE spanning L + 1 bases lands in a genome space interval chosen with
+probability proportional to its length (among the intervals it fits in), at a uniformly chosen start. Its bp overlap
+with the collapsed against set, f(x) = covered bases in [x, x + L], is piecewise linear in the start x, changing slope
+only where x or x + L + 1 crosses the edge of an against interval. Summing f and f^2 over each linear piece in closed
+form gives the exact mean and variance of one UCE's overlap without enumerating starts. The moments of the total
+overlap are the sums over UCEs, treating placements as independent, so the variance ignores the rejection of random
+sets whose members overlap each other.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import logging
+import sys
+import numpy as np
+
+
+def space_arrays(aGenomeSpaceIntervals):
+    """ Starts and stops of the genome space intervals on each chromosome, sorted by start """
+    hSpace = {}
+    for aInterval in aGenomeSpaceIntervals:
+        hSpace.setdefault(aInterval[0], []).append((aInterval[1], aInterval[2]))
+    for strChr in hSpace:
+        npArCoords = np.array(sorted(hSpace[strChr]), dtype=np.int64)
+        hSpace[strChr] = (npArCoords[:, 0], npArCoords[:, 1])
+    return hSpace
+
+
+def pieces(iLen, strChr, npArSpaceStarts, npArSpaceStops, oTrack):
+    """
+    Linear pieces of the overlap f of an interval of length iLen with the against set, over the starts allowed on one
+    chromosome. Returns arrays of the first start p and number of starts n of each piece, f(p), the slope D of f
+    along the piece, the index of the space interval holding it, and the null weight of each space interval (its
+    length) with its number of allowed starts. Returns None if the interval fits nowhere on the chromosome
+
+    """
+    # Allowed starts in each space interval are [a, b]
+    npArA = npArSpaceStarts
+    npArB = npArSpaceStops - iLen
+    abFits = npArB >= npArA
+    if not abFits.any():
+        return None
+    npArA = npArA[abFits]
+    npArB = npArB[abFits]
+    npArWeights = (npArSpaceStops[abFits] - npArSpaceStarts[abFits] + 1).astype(np.float64)
+    npArAgainstStarts, npArAgainstStops = oTrack.bounds(strChr)
+    # f changes slope where the window start enters or leaves an against interval, or the window end does
+    npArBreaks = np.unique(np.concatenate((npArA, npArB + 1, npArAgainstStarts, npArAgainstStops + 1,
+                                           npArAgainstStarts - iLen - 1, npArAgainstStops - iLen)))
+    npArP = npArBreaks[:-1]
+    npArN = npArBreaks[1:] - npArP
+    # Keep pieces that lie inside an allowed start range
+    aiSpace = np.searchsorted(npArA, npArP, side='right') - 1
+    abInside = (aiSpace >= 0) & (npArP <= npArB[np.maximum(aiSpace, 0)])
+    npArP = npArP[abInside]
+    npArN = npArN[abInside]
+    aiSpace = aiSpace[abInside]
+    npArF = oTrack.covered(strChr, npArP, npArP + iLen)
+    npArD = (oTrack.covered(strChr, npArP + iLen + 1, npArP + iLen + 1) - oTrack.covered(strChr, npArP, npArP))
+    return npArP, npArN, npArF, npArD, aiSpace, npArWeights, npArB - npArA + 1
+
+
+def length_moments(iLen, hSpace, oTrack):
+    """
+    Mean and second moment of the bp overlap of one random interval of length iLen (stop - start), placed as
+    random_interval places it. Returns None if the interval fits nowhere in the space
+
+    """
+    dWeight = dFirst = dSecond = 0.0
+    for strChr, (npArSpaceStarts, npArSpaceStops) in hSpace.items():
+        tPieces = pieces(iLen, strChr, npArSpaceStarts, npArSpaceStops, oTrack)
+        if tPieces is None:
+            continue
+        npArP, npArN, npArF, npArD, aiSpace, npArWeights, npArStarts = tPieces
+        npArN = npArN.astype(np.float64)
+        npArF = npArF.astype(np.float64)
+        npArD = npArD.astype(np.float64)
+        # Closed-form sums of f(p + t) = F + D t and its square over t = 0 .. n - 1
+        npArT1 = npArN * (npArN - 1) / 2.0
+        npArT2 = (npArN - 1) * npArN * (2 * npArN - 1) / 6.0
+        npArSumF = npArN * npArF + npArD * npArT1
+        npArSumF2 = npArN * npArF ** 2 + 2 * npArF * npArD * npArT1 + npArD ** 2 * npArT2
+        iSpaces = len(npArWeights)
+        dFirst += (npArWeights * np.bincount(aiSpace, npArSumF, iSpaces) / npArStarts).sum()
+        dSecond += (npArWeights * np.bincount(aiSpace, npArSumF2, iSpaces) / npArStarts).sum()
+        dWeight += npArWeights.sum()
+    if not dWeight:
+        return None
+    return dFirst / dWeight, dSecond / dWeight
+
+
+def null_moments(aUCEs, aGenomeSpaceIntervals, oTrack):
+    """ Mean and variance of the total bp overlap of a random set matched to aUCEs """
+    hSpace = space_arrays(aGenomeSpaceIntervals)
+    hLengths = {}
+    for aUCE in aUCEs:
+        iLen = aUCE[2] - aUCE[1]
+        hLengths[iLen] = hLengths.get(iLen, 0) + 1
+    logging.info("Computing analytic moments for {} distinct lengths".format(len(hLengths)))
+    dMean = dVariance = 0.0
+    for iLen, iCount in sorted(hLengths.items()):
+        tMoments = length_moments(iLen, hSpace, oTrack)
+        if tMoments is None:
+            logging.error("Can't place an interval of length {} anywhere in the genome space".format(iLen))
+            print "Could not find a space large enough to pick a random interval."
+            sys.exit(1)
+        dFirst, dSecond = tMoments
+        dMean += iCount * dFirst
+        dVariance += iCount * max(dSecond - dFirst ** 2, 0.0)
+    return dMean, dVariance
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the analytic null distribution in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''
+Module to implement a binned index of reference intervals, answering overlap queries given in any order
+
+Reference intervals are kept per chromosome in the hierarchical bins of the UCSC browser (and of tabix, see
+intervalio.py): each interval goes in the smallest bin of 16 kb, 128 kb, 1 Mb, 8 Mb, 64 Mb or 512 Mb that holds it.
+A query only looks at the bins that can hold intervals overlapping it, one or two per level for a short query, so
+neither the reference nor the queries need to be sorted and queries can be answered one at a time as they are read.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import sys
+
+try:
+    import intervalio
+except ImportError:
+    print "Cannot find intervalio.py. Ensure file is in working directory, exiting..."
+    sys.exit(1)
+
+
+class BinIndex(object):
+    """ 1-based reference intervals of each chromosome, each with a value, grouped by bin """
+
+    def __init__(self, aIntervals=None):
+        self.hBins = {}
+        self.iCount = 0
+        for aInterval in aIntervals or []:
+            self.add(aInterval)
+
+    def __len__(self):
+        return self.iCount
+
+    def add(self, aInterval, oValue=None):
+        """ Add a 3-column interval, returned with oValue (or the interval itself) by queries it overlaps """
+        strChr, iStart, iStop = aInterval[0], int(aInterval[1]), int(aInterval[2])
+        iBin = intervalio.region_bin(iStart - 1, iStop)
+        self.hBins.setdefault(strChr, {}).setdefault(iBin, []).append(
+            (iStart, iStop, aInterval if oValue is None else oValue))
+        self.iCount += 1
+
+    def overlapping(self, strChr, iStart, iStop):
+        """ Yield (start, stop, value) of each reference interval sharing at least one base with [iStart, iStop] """
+        hChrBins = self.hBins.get(strChr)
+        if not hChrBins:
+            return
+        for iBin in intervalio.region_bins(iStart - 1, iStop):
+            for tEntry in hChrBins.get(iBin, ()):
+                if tEntry[0] <= iStop and tEntry[1] >= iStart:
+                    yield tEntry
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement a binned interval index for "
+          "the coordinateoverlaps.py and recurrentUCEs.py scripts. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -20,6 +20,11 @@ limitations under the License.
 
 import sys
 
+try:
+    import kernels
+except ImportError:
+    kernels = None
+
 def cpartial_overlap(aIntervalA, aIntervalB):
     """
     Returns True if interval A overlaps for at least one bp with interval B, them returns the number of overlapping bp
@@ -58,6 +63,8 @@ def cpoint_checker(iPoint, aInterval):
         return True
 
 def ccollapse(aaIntervals):
+    if kernels and kernels.ENABLED:
+        return kernels.collapse(aaIntervals)
     # Initialize variables
     strChr = iStart = iStop = 0
     aOut = []
@@ -142,6 +149,54 @@ def c_trackuces(aaClusters, aaUCEs):
         aaClustersSizes.append((aCluster, aUCESizes))
     return(aaClustersSizes)
 
+def cluster_hierarchy(aaUCEs, aClusterWidths, hChrEnds):
+    '''Clusters a list of intervals at several cluster widths (kb) at once,
+    returning a dictionary of width to the clusters and associated UCEs that
+    cluster and c_trackuces would give. Neighbouring UCEs share a cluster when
+    the gap between them is at most the cluster width (+1 bp), so clusters at a
+    larger width are merges of the clusters at a smaller width. Each width
+    starts from the clusters of the previous one and only merges those whose
+    gaps it spans.'''
+    aaSorted = sorted(aaUCEs, key=lambda x: (x[0], x[1], x[2]))
+    # Group UCEs by chromosome, keeping the furthest stop reached so far with each
+    aaGroups = []
+    strChr = None
+    for aUCE in aaSorted:
+        strUCEChr, iStart, iStop = str(aUCE[0]), int(aUCE[1]), int(aUCE[2])
+        if strUCEChr != strChr:
+            if hChrEnds.get(strUCEChr) is None:
+                raise Exception("Could not find chromosomes correctly. Ensure that "
+                                "all files are based on the same genome.")
+            strChr = strUCEChr
+            aaGroups.append((strChr, [], []))
+            iMaxStop = iStop
+        iMaxStop = max(iMaxStop, iStop)
+        aaGroups[-1][1].append((iStart, iStop, iMaxStop))
+        # Each UCE starts as its own cluster, as (first, last) indices into the chromosome's UCEs
+        aaGroups[-1][2].append((len(aaGroups[-1][1]) - 1, len(aaGroups[-1][1]) - 1))
+    hClusters = {}
+    for iClusterWidth in sorted(set(aClusterWidths)):
+        # Convert cluster width (given in kb) to bp, divided by 2 to create flanks
+        iFlank = iClusterWidth * 500
+        aaClustersSizes = []
+        for strChr, aUCEs, aRanges in aaGroups:
+            iMaxStop = hChrEnds.get(strChr)
+            # Merge neighbouring clusters of the previous width where their flanks now meet
+            aMerged = [aRanges[0]]
+            for iFirst, iLast in aRanges[1:]:
+                if aUCEs[iFirst][0] - aUCEs[aMerged[-1][1]][2] <= 2 * iFlank + 1:
+                    aMerged[-1] = (aMerged[-1][0], iLast)
+                else:
+                    aMerged.append((iFirst, iLast))
+            aRanges[:] = aMerged
+            for iFirst, iLast in aMerged:
+                aCluster = [strChr, max(aUCEs[iFirst][0] - iFlank, 1), min(aUCEs[iLast][2] + iFlank, iMaxStop)]
+                aUCESizes = [(iStart - aCluster[1], iStop - iStart)
+                             for iStart, iStop, iReached in aUCEs[iFirst:iLast + 1]]
+                aaClustersSizes.append((aCluster, aUCESizes))
+        hClusters[iClusterWidth] = aaClustersSizes
+    return hClusters
+
 if __name__ == "__main__":
     print("This is a module designed to implement the clustering feature in "
           "the randomoverlaps3.py script. It is not meant to be run "
@@ -24,22 +24,29 @@ limitations under the License.
 """
 import argparse
 import sys
+import intervalio
 
 
 def get_args(strInput=False):
     parser = argparse.ArgumentParser(description="Collapses overlapping " +
                                                  "coordinates of a 1-based interval file.")
-    parser.add_argument("file", type=argparse.FileType('rU'),
-                        help="A 3-column interval file")
+    parser.add_argument("file", type=intervalio.input_file,
+                        help="A 3-column interval file, optionally gzip or bgzip-compressed")
+    parser.add_argument("-o", "--output",
+                        help="Write collapsed intervals to this file instead of stdout")
+    parser.add_argument("-z", "--bgzip", action="store_true",
+                        help="bgzip-compress the output file and write a tabix index (.tbi) beside it. Requires -o")
     if strInput:
-        return parser.parse_args(strInput.split())
+        args = parser.parse_args(strInput.split())
     else:
-        return parser.parse_args()
+        args = parser.parse_args()
+    if args.bgzip and not args.output:
+        parser.error("-z/--bgzip requires -o/--output")
+    return args
 
 
-def stdout_writer(aList):
-    for line in aList:
-        print '\t'.join(map(str, line))
+def write_intervals(aList, strOutput=None, bBgzip=False):
+    intervalio.write_intervals(aList, strOutput, bBgzip)
 
 
 def collapse(aIntervals):
@@ -75,4 +82,4 @@ if __name__ == "__main__":
                      [line.strip().split('\t') for line in args.file])
     aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
     aOut = collapse(aIntervals)
-    stdout_writer(aOut)
+    write_intervals(aOut, args.output, args.bgzip)
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 
 """
-Given two 3-column interval files, reports all bases overlapping between sets
+Given two or more 3-column interval files, reports all bases covered by every file, or by at least k of them
 
-Files should be formmatted as: chromosome/contig, start, stop seperated by tabs. Order does not matter, as only
-reciprocal overlaps are reported. Make sure files are both 1-based starts and are collapsed. Overlaps may be missed
-if intervals are not collapsed.
+Files should be formmatted as: chromosome/contig, start, stop seperated by tabs and 1-based. Files sorted by chromosome
+then start (as written by collapsecoordinates.py) are read as they are, after a first pass to check their order. Other
+files, such as those in karyotypic order, and files read from stdin are sorted first by the external sort of
+sumcoordinates.py, holding at most --sort-buffer intervals in memory. Overlapping intervals within a file are merged
+as they are read. The files are swept together in a single pass, merging their interval boundaries with a heap, so
+memory does not depend on file size and regions are printed as soon as they are found. Reported regions are maximal:
+neighbouring covered bases are reported as one region.
+
+With --stream, only the first (reference) file is read into memory, into a binned index (see binindex.py), and the
+intervals of the second file are read in any order, such as from stdin. The bases each one shares with the reference
+are printed as it is read.
 
 Copyright 2017 Harvard University, Wu Lab
 
@@ -23,34 +31,53 @@ limitations under the License.
 
 """
 import argparse
+import heapq
+import sys
+import binindex
+import intervalio
+import sumcoordinates
+
+try:
+    import genomemask
+except ImportError:
+    genomemask = None
 
 
 def get_args(strInput=None):
-    parser = argparse.ArgumentParser("Reports all reciprocally overlapping bases between 2 given interval files. Files "
-                                     "must be collapsed before use")
-    parser.add_argument('A', type=argparse.FileType('rU'),
-                        help="A 3-column interval file")
-    parser.add_argument('B', type=argparse.FileType('rU'),
-                        help="A 3-column interval file")
+    parser = argparse.ArgumentParser("Reports all bases covered by every one (or at least k) of the given interval "
+                                     "files")
+    parser.add_argument('files', type=intervalio.input_file, nargs='+',
+                        help="Two or more 3-column interval files (optionally gzip or bgzip-compressed) or "
+                             "genomemask.py mask files")
+    parser.add_argument('-k', '--min-files', type=int,
+                        help="Report bases covered by at least this many files [default=all files]")
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help="Index the first file and stream the intervals of the second, which need not be sorted "
+                             "and may be - for stdin, printing the bases each shares with the first as it is read. "
+                             "Overlapping query intervals are reported separately")
+    parser.add_argument('-b', '--sort-buffer', type=int, default=1000000,
+                        help="Maximum number of intervals held in memory when sorting a file not sorted by chromosome "
+                             "and start [default=1000000]")
+    parser.add_argument('-o', '--output',
+                        help="Write overlaps to this file instead of stdout")
+    parser.add_argument('-z', '--bgzip', action='store_true',
+                        help="bgzip-compress the output file and write a tabix index (.tbi) beside it. Requires -o")
     if strInput:
         print "Given debug argument string: {0}".format(strInput)
-        return parser.parse_args(strInput.split())
-    return parser.parse_args()
-
-
-def pointCheck(point, interval):
-    """ Returns True if point is within interval
-
-    Arguments:
-    point = integer
-    interval = chromosome/assemby, start, stop with start and stop being integers
-    """
-    assert isinstance(point, int)
-    assert isinstance(interval[1], int)
-    assert isinstance(interval[2], int)
-    if interval[1] <= point <= interval[2]:
-        return True
-    return False
+        args = parser.parse_args(strInput.split())
+    else:
+        args = parser.parse_args()
+    if len(args.files) < 2:
+        parser.error("At least 2 interval files are required")
+    if args.stream and (len(args.files) != 2 or args.min_files is not None or args.bgzip):
+        parser.error("--stream takes exactly 2 files and cannot be used with -k or -z, as its output is unsorted")
+    if args.bgzip and not args.output:
+        parser.error("-z/--bgzip requires -o/--output")
+    if args.min_files is None:
+        args.min_files = len(args.files)
+    elif not 1 <= args.min_files <= len(args.files):
+        parser.error("-k must be between 1 and the number of files ({0})".format(len(args.files)))
+    return args
 
 
 def formatInt(aInterval):
@@ -58,62 +85,122 @@ def formatInt(aInterval):
     return [aInterval[0], int(aInterval[1]), int(aInterval[2])]
 
 
-def intervalCheck(intervalA, intervalB):
-    """Return an interval containing all bases in common between intervalA and intervalB
+def isSorted(strPath):
+    """ True if the interval file at strPath is sorted by chromosome and start, reading it once in constant memory """
+    previous = None
+    with intervalio.open_input(strPath) as fh:
+        for interval in sumcoordinates.parse(fh):
+            if previous is not None and (interval[0], interval[1]) < previous:
+                return False
+            previous = (interval[0], interval[1])
+    return True
+
 
-    Takes an interval in 3-column format: chr, start, stop
+def streamIntervals(fileobj, iBuffer=1000000):
     """
-    chrA, startA, stopA = intervalA
-    chrB, startB, stopB = intervalB
-    if chrA == chrB:
-        overlapChr = chrA
-        # Check if start coordinate of interval A lies within interval B
-        if pointCheck(startA, intervalB):
-            overlapStart = startA
-            if stopA <= stopB:
-                overlapStop = stopA
-            else:
-                overlapStop = stopB
-            return [overlapChr, overlapStart, overlapStop]
-            # If not, check if end coordinate of interval A lies within interval B
-        elif pointCheck(stopA, intervalB):
-            overlapStop = stopA
-            overlapStart = startB
-            return [overlapChr, overlapStart, overlapStop]
-        # If not, check if interval A surrounds interval B
-        elif startA < startB and stopA > stopB:
-            overlapStart, overlapStop = startB, stopB  # Report smaller of the two
-            return [overlapChr, overlapStart, overlapStop]
+    Yield the intervals of a 3-column interval file (or genome mask) sorted by chromosome and start, merging those that
+    overlap or touch. Unsorted files and stdin are sorted with the bounded external sort of sumcoordinates.py
+
+    """
+    if genomemask and genomemask.is_mask(fileobj.name):
+        aIntervals = genomemask.GenomeMask(fileobj.name).intervals()
+        aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
+    elif fileobj is sys.stdin:
+        aIntervals = sumcoordinates.external_sort(sumcoordinates.parse(fileobj), iBuffer)
+    elif isSorted(fileobj.name):
+        aIntervals = sumcoordinates.parse(fileobj)
+    else:
+        sys.stderr.write("{0} is not sorted, sorting...\n".format(fileobj.name))
+        aIntervals = sumcoordinates.external_sort(sumcoordinates.parse(fileobj), iBuffer)
+    return mergeIntervals(aIntervals, fileobj.name)
+
+
+def mergeIntervals(aIntervals, strName):
+    """ Yield sorted intervals, merging those that overlap or touch """
+    current = None
+    for interval in aIntervals:
+        if current is None:
+            current = interval
+        elif interval[0] == current[0] and interval[1] <= current[2] + 1:
+            if interval[1] < current[1]:
+                sys.exit("{0} is not sorted by chromosome and start, exiting...".format(strName))
+            current[2] = max(current[2], interval[2])
         else:
-            return False
-    return False
+            if (interval[0], interval[1]) < (current[0], current[1]):
+                sys.exit("{0} is not sorted by chromosome and start, exiting...".format(strName))
+            yield current
+            current = interval
+    if current is not None:
+        yield current
+
+
+def boundaries(fileobj, iBuffer=1000000):
+    """ Yield (chromosome, position, change in coverage) where each interval of a file starts and ends """
+    for interval in streamIntervals(fileobj, iBuffer):
+        yield interval[0], interval[1], 1
+        yield interval[0], interval[2] + 1, -1
+
+
+def sweep(aFiles, iMinFiles, iBuffer=1000000):
+    """ Yield the maximal regions covered by at least iMinFiles of the interval files """
+    iCovered = 0
+    regionStart = None
+    previous = None
+    # Each file's boundaries are sorted, so merging them gives every boundary in order
+    for strChr, iPos, iChange in heapq.merge(*[boundaries(fileobj, iBuffer) for fileobj in aFiles]):
+        if (strChr, iPos) != previous:
+            # All changes at the previous boundary have been applied
+            if previous is not None:
+                if iCovered >= iMinFiles and regionStart is None:
+                    regionStart = previous
+                elif iCovered < iMinFiles and regionStart is not None:
+                    yield [regionStart[0], regionStart[1], previous[1] - 1]
+                    regionStart = None
+            previous = (strChr, iPos)
+        iCovered += iChange
+    if regionStart is not None:
+        yield [regionStart[0], regionStart[1], previous[1] - 1]
+
+
+def referenceIndex(fileobj):
+    """ Binned index of the merged intervals of an interval file (or genome mask) in any order """
+    if genomemask and genomemask.is_mask(fileobj.name):
+        aIntervals = genomemask.GenomeMask(fileobj.name).intervals()
+    else:
+        aIntervals = [formatInt(line.strip().split('\t')) for line in fileobj if line.strip()]
+    aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
+    return binindex.BinIndex(mergeIntervals(aIntervals, fileobj.name))
+
+
+def streamOverlaps(oIndex, fileobj):
+    """ Yield the bases each interval of a file, in any order, shares with the indexed intervals, as it is read """
+    for line in fileobj:
+        if not line.strip():
+            continue
+        query = formatInt(line.strip().split('\t'))
+        for start, stop, interval in sorted(oIndex.overlapping(*query)):
+            yield [query[0], max(start, query[1]), min(stop, query[2])]
+
+
+def maskOverlaps(strMaskA, strMaskB):
+    """ Return all bases in common between two masks as collapsed intervals, using a bitwise AND """
+    overlaps = []
+    for strChr, iBits, npArBytes in genomemask.combine(genomemask.GenomeMask(strMaskA),
+                                                       genomemask.GenomeMask(strMaskB), "and"):
+        overlaps.extend(genomemask.unpack_intervals(strChr, iBits, npArBytes))
+    return overlaps
 
 
 def main(args):
-    fileA = [formatInt(line.strip().split('\t')) for line in args.A]
-    fileA.sort(key=lambda x: (x[0], x[1], x[2]))
-    fileB = [formatInt(line.strip().split('\t')) for line in args.B]
-    fileB.sort(key=lambda x: (x[0], x[1], x[2]))
-    overlaps = []
-    for intervalB in fileB:
-        for intervalA in fileA:
-            if intervalB[0] != intervalA[0]:  # Check chromosome is the same for both intervals
-                continue
-            elif intervalB[1] > intervalA[2]:  # Don't check against intervalA if stop is less than intervalB start
-                continue
-            overlap = intervalCheck(intervalB, intervalA)
-            if overlap:  # If overlap found, append and check next intervalB
-                overlaps.append(overlap)
-                continue
-            elif intervalB[2] < intervalA[1]:  # Don't check against intervalA if intervalB ends before intervalA starts
-                break
-            else:
-                break
-    return overlaps
+    if args.stream:
+        return streamOverlaps(referenceIndex(args.files[0]), args.files[1])
+    if len(args.files) == args.min_files == 2 and genomemask and \
+            all([genomemask.is_mask(fileobj.name) for fileobj in args.files]):
+        return maskOverlaps(args.files[0].name, args.files[1].name)
+    return sweep(args.files, args.min_files, args.sort_buffer)
 
 
 if __name__ == '__main__':
     args = get_args()
     overlaps = main(args)
-    for line in overlaps:
-        print "\t".join(map(str, line))
+    intervalio.write_intervals(overlaps, args.output, args.bgzip)
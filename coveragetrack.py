@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+'''
+Module to implement the union coverage scoring mode in randomoverlaps.py
+
+The against set is collapsed per chromosome and stored as sorted start and stop arrays together with the cumulative
+covered length, so the number of covered bases inside any query interval is found with two binary searches and a
+subtraction. The track is built once per against file and reused for every iteration.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import sys
+import numpy as np
+
+
+def collapse_arrays(npArStarts, npArStops):
+    """
+    Collapse overlapping or adjacent intervals on a single chromosome. Inputs must be sorted by start, and the
+    collapsed starts and stops are returned as two new arrays
+
+    """
+    if len(npArStarts) == 0:
+        return npArStarts, npArStops
+    # Running maximum stop so that intervals nested inside an earlier one never end a block early
+    npArRunningStops = np.maximum.accumulate(npArStops)
+    # A new block starts wherever the start lies beyond the running stop of the previous interval (+1 for adjacency)
+    abNewBlock = np.empty(len(npArStarts), dtype=bool)
+    abNewBlock[0] = True
+    abNewBlock[1:] = npArStarts[1:] > (npArRunningStops[:-1] + 1)
+    aiBlockStarts = np.flatnonzero(abNewBlock)
+    aiBlockEnds = np.append(aiBlockStarts[1:] - 1, len(npArStarts) - 1)
+    return npArStarts[aiBlockStarts], npArRunningStops[aiBlockEnds]
+
+
+class CoverageTrack(object):
+    """ Per-chromosome collapsed intervals with prefix sums of covered length """
+
+    def __init__(self, aaIntervals):
+        self.hStarts = {}
+        self.hStops = {}
+        self.hCumulative = {}
+        hGrouped = {}
+        for aInterval in aaIntervals:
+            hGrouped.setdefault(aInterval[0], []).append((aInterval[1], aInterval[2]))
+        for strChr, aCoords in hGrouped.items():
+            aCoords.sort()
+            npArCoords = np.array(aCoords, dtype=np.int64)
+            npArStarts, npArStops = collapse_arrays(npArCoords[:, 0], npArCoords[:, 1])
+            self.add_chromosome(strChr, npArStarts, npArStops)
+
+    def add_chromosome(self, strChr, npArStarts, npArStops):
+        """ Store already collapsed, sorted intervals for one chromosome """
+        # Index 0 is padding so that a binary search result of i refers to interval i - 1
+        self.hStarts[strChr] = npArStarts
+        self.hStops[strChr] = np.concatenate(([0], npArStops)).astype(np.int64)
+        self.hCumulative[strChr] = np.concatenate(([0], np.cumsum(npArStops - npArStarts + 1))).astype(np.int64)
+
+    def bounds(self, strChr):
+        """ Collapsed starts and stops on one chromosome """
+        if strChr not in self.hStarts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return self.hStarts[strChr], self.hStops[strChr][1:]
+
+    def coverage(self):
+        """ Total number of bases covered by the track """
+        return sum([int(npArCum[-1]) for npArCum in self.hCumulative.values()])
+
+    def covered_to(self, strChr, npArPoints):
+        """ Number of covered bases at or before each point on the given chromosome """
+        npArPoints = np.asarray(npArPoints, dtype=np.int64)
+        if strChr not in self.hStarts:
+            return np.zeros(npArPoints.shape, dtype=np.int64)
+        aiIndex = np.searchsorted(self.hStarts[strChr], npArPoints, side='right')
+        # Remove the part of the last interval that lies beyond the point
+        npArExcess = np.clip(self.hStops[strChr][aiIndex] - npArPoints, 0, None)
+        return self.hCumulative[strChr][aiIndex] - npArExcess
+
+    def covered(self, strChr, npArStarts, npArStops):
+        """ Number of covered bases inside each 1-based, inclusive query interval on the given chromosome """
+        return self.covered_to(strChr, npArStops) - self.covered_to(strChr, np.asarray(npArStarts) - 1)
+
+    def covered_each(self, npArChr, npArStarts, npArStops):
+        """ Number of covered bases inside each placed interval, given as arrays of chromosomes, starts and stops """
+        npArChr = np.asarray(npArChr)
+        npArStarts = np.asarray(npArStarts, dtype=np.int64)
+        npArStops = np.asarray(npArStops, dtype=np.int64)
+        npArCovered = np.zeros(npArStarts.shape, dtype=np.int64)
+        for strChr in np.unique(npArChr):
+            abMask = npArChr == strChr
+            npArCovered[abMask] = self.covered(strChr, npArStarts[abMask], npArStops[abMask])
+        return npArCovered
+
+    def batch_overlap(self, npArChr, npArStarts, npArStops):
+        """
+        Score many placement sets at once. Each argument is an array with one row per iteration and one column per
+        placed interval. Returns arrays with the number of overlapping intervals and total bp overlap for each row
+
+        """
+        npArCovered = np.atleast_2d(self.covered_each(npArChr, npArStarts, npArStops))
+        return (npArCovered > 0).sum(axis=1), npArCovered.sum(axis=1)
+
+    def overlap(self, aaIntervals):
+        """ Return the number of intervals overlapping the track and their total bp overlap """
+        if not aaIntervals:
+            return 0, 0
+        aCounts, aBP = self.batch_overlap(*to_arrays([aaIntervals]))
+        return int(aCounts[0]), int(aBP[0])
+
+    def distribution(self, aaaPlacements):
+        """ Score a list of placement sets in one vectorized call, returning [count, bp] for each set """
+        aCounts, aBP = self.batch_overlap(*to_arrays(aaaPlacements))
+        return [[int(iCount), int(iBP)] for iCount, iBP in zip(aCounts, aBP)]
+
+
+def to_arrays(aaaPlacements):
+    """ Convert a list of equally sized lists of 3-column intervals into chromosome, start and stop arrays """
+    npArChr = np.array([[aInterval[0] for aInterval in aaPlacement] for aaPlacement in aaaPlacements])
+    npArStarts = np.array([[aInterval[1] for aInterval in aaPlacement] for aaPlacement in aaaPlacements],
+                          dtype=np.int64)
+    npArStops = np.array([[aInterval[2] for aInterval in aaPlacement] for aaPlacement in aaaPlacements],
+                         dtype=np.int64)
+    return npArChr, npArStarts, npArStops
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the union coverage scoring mode in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
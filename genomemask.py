@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Compiles a 1-based, 3-column interval file into a memory-mapped, bit-packed genome mask, and combines or queries
+existing masks.
+
+Each chromosome is stored as one bit per base (bit i is base i, bit 0 is unused), followed by a rank directory holding
+the number of set bits before every 512-base block. Point queries read a single byte and range queries read one rank
+entry plus at most 64 bytes at each end, so both are constant time. Masks are opened read-only with numpy.memmap, so
+any number of processes can share the same mask through the page cache without copying it.
+
+Mask files can be given to randomoverlaps.py, coordinateoverlaps.py and sumcoordinates.py in place of interval files.
+
+Requirement: numpy
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import numpy as np
+import coveragetrack
+import intervalio
+
+MAGIC = "UCEMASK1"
+BLOCK_BYTES = 64  # Rank directory stores one cumulative count per 512 bases
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def get_args(strInput=None):
+    parser = argparse.ArgumentParser(description="Builds, combines and queries memory-mapped genome masks made from "
+                                                 "1-based interval files.")
+    subparsers = parser.add_subparsers(dest="command")
+    build = subparsers.add_parser("build", help="Compile a 3-column interval file into a mask")
+    build.add_argument("file", type=intervalio.input_file,
+                       help="A 3-column interval file")
+    build.add_argument("-o", "--output", required=True,
+                       help="The mask file to write")
+    build.add_argument("-s", "--sizes", type=intervalio.input_file,
+                       help="Chromosome sizes file (chr, size), otherwise each chromosome ends at its last interval")
+    for strOp in ("and", "or", "andnot"):
+        combine = subparsers.add_parser(strOp, help="Write the {0} of two masks to a new mask".format(strOp.upper()))
+        combine.add_argument("A", help="A mask file")
+        combine.add_argument("B", help="A mask file")
+        combine.add_argument("-o", "--output", required=True,
+                             help="The mask file to write")
+    query = subparsers.add_parser("query", help="Print the number of masked bases in one or more regions")
+    query.add_argument("mask", help="A mask file")
+    query.add_argument("region", nargs='+',
+                       help="Regions as chr:start-stop (1-based, inclusive) or chr:position")
+    intervals = subparsers.add_parser("intervals", help="Print the mask as collapsed 3-column intervals")
+    intervals.add_argument("mask", help="A mask file")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+def is_mask(strPath):
+    """ Returns True if the given path is a genome mask file """
+    if not os.path.isfile(strPath):
+        return False
+    with open(strPath, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def rank_directory(npArBytes):
+    """ Cumulative number of set bits before each block of BLOCK_BYTES bytes """
+    iBlocks = (len(npArBytes) + BLOCK_BYTES - 1) // BLOCK_BYTES
+    npArPadded = np.zeros(iBlocks * BLOCK_BYTES, dtype=np.uint8)
+    npArPadded[:len(npArBytes)] = npArBytes
+    npArBlockCounts = POPCOUNT.astype(np.uint8)[npArPadded].reshape(iBlocks, BLOCK_BYTES).sum(axis=1, dtype=np.int64)
+    return np.concatenate(([0], np.cumsum(npArBlockCounts)[:-1])).astype(np.uint64)
+
+
+def pack_intervals(npArStarts, npArStops, iLength):
+    """ Bit-pack one chromosome's intervals (sorted by start) into bytes covering bases 0 to iLength """
+    npArStarts, npArStops = coveragetrack.collapse_arrays(npArStarts, npArStops)
+    npArStarts = np.asarray(npArStarts, dtype=np.int64)
+    npArStops = np.asarray(npArStops, dtype=np.int64)
+    iBytes = (iLength + 8) // 8
+    aiFirst = npArStarts >> 3
+    aiLast = npArStops >> 3
+    # Bytes wholly inside an interval are filled from a difference array over bytes rather than bases. Collapsed
+    # intervals never share a whole byte, so int8 is enough
+    npArDiff = np.zeros(iBytes + 1, dtype=np.int8)
+    np.add.at(npArDiff, aiFirst + 1, 1)
+    np.add.at(npArDiff, np.maximum(aiLast, aiFirst + 1), -1)
+    npArPacked = np.cumsum(npArDiff[:iBytes], dtype=np.int8).astype(np.uint8) * np.uint8(0xFF)
+    # The partial bytes at each end may be shared with a neighbouring interval, so they are ORed in
+    npArHead = (0xFF >> (npArStarts & 7)).astype(np.uint8)
+    npArTail = ((0xFF00 >> ((npArStops & 7) + 1)) & 0xFF).astype(np.uint8)
+    abSame = aiFirst == aiLast
+    npArHead[abSame] &= npArTail[abSame]
+    np.bitwise_or.at(npArPacked, aiFirst, npArHead)
+    np.bitwise_or.at(npArPacked, aiLast[~abSame], npArTail[~abSame])
+    return npArPacked
+
+
+def unpack_bounds(iBits, npArBytes):
+    """ Collapsed starts and stops of the set bits in one chromosome's packed bytes """
+    npArBits = np.unpackbits(npArBytes)[:iBits + 1].astype(np.int8)
+    npArEdges = np.diff(np.concatenate(([0], npArBits, [0])))
+    return np.flatnonzero(npArEdges == 1), np.flatnonzero(npArEdges == -1) - 1
+
+
+def unpack_intervals(strChr, iBits, npArBytes):
+    """ Collapsed 1-based intervals of the set bits in one chromosome's packed bytes """
+    aiStarts, aiStops = unpack_bounds(iBits, npArBytes)
+    return [[strChr, int(iStart), int(iStop)] for iStart, iStop in zip(aiStarts, aiStops)]
+
+
+def write_mask(strPath, aChromosomes):
+    """
+    Write a mask file from a list of (chr, number of bases, packed bytes) tuples. The header lists the byte offset of
+    each chromosome's bits and rank directory so they can be memory-mapped directly
+
+    """
+    aEntries = []
+    aBlobs = []
+    iOffset = 0
+    for strChr, iBits, npArBytes in aChromosomes:
+        npArRanks = rank_directory(npArBytes)
+        aEntries.append([strChr, int(iBits), iOffset, len(npArBytes), iOffset + pad8(len(npArBytes)),
+                         len(npArRanks)])
+        aBlobs.append((npArBytes, npArRanks))
+        iOffset += pad8(len(npArBytes)) + npArRanks.nbytes
+    strHeader = json.dumps({"chromosomes": aEntries})
+    strHeader += " " * (pad8(len(MAGIC) + 8 + len(strHeader)) - (len(MAGIC) + 8 + len(strHeader)))
+    with open(strPath, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack("<Q", len(strHeader)))
+        fh.write(strHeader)
+        for npArBytes, npArRanks in aBlobs:
+            fh.write(npArBytes.tobytes())
+            fh.write("\0" * (pad8(len(npArBytes)) - len(npArBytes)))
+            fh.write(npArRanks.astype("<u8").tobytes())
+
+
+def pad8(iLength):
+    return (iLength + 7) // 8 * 8
+
+
+class GenomeMask(coveragetrack.CoverageTrack):
+    """
+    Read-only, memory-mapped genome mask. Shares the scoring methods of CoverageTrack, so a mask can be used for union
+    coverage scoring in randomoverlaps.py
+
+    """
+
+    def __init__(self, strPath):
+        self.name = strPath
+        with open(strPath, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise Exception("{0} is not a genome mask file".format(strPath))
+            iHeaderLen = struct.unpack("<Q", fh.read(8))[0]
+            hHeader = json.loads(fh.read(iHeaderLen))
+        iDataStart = len(MAGIC) + 8 + iHeaderLen
+        self.aChromosomes = []
+        self.hBits = {}
+        self.hBytes = {}
+        self.hRanks = {}
+        for strChr, iBits, iByteOffset, iBytes, iRankOffset, iRanks in hHeader["chromosomes"]:
+            strChr = str(strChr)
+            self.aChromosomes.append(strChr)
+            self.hBits[strChr] = iBits
+            self.hBytes[strChr] = np.memmap(strPath, dtype=np.uint8, mode='r', offset=iDataStart + iByteOffset,
+                                            shape=(iBytes,))
+            self.hRanks[strChr] = np.memmap(strPath, dtype="<u8", mode='r', offset=iDataStart + iRankOffset,
+                                            shape=(iRanks,))
+
+    def point(self, strChr, iPos):
+        """ Returns True if the given base is set """
+        if strChr not in self.hBytes or not 0 <= iPos <= self.hBits[strChr]:
+            return False
+        return bool(self.hBytes[strChr][iPos >> 3] & (0x80 >> (iPos & 7)))
+
+    def rank(self, strChr, npArPoints):
+        """ Number of set bases at or before each point """
+        npArPoints = np.asarray(npArPoints, dtype=np.int64)
+        if strChr not in self.hBytes:
+            return np.zeros(npArPoints.shape, dtype=np.int64)
+        npArBytes = self.hBytes[strChr]
+        abBefore = npArPoints < 0
+        npArPoints = np.clip(npArPoints, 0, self.hBits[strChr])
+        aiByte = npArPoints >> 3
+        aiBlock = aiByte // BLOCK_BYTES
+        npArRank = self.hRanks[strChr][aiBlock].astype(np.int64)
+        # Whole bytes between the block start and the point's byte, one byte position at a time so memory stays in
+        # proportion to the number of points
+        aiOffset = aiBlock * BLOCK_BYTES
+        for i in range(int((aiByte - aiOffset).max()) if aiByte.size else 0):
+            abWhole = aiOffset < aiByte
+            npArRank += POPCOUNT[npArBytes[np.where(abWhole, aiOffset, 0)]] * abWhole
+            aiOffset += 1
+        # Bits of the point's own byte up to and including the point
+        npArLast = npArBytes[aiByte] & ((0xFF00 >> ((npArPoints & 7) + 1)) & 0xFF)
+        npArRank += POPCOUNT[npArLast]
+        return np.where(abBefore, 0, npArRank)
+
+    def covered(self, strChr, npArStarts, npArStops):
+        """ Number of set bases inside each 1-based, inclusive interval """
+        return self.rank(strChr, npArStops) - self.rank(strChr, np.asarray(npArStarts) - 1)
+
+    def coverage(self, strChr=None):
+        """ Total number of set bases, for one chromosome or the whole mask """
+        aChromosomes = [strChr] if strChr else self.aChromosomes
+        return sum([int(self.rank(strChr, self.hBits[strChr])) for strChr in aChromosomes])
+
+    def bounds(self, strChr):
+        """ Collapsed starts and stops on one chromosome """
+        if strChr not in self.hBytes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return unpack_bounds(self.hBits[strChr], self.hBytes[strChr])
+
+    def chromosome_intervals(self, strChr):
+        """ Collapsed 1-based intervals of the set bases on one chromosome """
+        return unpack_intervals(strChr, self.hBits[strChr], self.hBytes[strChr])
+
+    def intervals(self):
+        """ Collapsed 1-based intervals of the whole mask, sorted by chr, start """
+        aaIntervals = []
+        for strChr in sorted(self.aChromosomes):
+            aaIntervals.extend(self.chromosome_intervals(strChr))
+        return aaIntervals
+
+
+def build(aaIntervals, hSizes=None):
+    """ Pack a list of 3-column intervals into (chr, bases, bytes) tuples ready for write_mask """
+    hGrouped = {}
+    for aInterval in aaIntervals:
+        hGrouped.setdefault(aInterval[0], []).append((aInterval[1], aInterval[2]))
+    aChromosomes = []
+    for strChr in sorted(set(hGrouped) | set(hSizes or {})):
+        npArCoords = np.array(sorted(hGrouped.get(strChr, [])), dtype=np.int64).reshape(-1, 2)
+        iLength = int(npArCoords[:, 1].max()) if len(npArCoords) else 0
+        if hSizes and strChr in hSizes:
+            if iLength > hSizes[strChr]:
+                raise Exception("Intervals on {0} extend beyond the chromosome size".format(strChr))
+            iLength = hSizes[strChr]
+        aChromosomes.append((strChr, iLength, pack_intervals(npArCoords[:, 0], npArCoords[:, 1], iLength)))
+    return aChromosomes
+
+
+def combine(oMaskA, oMaskB, strOp):
+    """ Combine two masks base by base with and, or or andnot, returning (chr, bases, bytes) tuples """
+    aChromosomes = []
+    for strChr in sorted(set(oMaskA.aChromosomes) | set(oMaskB.aChromosomes)):
+        iBits = max(oMaskA.hBits.get(strChr, 0), oMaskB.hBits.get(strChr, 0))
+        iBytes = (iBits + 8) // 8
+        npArA = np.zeros(iBytes, dtype=np.uint8)
+        npArB = np.zeros(iBytes, dtype=np.uint8)
+        if strChr in oMaskA.hBytes:
+            npArA[:len(oMaskA.hBytes[strChr])] = oMaskA.hBytes[strChr]
+        if strChr in oMaskB.hBytes:
+            npArB[:len(oMaskB.hBytes[strChr])] = oMaskB.hBytes[strChr]
+        if strOp == "and":
+            npArOut = np.bitwise_and(npArA, npArB)
+        elif strOp == "or":
+            npArOut = np.bitwise_or(npArA, npArB)
+        elif strOp == "andnot":
+            npArOut = np.bitwise_and(npArA, np.invert(npArB))
+        else:
+            raise Exception("Unknown mask operation: {0}".format(strOp))
+        aChromosomes.append((strChr, iBits, npArOut))
+    return aChromosomes
+
+
+def read_intervals(fileobj):
+    """ Read an interval file, or the collapsed intervals of a mask if a mask file was given """
+    if is_mask(fileobj.name):
+        return GenomeMask(fileobj.name).intervals()
+    return [[line[0], int(line[1]), int(line[2])] for line in
+            [strLine.strip().split("\t") for strLine in fileobj if strLine.strip()]]
+
+
+def parse_region(strRegion):
+    strChr, strCoords = strRegion.rsplit(":", 1)
+    if "-" in strCoords:
+        strStart, strStop = strCoords.split("-")
+    else:
+        strStart = strStop = strCoords
+    return strChr, int(strStart.replace(",", "")), int(strStop.replace(",", ""))
+
+
+def main(args):
+    if args.command == "build":
+        hSizes = None
+        if args.sizes:
+            hSizes = dict([(line[0], int(line[1])) for line in
+                           [strLine.strip().split("\t") for strLine in args.sizes if strLine.strip()]])
+        sys.stderr.write("Building mask...\n")
+        write_mask(args.output, build(read_intervals(args.file), hSizes))
+    elif args.command in ("and", "or", "andnot"):
+        write_mask(args.output, combine(GenomeMask(args.A), GenomeMask(args.B), args.command))
+    elif args.command == "query":
+        oMask = GenomeMask(args.mask)
+        for strRegion in args.region:
+            strChr, iStart, iStop = parse_region(strRegion)
+            print "{0}\t{1}\t{2}\t{3}".format(strChr, iStart, iStop, int(oMask.covered(strChr, iStart, iStop)))
+    elif args.command == "intervals":
+        oMask = GenomeMask(args.mask)
+        for strChr in sorted(oMask.aChromosomes):
+            for aInterval in oMask.chromosome_intervals(strChr):
+                print "\t".join(map(str, aInterval))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
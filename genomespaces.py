@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Builds the genome spaces used by randomoverlaps_driver.py in a single pass over a genome FASTA (or .2bit) file and a
+gene annotation file:
+
+<genome>.genomic.coordinates.nonN   -- all stretches without Ns
+intergenic.boundaries.nonN          -- stretches without Ns outside any gene
+intronic.boundaries.nonN            -- stretches without Ns inside genes but outside any exon
+exonic.boundaries.nonN              -- stretches without Ns inside exons
+
+With --nonrep, the same four spaces are also written with repeat-masked (lower-case) bases removed, in files ending in
+.nonrep instead of .nonN. The FASTA must have one entry per chromosome (as nonNcoordinates.py -g). Each chromosome is
+read once and all spaces are derived from its N runs by interval arithmetic, so no intermediate files are written or
+reparsed. Outputs are collapsed 1-based interval files, or genomemask.py masks with --mask (which randomoverlaps.py
+reads in place of interval files).
+
+The annotation may be a GTF/GFF file, whose exon features give the exons and whose gene, transcript or mRNA features
+give the gene bodies (the span of each transcript's exons is used if there are none), or a UCSC genePred table such as
+refGene or knownGene, with or without the leading bin column.
+
+Requirement: numpy
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import os
+import re
+import sys
+import numpy as np
+import coveragetrack
+import intervalio
+
+try:
+    import indexedsequence
+except ImportError:
+    indexedsequence = None
+
+try:
+    import genomemask
+except ImportError:
+    genomemask = None
+
+SPACES = ("genomic", "intergenic", "intronic", "exonic")
+GENE_FEATURES = ("gene", "transcript", "mRNA")
+REPMASKED_BASES = np.frombuffer("acgt", dtype=np.uint8)
+
+
+def get_args(strInput=None):
+    parser = argparse.ArgumentParser(description="Builds the genomic, intergenic, intronic and exonic genome spaces "
+                                                 "used by randomoverlaps_driver.py from a genome FASTA and a gene "
+                                                 "annotation in one pass.")
+    parser.add_argument("fasta",
+                        help="Genome FASTA file with one entry per chromosome, optionally bgzip-compressed, or a .2bit "
+                             "file")
+    parser.add_argument("annotation", type=intervalio.input_file,
+                        help="Gene annotation as GTF/GFF or a UCSC genePred table (e.g. refGene.txt)")
+    parser.add_argument("-g", "--genome", default="hg18",
+                        help="Genome name used for the genomic space file name [default=hg18]")
+    parser.add_argument("-o", "--outdir", default=".",
+                        help="Directory to write the spaces to [default=current directory]")
+    parser.add_argument("-n", "--nonrep", action="store_true",
+                        help="Also write each space with repeat-masked (lower-case) bases removed")
+    parser.add_argument("-m", "--mask", action="store_true",
+                        help="Write genomemask.py masks instead of interval files")
+    parser.add_argument("-c", "--chromosomes", nargs="+",
+                        help="Only build the spaces on these chromosomes")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+def space_name(strSpace, strGenome, bNonrep):
+    """ File name the driver expects for a space """
+    strSuffix = "nonrep" if bNonrep else "nonN"
+    if strSpace == "genomic":
+        return "{0}.genomic.coordinates.{1}".format(strGenome, strSuffix)
+    return "{0}.boundaries.{1}".format(strSpace, strSuffix)
+
+
+def gtf_attribute(strAttributes, strKey):
+    oMatch = re.search(r'(?:^|;)\s*' + strKey + r'[ =]"?([^";]+)"?', strAttributes)
+    return oMatch.group(1) if oMatch else None
+
+
+def read_annotation(fileobj):
+    """
+    Return exon and gene body intervals (1-based, closed) grouped by chromosome, as {chr: [(start, stop), ...]}
+    dictionaries
+
+    """
+    hExons = {}
+    hGenes = {}
+    hTranscripts = {}
+    for line in fileobj:
+        if not line.strip() or line.startswith(("#", "track", "browser")):
+            continue
+        aLine = line.rstrip("\n").split("\t")
+        if len(aLine) >= 9 and aLine[3].isdigit() and aLine[4].isdigit() and aLine[6] in ("+", "-", "."):
+            # GTF/GFF: 1-based, closed coordinates
+            strChr, strFeature, iStart, iStop = aLine[0], aLine[2], int(aLine[3]), int(aLine[4])
+            if strFeature == "exon":
+                hExons.setdefault(strChr, []).append((iStart, iStop))
+                strTranscript = gtf_attribute(aLine[8], "transcript_id") or gtf_attribute(aLine[8], "Parent")
+                if strTranscript:
+                    tSpan = hTranscripts.get((strChr, strTranscript), (iStart, iStop))
+                    hTranscripts[(strChr, strTranscript)] = (min(tSpan[0], iStart), max(tSpan[1], iStop))
+            elif strFeature in GENE_FEATURES:
+                hGenes.setdefault(strChr, []).append((iStart, iStop))
+            continue
+        # genePred: name, chrom, strand, txStart, txEnd, cdsStart, cdsEnd, exonCount, exonStarts, exonEnds, with
+        # 0-based starts and an optional leading bin column
+        aiStrand = [i for i in (2, 3) if i < len(aLine) and aLine[i] in ("+", "-")]
+        if not aiStrand or len(aLine) < aiStrand[0] + 8:
+            print "Could not parse annotation line: {0}".format(line.strip())
+            sys.exit(1)
+        i = aiStrand[0]
+        strChr = aLine[i - 1]
+        hGenes.setdefault(strChr, []).append((int(aLine[i + 1]) + 1, int(aLine[i + 2])))
+        aStarts = [int(strCoord) for strCoord in aLine[i + 6].split(",") if strCoord]
+        aStops = [int(strCoord) for strCoord in aLine[i + 7].split(",") if strCoord]
+        hExons.setdefault(strChr, []).extend([(iStart + 1, iStop) for iStart, iStop in zip(aStarts, aStops)])
+    if not hGenes:
+        # No gene or transcript features, so use the span of each transcript's exons
+        for (strChr, strTranscript), tSpan in hTranscripts.items():
+            hGenes.setdefault(strChr, []).append(tSpan)
+    return hExons, hGenes
+
+
+def to_arrays(aIntervals, iLength):
+    """ Collapsed starts and stops of a list of (start, stop) pairs, clipped to the chromosome """
+    npArCoords = np.array(sorted(aIntervals), dtype=np.int64).reshape(-1, 2)
+    npArStarts = np.maximum(npArCoords[:, 0], 1)
+    npArStops = np.minimum(npArCoords[:, 1], iLength)
+    abKeep = npArStops >= npArStarts
+    return coveragetrack.collapse_arrays(npArStarts[abKeep], npArStops[abKeep])
+
+
+def combine(tA, tB, strOp):
+    """ "and" or "andnot" of two collapsed (starts, stops) interval sets on one chromosome, collapsed """
+    npArAStarts, npArAStops = tA
+    npArBStarts, npArBStops = tB
+    # Half-open pieces between every interval edge, each wholly inside or outside each set
+    npArBreaks = np.unique(np.concatenate((npArAStarts, npArAStops + 1, npArBStarts, npArBStops + 1)))
+    npArPieces = npArBreaks[:-1]
+    abInA = np.searchsorted(npArAStarts, npArPieces, side="right") > np.searchsorted(npArAStops + 1, npArPieces,
+                                                                                     side="right")
+    abInB = np.searchsorted(npArBStarts, npArPieces, side="right") > np.searchsorted(npArBStops + 1, npArPieces,
+                                                                                     side="right")
+    if strOp == "and":
+        abKeep = abInA & abInB
+    else:
+        abKeep = abInA & ~abInB
+    return coveragetrack.collapse_arrays(npArPieces[abKeep], npArBreaks[1:][abKeep] - 1)
+
+
+def sequence_runs(strSeq, bNonrep):
+    """ Collapsed 1-based starts and stops of the stretches without Ns, as nonNcoordinates.py finds them """
+    npArBases = np.frombuffer(strSeq, dtype=np.uint8)
+    abKeep = (npArBases != ord("N")) & (npArBases != ord("n"))
+    if bNonrep:
+        abKeep &= ~np.in1d(npArBases, REPMASKED_BASES)
+    npArEdges = np.diff(np.concatenate(([0], abKeep.astype(np.int8), [0])))
+    return np.flatnonzero(npArEdges == 1) + 1, np.flatnonzero(npArEdges == -1)
+
+
+def chromosome_runs(strPath):
+    """ Yield (chr, length, runs without Ns, runs without Ns or repeat-masked bases) for each genome entry """
+    if indexedsequence and indexedsequence.file_format(strPath) == "2bit":
+        oTwoBit = indexedsequence.TwoBitFile(strPath)
+        for strChr in oTwoBit.names():
+            iLength = oTwoBit.blocks(strChr)[0]
+            aRuns = [np.array(aCoords, dtype=np.int64).reshape(-1, 2) for aCoords in
+                     (oTwoBit.runs(strChr, False), oTwoBit.runs(strChr, True))]
+            yield strChr, int(iLength), (aRuns[0][:, 0], aRuns[0][:, 1]), (aRuns[1][:, 0], aRuns[1][:, 1])
+        return
+    for strChr, strSeq in fasta_entries(strPath):
+        yield strChr, len(strSeq), sequence_runs(strSeq, False), sequence_runs(strSeq, True)
+
+
+def fasta_entries(strPath):
+    """ Yield (name, sequence) for each entry of a FASTA file, reading it once """
+    fh = intervalio.open_input(strPath)
+    strName = None
+    aLines = []
+    for line in fh:
+        if line.startswith(">"):
+            if strName is not None:
+                yield strName, "".join(aLines)
+            strName = line[1:].split()[0]
+            aLines = []
+        else:
+            aLines.append(line.strip())
+    if strName is not None:
+        yield strName, "".join(aLines)
+    fh.close()
+
+
+def chromosome_spaces(tRuns, tExons, tGenes):
+    """ The four spaces on one chromosome, from its runs without Ns and its collapsed exons and gene bodies """
+    return {"genomic": tRuns,
+            "intergenic": combine(tRuns, tGenes, "andnot"),
+            "intronic": combine(combine(tRuns, tGenes, "and"), tExons, "andnot"),
+            "exonic": combine(tRuns, tExons, "and")}
+
+
+def main(args):
+    if args.mask and genomemask is None:
+        print "Cannot find genomemask.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    hExons, hGenes = read_annotation(args.annotation)
+    aVariants = [False, True] if args.nonrep else [False]
+    # Spaces of each chromosome, keyed by (space, nonrep)
+    hSpaces = dict([((strSpace, bNonrep), []) for strSpace in SPACES for bNonrep in aVariants])
+    for strChr, iLength, tRuns, tNonrepRuns in chromosome_runs(args.fasta):
+        if args.chromosomes and strChr not in args.chromosomes:
+            continue
+        sys.stderr.write("Building spaces on {0}...\n".format(strChr))
+        tExons = to_arrays(hExons.get(strChr, []), iLength)
+        tGenes = to_arrays(hGenes.get(strChr, []) + hExons.get(strChr, []), iLength)
+        for bNonrep in aVariants:
+            hChrSpaces = chromosome_spaces(tNonrepRuns if bNonrep else tRuns, tExons, tGenes)
+            for strSpace in SPACES:
+                hSpaces[(strSpace, bNonrep)].append((strChr, iLength, hChrSpaces[strSpace]))
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    for (strSpace, bNonrep), aChromosomes in sorted(hSpaces.items()):
+        strPath = os.path.join(args.outdir, space_name(strSpace, args.genome, bNonrep))
+        aChromosomes.sort()
+        if args.mask:
+            genomemask.write_mask(strPath, [(strChr, iLength, genomemask.pack_intervals(npArStarts, npArStops,
+                                                                                        iLength))
+                                            for strChr, iLength, (npArStarts, npArStops) in aChromosomes])
+        else:
+            with open(strPath, "w") as out:
+                for strChr, iLength, (npArStarts, npArStops) in aChromosomes:
+                    for iStart, iStop in zip(npArStarts, npArStops):
+                        out.write("{0}\t{1}\t{2}\n".format(strChr, iStart, iStop))
+        iCoverage = sum([int((npArStops - npArStarts + 1).sum()) for strChr, iLength, (npArStarts, npArStops) in
+                         aChromosomes])
+        print "Wrote {0} ({1} bp)".format(strPath, iCoverage)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+'''
+Module to implement the importance-sampling tail estimator in randomoverlaps.py
+
+For a UCE of a given length, the bp overlap f(x) of an interval placed at start x is piecewise linear in x (see
+analyticnull.py). The proposal tilts the null placement of each UCE exponentially in its overlap, q(x) = p(x) e^(theta
+f(x)) / M(theta), where M(theta) is the null mean of e^(theta f). Because f is linear on each piece, the tilted mass of
+a piece and the tilted draw of a start inside it both have closed forms (a truncated geometric distribution). Theta is
+chosen so the expected total overlap under the proposal equals the observed overlap, so random sets land near it, and
+each set is reweighted by the product over UCEs of M(theta) e^(-theta f). Within the tail the weights are bounded by
+the value at the observed overlap, which keeps the effective sample size high however extreme the tail is. Sets whose
+members overlap are rejected as in norm_distribution, so the estimate is self-normalized.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import logging
+import math
+import sys
+import numpy as np
+import analyticnull
+
+CHROMOSOME_SPAN = 2 ** 40  # Larger than any chromosome, used to give each chromosome its own coordinate range
+THETA_LIMIT = 2.0  # Tilts beyond this per bp put all the proposal mass on the extreme pieces
+
+
+def log_geometric_sum(npArN, npArA):
+    """ log of the sum of e^(a t) over t = 0 .. n - 1 """
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        npArSum = np.log(np.expm1(npArA * npArN) / np.expm1(npArA))
+        # For large positive a the ratio overflows, but it is then e^(a (n - 1)) to double precision
+        npArSum = np.where(np.isfinite(npArSum), npArSum, npArA * (npArN - 1))
+    return np.where(np.abs(npArA) < 1e-12, np.log(npArN), npArSum)
+
+
+def geometric_mean(npArN, npArA):
+    """ Mean of t = 0 .. n - 1 drawn with probability proportional to e^(a t) """
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        npArMean = npArN / -np.expm1(-npArA * npArN) - 1.0 / -np.expm1(-npArA)
+    return np.where(np.abs(npArA) < 1e-9, (npArN - 1) / 2.0, npArMean)
+
+
+def logsumexp(npAr):
+    dMax = npAr.max()
+    return dMax + math.log(np.exp(npAr - dMax).sum())
+
+
+class TiltedSampler(object):
+    """ Linear overlap pieces for each UCE length, and sampling from the exponentially tilted proposal """
+
+    def __init__(self, aUCEs, aGenomeSpaceIntervals, oTrack):
+        self.hSpace = analyticnull.space_arrays(aGenomeSpaceIntervals)
+        self.aChromosomes = sorted(self.hSpace)
+        self.hCounts = {}
+        for aUCE in aUCEs:
+            self.hCounts[aUCE[2] - aUCE[1]] = self.hCounts.get(aUCE[2] - aUCE[1], 0) + 1
+        self.aLengths = sorted(self.hCounts)
+        self.hPieces = {}
+        for iLen in self.aLengths:
+            tPieces = self.pieces(iLen, oTrack)
+            if tPieces is None:
+                logging.error("Can't place an interval of length {} anywhere in the genome space".format(iLen))
+                print "Could not find a space large enough to pick a random interval."
+                sys.exit(1)
+            self.hPieces[iLen] = tPieces
+
+    def pieces(self, iLen, oTrack):
+        """
+        Pieces of all chromosomes for an interval of length iLen, as (chromosome codes, first start, number of
+        starts, overlap at the first start, slope, log null probability of each start) arrays
+
+        """
+        aParts = []
+        for iCode, strChr in enumerate(self.aChromosomes):
+            npArSpaceStarts, npArSpaceStops = self.hSpace[strChr]
+            tPieces = analyticnull.pieces(iLen, strChr, npArSpaceStarts, npArSpaceStops, oTrack)
+            if tPieces is None:
+                continue
+            npArP, npArN, npArF, npArD, aiSpace, npArWeights, npArStarts = tPieces
+            # Null probability of each start, up to a constant: interval weight spread over its starts
+            npArLogStart = np.log(npArWeights / npArStarts)[aiSpace]
+            aParts.append((np.repeat(iCode, len(npArP)), npArP, npArN.astype(np.float64),
+                           npArF.astype(np.float64), npArD.astype(np.float64), npArLogStart))
+        if not aParts:
+            return None
+        return tuple([np.concatenate(aPart) for aPart in zip(*aParts)])
+
+    def log_masses(self, iLen, dTheta):
+        """ Log tilted mass of each piece of length iLen, and the log of the null mean of e^(theta f) """
+        npArCodes, npArP, npArN, npArF, npArD, npArLogStart = self.hPieces[iLen]
+        npArLogMass = npArLogStart + dTheta * npArF + log_geometric_sum(npArN, dTheta * npArD)
+        dLogM = logsumexp(npArLogMass) - logsumexp(npArLogStart + np.log(npArN))
+        return npArLogMass, dLogM
+
+    def proposal_mean(self, dTheta):
+        """ Expected total overlap under the proposal with tilt dTheta (theta 0 gives the exact null mean) """
+        dMean = 0.0
+        for iLen in self.aLengths:
+            npArCodes, npArP, npArN, npArF, npArD, npArLogStart = self.hPieces[iLen]
+            npArLogMass = self.log_masses(iLen, dTheta)[0]
+            npArProb = np.exp(npArLogMass - npArLogMass.max())
+            npArMeans = npArF + npArD * geometric_mean(npArN, dTheta * npArD)
+            dMean += self.hCounts[iLen] * (npArProb * npArMeans).sum() / npArProb.sum()
+        return dMean
+
+    def null_mean(self):
+        """ Exact null mean of the union bp overlap """
+        return self.proposal_mean(0.0)
+
+    def solve_theta(self, dTarget):
+        """ Tilt whose proposal mean equals dTarget, found by bisection (the mean increases with theta) """
+        dLow, dHigh = -THETA_LIMIT, THETA_LIMIT
+        for i in range(100):
+            dMid = (dLow + dHigh) / 2.0
+            if self.proposal_mean(dMid) < dTarget:
+                dLow = dMid
+            else:
+                dHigh = dMid
+        return (dLow + dHigh) / 2.0
+
+    def draw(self, iIterations, dTheta, rng):
+        """ Draw placement sets from the proposal. Returns codes, starts and stops sorted within each set, and the
+        log likelihood ratio of each set """
+        aCodes = []
+        aStarts = []
+        aStops = []
+        npArLogWeights = np.zeros(iIterations)
+        for iLen in self.aLengths:
+            iCount = self.hCounts[iLen]
+            npArPieceCodes, npArP, npArN, npArF, npArD, npArLogStart = self.hPieces[iLen]
+            npArLogMass, dLogM = self.log_masses(iLen, dTheta)
+            npArCum = np.cumsum(np.exp(npArLogMass - npArLogMass.max()))
+            aiPiece = np.searchsorted(npArCum, rng.random_sample((iIterations, iCount)) * npArCum[-1], side='right')
+            aiPiece = np.minimum(aiPiece, len(npArCum) - 1)
+            # Offset inside the piece by inverting the truncated geometric distribution
+            npArN = npArN[aiPiece]
+            npArA = dTheta * npArD[aiPiece]
+            npArU = rng.random_sample((iIterations, iCount))
+            with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+                npArT = np.floor(np.log1p(npArU * np.expm1(npArA * npArN)) / npArA)
+                # Overflow for large positive a means the draw is at the top of the piece
+                npArT = np.where(np.isfinite(npArT), npArT, npArN - 1)
+            npArT = np.where(np.abs(npArA) < 1e-12, np.floor(npArU * npArN), npArT)
+            npArT = np.clip(npArT, 0, npArN - 1)
+            npArStarts = npArP[aiPiece] + npArT.astype(np.int64)
+            aCodes.append(npArPieceCodes[aiPiece])
+            aStarts.append(npArStarts)
+            aStops.append(npArStarts + iLen)
+            # Likelihood ratio of null to proposal for each UCE
+            npArOverlap = npArF[aiPiece] + npArD[aiPiece] * npArT
+            npArLogWeights += iCount * dLogM - dTheta * npArOverlap.sum(axis=1)
+        npArCodes = np.hstack(aCodes)
+        npArStarts = np.hstack(aStarts)
+        npArStops = np.hstack(aStops)
+        aiOrder = np.lexsort((npArStops, npArStarts, npArCodes), axis=1)
+        npArCodes = np.take_along_axis(npArCodes, aiOrder, axis=1)
+        npArStarts = np.take_along_axis(npArStarts, aiOrder, axis=1)
+        npArStops = np.take_along_axis(npArStops, aiOrder, axis=1)
+        return npArCodes, npArStarts, npArStops, npArLogWeights
+
+    def sample(self, iIterations, dTheta, rng, iMaxWrong=100000):
+        """ Draw iIterations sets whose members do not overlap or touch, as required by norm_distribution """
+        aAccepted = []
+        iAccepted = iWrong = 0
+        while iAccepted < iIterations:
+            npArCodes, npArStarts, npArStops, npArLogWeights = self.draw(iIterations - iAccepted, dTheta, rng)
+            npArGlobalStops = np.maximum.accumulate(npArCodes * CHROMOSOME_SPAN + npArStops, axis=1)
+            abClash = (npArCodes[:, 1:] * CHROMOSOME_SPAN + npArStarts[:, 1:]) <= (npArGlobalStops[:, :-1] + 1)
+            abKeep = ~abClash.any(axis=1)
+            iWrong += (~abKeep).sum()
+            if iWrong > iMaxWrong:
+                print "Cannot find {0} non-overlapping random matches after {1} tries".format(npArCodes.shape[1],
+                                                                                              iMaxWrong)
+                print "Exiting..."
+                sys.exit(1)
+            aAccepted.append((npArCodes[abKeep], npArStarts[abKeep], npArStops[abKeep], npArLogWeights[abKeep]))
+            iAccepted += abKeep.sum()
+        logging.info("Found {} instances where randoms overlapped".format(iWrong))
+        return tuple([np.concatenate(aPart) for aPart in zip(*aAccepted)])
+
+
+def tail_probability(npArBP, npArLogWeights, iObserved, bLower):
+    """
+    Self-normalized importance-sampling estimate of the null probability of an overlap at or beyond the observed
+    value, with its delta-method standard error and the effective sample size
+
+    """
+    npArWeights = np.exp(npArLogWeights - npArLogWeights.max())
+    dTotal = npArWeights.sum()
+    if bLower:
+        abTail = npArBP <= iObserved
+    else:
+        abTail = npArBP >= iObserved
+    dEstimate = (npArWeights * abTail).sum() / dTotal
+    dSE = math.sqrt(((npArWeights * (abTail - dEstimate)) ** 2).sum()) / dTotal
+    dESS = dTotal ** 2 / (npArWeights ** 2).sum()
+    return dEstimate, dSE, dESS
+
+
+def weighted_moments(npArBP, npArLogWeights):
+    """ Self-normalized estimates of the null mean and s.d. of the overlap """
+    npArWeights = np.exp(npArLogWeights - npArLogWeights.max())
+    dMean = (npArWeights * npArBP).sum() / npArWeights.sum()
+    dVariance = (npArWeights * (npArBP - dMean) ** 2).sum() / npArWeights.sum()
+    return dMean, math.sqrt(dVariance)
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the importance-sampling tail estimator in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+'''
+Module to implement incremental re-analysis (--incremental) in randomoverlaps.py
+
+The state of a union-scored run is kept in one file: the random placement sets with their order by chromosome and
+start, the number of bases of the against set covered by every placed interval, the disjoint intervals covered by the
+against set, and the size, modification time and a checksum of the end of the against file that was read. When the
+against file has only grown since and still ends as it did, just the appended lines are read. Their bases already
+covered are removed, leaving the newly covered segments, and only placed intervals overlapping those segments (found
+by binary search of the sorted placement starts) gain covered bases. The cost of an update so grows with the
+appended intervals and the placements they reach, not with the size of the against file or of the run.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import numpy as np
+
+try:
+    import coveragetrack
+except ImportError:
+    print "Cannot find coveragetrack.py. Ensure file is in working directory, exiting..."
+    sys.exit(1)
+
+STATE_VERSION = 2
+TAIL_BYTES = 1 << 16  # Bytes before the end of the against file that must be unchanged for lines to be appended
+
+
+def tail_digest(fh, iBytes):
+    """ Checksum of the iBytes long start of an open file, taken over its last TAIL_BYTES bytes and its length """
+    iStart = max(0, iBytes - TAIL_BYTES)
+    fh.seek(iStart)
+    return hashlib.sha256("{0}:{1}".format(iBytes, fh.read(iBytes - iStart))).hexdigest()
+
+
+def file_state(strPath):
+    """ Size, end checksum and modification time of a file """
+    iBytes = os.path.getsize(strPath)
+    with open(strPath, "rb") as fh:
+        return iBytes, tail_digest(fh, iBytes), os.path.getmtime(strPath)
+
+
+def group_intervals(aaIntervals):
+    """ Sorted (start, stop) arrays of each chromosome """
+    hGrouped = {}
+    for aInterval in aaIntervals:
+        hGrouped.setdefault(aInterval[0], []).append((aInterval[1], aInterval[2]))
+    hArrays = {}
+    for strChr, aCoords in hGrouped.items():
+        aCoords.sort()
+        npArCoords = np.array(aCoords, dtype=np.int64)
+        hArrays[strChr] = (npArCoords[:, 0], npArCoords[:, 1])
+    return hArrays
+
+
+class IncrementalState(object):
+    """ Placements, their covered bases and the intervals covered by the against set of a union-scored run """
+
+    def __init__(self, strRunKey, aChromosomes, npArCodes, npArStarts, npArStops, hAgainst, iAgainstBytes,
+                 strAgainstDigest, dAgainstMtime, npArCovered=None, aiOrder=None):
+        self.strRunKey = strRunKey
+        self.aChromosomes = list(aChromosomes)
+        self.npArCodes = npArCodes
+        self.npArStarts = npArStarts
+        self.npArStops = npArStops
+        # Sorted, disjoint intervals covered by the against set on each chromosome, as (starts, stops)
+        self.hAgainst = hAgainst
+        self.iAgainstBytes = iAgainstBytes
+        self.strAgainstDigest = strAgainstDigest
+        self.dAgainstMtime = dAgainstMtime
+        # Placed intervals (as flat indexes) sorted by chromosome code and start, with where each code begins
+        if aiOrder is None:
+            aiOrder = np.lexsort((npArStarts.ravel(), npArCodes.ravel()))
+        self.aiOrder = aiOrder
+        self.npArSortedStarts = npArStarts.ravel()[aiOrder]
+        self.aiCodeBounds = np.searchsorted(npArCodes.ravel()[aiOrder], np.arange(len(self.aChromosomes) + 1))
+        self.iLongest = int((npArStops - npArStarts).max()) + 1 if npArStarts.size else 0
+        if npArCovered is None:
+            npArCovered = np.zeros(npArStarts.shape, dtype=np.int64)
+            for strChr in self.hAgainst:
+                self.rescore(strChr, npArCovered)
+        self.npArCovered = npArCovered
+
+    @classmethod
+    def from_intervals(cls, strRunKey, aChromosomes, npArCodes, npArStarts, npArStops, aaAgainst, iAgainstBytes,
+                       strAgainstDigest, dAgainstMtime):
+        """ State of a full run, collapsing the against intervals and scoring every placement """
+        hAgainst = dict([(strChr, coveragetrack.collapse_arrays(*tArrays))
+                         for strChr, tArrays in group_intervals(aaAgainst).items()])
+        return cls(strRunKey, aChromosomes, npArCodes, npArStarts, npArStops, hAgainst, iAgainstBytes,
+                   strAgainstDigest, dAgainstMtime)
+
+    @classmethod
+    def load(cls, strPath):
+        """ Read a state file, returning None if it is missing or unreadable """
+        if not os.path.isfile(strPath):
+            return None
+        try:
+            with np.load(strPath) as hState:
+                if int(hState["version"]) != STATE_VERSION:
+                    logging.warning("Incremental state {} is from another version, starting again".format(strPath))
+                    return None
+                aAgainstChromosomes = [str(strChr) for strChr in hState["against_chromosomes"]]
+                aiOffsets = hState["against_offsets"]
+                npArAgainstStarts = hState["against_starts"].astype(np.int64)
+                npArAgainstStops = hState["against_stops"].astype(np.int64)
+                hAgainst = dict([(strChr, (npArAgainstStarts[aiOffsets[i]:aiOffsets[i + 1]],
+                                           npArAgainstStops[aiOffsets[i]:aiOffsets[i + 1]]))
+                                 for i, strChr in enumerate(aAgainstChromosomes)])
+                return cls(str(hState["run_key"]), [str(strChr) for strChr in hState["chromosomes"]],
+                           hState["codes"], hState["starts"].astype(np.int64), hState["stops"].astype(np.int64),
+                           hAgainst, int(hState["against_bytes"]), str(hState["against_digest"]),
+                           float(hState["against_mtime"]), hState["covered"].astype(np.int64),
+                           hState["order"].astype(np.int64))
+        except Exception as err:
+            logging.warning("Could not read incremental state {}: {}, starting again".format(strPath, err))
+            return None
+
+    def save(self, strPath):
+        """ Write the state, replacing any previous state file only once it is complete """
+        aAgainstChromosomes = sorted(self.hAgainst)
+        aiOffsets = np.cumsum([0] + [len(self.hAgainst[strChr][0]) for strChr in aAgainstChromosomes])
+        strDir = os.path.dirname(os.path.abspath(strPath))
+        iHandle, strTemp = tempfile.mkstemp(dir=strDir, suffix=".tmp")
+        with os.fdopen(iHandle, "wb") as fh:
+            np.savez(fh, version=np.array(STATE_VERSION), run_key=np.array(self.strRunKey),
+                     chromosomes=np.array(self.aChromosomes), codes=self.npArCodes, starts=self.npArStarts,
+                     stops=self.npArStops, covered=self.npArCovered, order=self.aiOrder,
+                     against_chromosomes=np.array(aAgainstChromosomes), against_offsets=aiOffsets,
+                     against_starts=np.concatenate([self.hAgainst[strChr][0] for strChr in aAgainstChromosomes] +
+                                                   [np.zeros(0, dtype=np.int64)]),
+                     against_stops=np.concatenate([self.hAgainst[strChr][1] for strChr in aAgainstChromosomes] +
+                                                  [np.zeros(0, dtype=np.int64)]),
+                     against_bytes=np.array(self.iAgainstBytes), against_digest=np.array(self.strAgainstDigest),
+                     against_mtime=np.array(self.dAgainstMtime))
+        os.rename(strTemp, strPath)
+
+    def appended(self, strPath):
+        """
+        If the file at strPath is the against file this state was built from with whole lines appended, return the
+        appended lines, and the size, end checksum and modification time of the file up to its last complete line.
+        Otherwise return None. Only the end of the old file and the appended bytes are read
+
+        """
+        iBytes = os.path.getsize(strPath)
+        dMtime = os.path.getmtime(strPath)
+        if iBytes < self.iAgainstBytes or (iBytes == self.iAgainstBytes and dMtime != self.dAgainstMtime):
+            # Shorter, or rewritten in place
+            return None
+        with open(strPath, "rb") as fh:
+            if tail_digest(fh, self.iAgainstBytes) != self.strAgainstDigest:
+                return None
+            if self.iAgainstBytes:
+                # The previous file must have ended with a complete line
+                fh.seek(self.iAgainstBytes - 1)
+                if fh.read(1) != "\n":
+                    return None
+            strAppended = fh.read(iBytes - self.iAgainstBytes)
+            # A line still being written is left for the next update
+            strAppended = strAppended[:strAppended.rfind("\n") + 1]
+            iBytes = self.iAgainstBytes + len(strAppended)
+            return strAppended, iBytes, tail_digest(fh, iBytes), dMtime
+
+    def rescore(self, strChr, npArCovered):
+        """ Score the placed intervals on one chromosome against its covered intervals """
+        if strChr not in self.aChromosomes:
+            return 0
+        abMask = self.npArCodes == self.aChromosomes.index(strChr)
+        oTrack = coveragetrack.CoverageTrack([])
+        oTrack.add_chromosome(strChr, *self.hAgainst[strChr])
+        npArCovered[abMask] = oTrack.covered(strChr, self.npArStarts[abMask], self.npArStops[abMask])
+        return int(abMask.sum())
+
+    def uncovered(self, strChr, npArStarts, npArStops):
+        """ Parts of sorted, collapsed intervals on a chromosome not already covered by the against set """
+        npArOldStarts, npArOldStops = self.hAgainst.get(strChr, (np.zeros(0, dtype=np.int64),) * 2)
+        # Covered intervals reaching each new interval, from the first ending at or after its start
+        aiFirst = np.searchsorted(npArOldStops, npArStarts, side='left')
+        aiLast = np.searchsorted(npArOldStarts, npArStops, side='right')
+        aSegments = []
+        for iStart, iStop, iFirst, iLast in zip(npArStarts, npArStops, aiFirst, aiLast):
+            iPos = iStart
+            for iOldStart, iOldStop in zip(npArOldStarts[iFirst:iLast], npArOldStops[iFirst:iLast]):
+                if iOldStart > iPos:
+                    aSegments.append((iPos, iOldStart - 1))
+                iPos = max(iPos, iOldStop + 1)
+            if iPos <= iStop:
+                aSegments.append((iPos, iStop))
+        npArSegments = np.array(aSegments, dtype=np.int64).reshape(-1, 2)
+        return npArSegments[:, 0], npArSegments[:, 1]
+
+    def add_covered(self, strChr, npArStarts, npArStops):
+        """ Add newly covered segments to the placed intervals overlapping them, returning how many there were """
+        if strChr not in self.aChromosomes or not len(npArStarts):
+            return 0
+        iCode = self.aChromosomes.index(strChr)
+        aiPlaced = self.aiOrder[self.aiCodeBounds[iCode]:self.aiCodeBounds[iCode + 1]]
+        npArPlacedStarts = self.npArSortedStarts[self.aiCodeBounds[iCode]:self.aiCodeBounds[iCode + 1]]
+        # Placed intervals that can reach a segment start no earlier than the longest placement before it
+        aiFrom = np.searchsorted(npArPlacedStarts, npArStarts - self.iLongest + 1, side='left')
+        aiTo = np.searchsorted(npArPlacedStarts, npArStops, side='right')
+        aiReached = set()
+        for iStart, iStop, iFrom, iTo in zip(npArStarts, npArStops, aiFrom, aiTo):
+            aiCandidates = aiPlaced[iFrom:iTo]
+            npArBP = np.minimum(self.npArStops.ravel()[aiCandidates], iStop) - \
+                np.maximum(self.npArStarts.ravel()[aiCandidates], iStart) + 1
+            abHit = npArBP > 0
+            # Segments are disjoint from each other and from the old coverage, so their bases simply add up
+            np.add.at(self.npArCovered.ravel(), aiCandidates[abHit], npArBP[abHit])
+            aiReached.update(aiCandidates[abHit].tolist())
+        return len(aiReached)
+
+    def add_against(self, aaIntervals, iAgainstBytes, strAgainstDigest, dAgainstMtime):
+        """
+        Add appended against intervals, adding the bases they newly cover to the placed intervals they reach. Returns
+        the number of newly covered bases and of placed intervals rescored
+
+        """
+        iNewBP = iRescored = 0
+        for strChr, tArrays in group_intervals(aaIntervals).items():
+            npArStarts, npArStops = self.uncovered(strChr, *coveragetrack.collapse_arrays(*tArrays))
+            iNewBP += int((npArStops - npArStarts + 1).sum())
+            iRescored += self.add_covered(strChr, npArStarts, npArStops)
+            if strChr in self.hAgainst:
+                # New segments fall between the covered intervals, so are inserted without sorting again
+                npArOldStarts, npArOldStops = self.hAgainst[strChr]
+                aiAt = np.searchsorted(npArOldStarts, npArStarts)
+                self.hAgainst[strChr] = (np.insert(npArOldStarts, aiAt, npArStarts),
+                                         np.insert(npArOldStops, aiAt, npArStops))
+            else:
+                self.hAgainst[strChr] = (npArStarts, npArStops)
+        self.iAgainstBytes = iAgainstBytes
+        self.strAgainstDigest = strAgainstDigest
+        self.dAgainstMtime = dAgainstMtime
+        return iNewBP, iRescored
+
+    def track(self):
+        """ Coverage track of the whole against set """
+        oTrack = coveragetrack.CoverageTrack([])
+        for strChr, (npArStarts, npArStops) in self.hAgainst.items():
+            # Segments added by updates may touch the intervals beside them
+            oTrack.add_chromosome(strChr, *coveragetrack.collapse_arrays(npArStarts, npArStops))
+        return oTrack
+
+    def distribution(self):
+        """ [count, bp] overlaps of every iteration """
+        return [[int(iCount), int(iBP)] for iCount, iBP in zip((self.npArCovered > 0).sum(axis=1),
+                                                               self.npArCovered.sum(axis=1))]
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement incremental re-analysis in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+'''
+Module to implement random access to reference sequences in nonNcoordinates.py
+
+Three formats are supported, each read one entry at a time:
+FASTA         -- uncompressed, with a samtools .fai index. The index is built (and saved next to the FASTA if possible)
+                 when it is missing.
+bgzip FASTA   -- bgzip-compressed, with a .fai index. Blocks are located from the .gzi index if present, otherwise from
+                 the block headers, which does not need any decompression.
+2bit          -- UCSC .2bit. N-blocks and mask (lower-case) blocks are stored in each entry's header, so runs without
+                 Ns are read from there without unpacking any bases.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import bisect
+import logging
+import os
+import struct
+import sys
+import numpy as np
+
+try:
+    from Bio import bgzf
+except ImportError:
+    bgzf = None
+
+TWOBIT_SIGNATURE = 0x1A412743
+BGZF_MAGIC = "\x1f\x8b\x08\x04"
+
+
+def file_format(strPath):
+    """ "2bit", "bgzip" or "fasta", from the first bytes of the file """
+    with open(strPath, "rb") as fh:
+        strHead = fh.read(16)
+    if len(strHead) >= 4 and TWOBIT_SIGNATURE in (struct.unpack("<I", strHead[:4])[0],
+                                                  struct.unpack(">I", strHead[:4])[0]):
+        return "2bit"
+    # bgzip files are gzip files whose first extra subfield is "BC"
+    if strHead.startswith(BGZF_MAGIC) and strHead[12:14] == "BC":
+        return "bgzip"
+    return "fasta"
+
+
+def open_indexed(strPath):
+    """ Open a FASTA, bgzip FASTA or 2bit file for access by entry name """
+    strFormat = file_format(strPath)
+    if strFormat == "2bit":
+        return TwoBitFile(strPath)
+    return IndexedFasta(strPath, strFormat == "bgzip")
+
+
+def read_fai(strPath):
+    """ Return entry names in file order and name -> (length, offset, bases per line, bytes per line) """
+    aNames = []
+    hIndex = {}
+    with open(strPath) as fh:
+        for line in fh:
+            aLine = line.rstrip("\n").split("\t")
+            aNames.append(aLine[0])
+            hIndex[aLine[0]] = tuple([int(strField) for strField in aLine[1:5]])
+    return aNames, hIndex
+
+
+def build_fai(fh):
+    """ Build a .fai index by reading a FASTA file (or decompressed bgzip stream) line by line """
+    aNames = []
+    hIndex = {}
+    iOffset = 0
+    aEntry = None
+    for line in iter(fh.readline, ""):
+        iOffset += len(line)
+        if line.startswith(">"):
+            aEntry = [0, iOffset, 0, 0]
+            strName = line[1:].split()[0]
+            aNames.append(strName)
+            hIndex[strName] = aEntry
+        elif aEntry is not None and line.strip():
+            strBases = line.rstrip("\r\n")
+            if not aEntry[2]:
+                aEntry[2] = len(strBases)
+                aEntry[3] = len(line)
+            aEntry[0] += len(strBases)
+    return aNames, dict([(strName, tuple(aEntry)) for strName, aEntry in hIndex.items()])
+
+
+def write_fai(strPath, aNames, hIndex):
+    with open(strPath, "w") as out:
+        for strName in aNames:
+            out.write("{0}\t{1}\t{2}\t{3}\t{4}\n".format(strName, *hIndex[strName]))
+
+
+def bgzf_blocks(strPath):
+    """ Compressed and uncompressed start offsets of every block of a bgzip file, read from the block headers """
+    aCompressed = []
+    aUncompressed = []
+    iCompressed = iUncompressed = 0
+    with open(strPath, "rb") as fh:
+        while True:
+            strHeader = fh.read(12)
+            if len(strHeader) < 12:
+                break
+            iExtra = struct.unpack("<H", strHeader[10:12])[0]
+            strExtra = fh.read(iExtra)
+            iBlockSize = None
+            i = 0
+            while i + 4 <= len(strExtra):
+                iFieldLen = struct.unpack("<H", strExtra[i + 2:i + 4])[0]
+                if strExtra[i:i + 2] == "BC":
+                    iBlockSize = struct.unpack("<H", strExtra[i + 4:i + 6])[0] + 1
+                i += 4 + iFieldLen
+            if iBlockSize is None:
+                raise ValueError("{0} is not a valid bgzip file".format(strPath))
+            # The uncompressed size of the block is its last 4 bytes
+            fh.seek(iCompressed + iBlockSize - 4)
+            iSize = struct.unpack("<I", fh.read(4))[0]
+            aCompressed.append(iCompressed)
+            aUncompressed.append(iUncompressed)
+            iCompressed += iBlockSize
+            iUncompressed += iSize
+            fh.seek(iCompressed)
+    return aCompressed, aUncompressed
+
+
+def read_gzi(strPath):
+    """ Block offsets from a bgzip .gzi index, which omits the first block """
+    with open(strPath, "rb") as fh:
+        iCount = struct.unpack("<Q", fh.read(8))[0]
+        npArPairs = np.frombuffer(fh.read(16 * iCount), dtype="<u8").reshape(-1, 2)
+    return [0] + npArPairs[:, 0].tolist(), [0] + npArPairs[:, 1].tolist()
+
+
+class IndexedFasta(object):
+    """ Entries of an uncompressed or bgzip-compressed FASTA file, read through its .fai index """
+
+    def __init__(self, strPath, bBgzip=False):
+        self.strPath = strPath
+        self.bBgzip = bBgzip
+        if bBgzip:
+            if bgzf is None:
+                print "Reading bgzip files requires BioPython's Bio.bgzf module, exiting..."
+                sys.exit(1)
+            self.fh = bgzf.BgzfReader(strPath, "rb")
+            if os.path.isfile(strPath + ".gzi"):
+                self.aCompressed, self.aUncompressed = read_gzi(strPath + ".gzi")
+            else:
+                self.aCompressed, self.aUncompressed = bgzf_blocks(strPath)
+        else:
+            self.fh = open(strPath, "rb")
+        if os.path.isfile(strPath + ".fai"):
+            self.aNames, self.hIndex = read_fai(strPath + ".fai")
+        else:
+            sys.stderr.write("Indexing " + strPath + "\n")
+            self.aNames, self.hIndex = build_fai(self.fh)
+            try:
+                write_fai(strPath + ".fai", self.aNames, self.hIndex)
+            except IOError as err:
+                logging.warning("Could not save index {}.fai: {}".format(strPath, err))
+
+    def names(self):
+        return list(self.aNames)
+
+    def seek(self, iOffset):
+        """ Seek to an offset in the uncompressed FASTA """
+        if not self.bBgzip:
+            self.fh.seek(iOffset)
+            return
+        i = bisect.bisect_right(self.aUncompressed, iOffset) - 1
+        self.fh.seek(bgzf.make_virtual_offset(self.aCompressed[i], iOffset - self.aUncompressed[i]))
+
+    def sequence(self, strName):
+        """ The bases of one entry as a string """
+        iLength, iOffset, iLineBases, iLineWidth = self.hIndex[strName]
+        if not iLength:
+            return ""
+        # Bytes spanned by the entry, including the line endings of all but its last line
+        iBytes = (iLength // iLineBases) * iLineWidth + iLength % iLineBases
+        self.seek(iOffset)
+        return self.fh.read(iBytes).replace("\n", "").replace("\r", "")[:iLength]
+
+
+class TwoBitFile(object):
+    """ Entries of a UCSC .2bit file, giving runs without Ns from the N-block and mask-block headers """
+
+    def __init__(self, strPath):
+        self.strPath = strPath
+        self.fh = open(strPath, "rb")
+        strHeader = self.fh.read(16)
+        if struct.unpack("<I", strHeader[:4])[0] == TWOBIT_SIGNATURE:
+            self.strEndian = "<"
+        else:
+            self.strEndian = ">"
+        iVersion, iCount = struct.unpack(self.strEndian + "II", strHeader[4:12])
+        if iVersion:
+            print "Unsupported 2bit version {0} in {1}, exiting...".format(iVersion, strPath)
+            sys.exit(1)
+        self.aNames = []
+        self.hOffsets = {}
+        for i in xrange(iCount):
+            iNameLen = ord(self.fh.read(1))
+            strName = self.fh.read(iNameLen)
+            self.aNames.append(strName)
+            self.hOffsets[strName] = struct.unpack(self.strEndian + "I", self.fh.read(4))[0]
+
+    def names(self):
+        return list(self.aNames)
+
+    def read_uint32(self, iCount):
+        return np.frombuffer(self.fh.read(4 * iCount), dtype=self.strEndian + "u4").astype(np.int64)
+
+    def blocks(self, strName):
+        """ Entry length, N-block starts and sizes and mask-block starts and sizes (0-based) """
+        self.fh.seek(self.hOffsets[strName])
+        iLength = self.read_uint32(1)[0]
+        iNBlocks = self.read_uint32(1)[0]
+        npArNStarts = self.read_uint32(iNBlocks)
+        npArNSizes = self.read_uint32(iNBlocks)
+        iMaskBlocks = self.read_uint32(1)[0]
+        npArMaskStarts = self.read_uint32(iMaskBlocks)
+        npArMaskSizes = self.read_uint32(iMaskBlocks)
+        return iLength, npArNStarts, npArNSizes, npArMaskStarts, npArMaskSizes
+
+    def runs(self, strName, bNonrep):
+        """ 1-based (left, right) bounds of the stretches without Ns, also skipping mask blocks if bNonrep """
+        iLength, npArStarts, npArSizes, npArMaskStarts, npArMaskSizes = self.blocks(strName)
+        if bNonrep:
+            npArStarts = np.concatenate((npArStarts, npArMaskStarts))
+            npArSizes = np.concatenate((npArSizes, npArMaskSizes))
+        aiOrder = np.argsort(npArStarts, kind="mergesort")
+        npArStarts = npArStarts[aiOrder]
+        npArEnds = npArStarts + npArSizes[aiOrder]
+        # Merge gaps that overlap or touch, leaving the half-open gaps [start, end)
+        npArGapStarts = npArGapEnds = npArStarts
+        if len(npArStarts):
+            abNew = np.ones(len(npArStarts), dtype=bool)
+            abNew[1:] = npArStarts[1:] > np.maximum.accumulate(npArEnds)[:-1]
+            npArGapStarts = npArStarts[abNew]
+            npArGapEnds = np.maximum.reduceat(npArEnds, np.flatnonzero(abNew))
+        npArLefts = np.concatenate(([0], npArGapEnds))
+        npArRights = np.concatenate((npArGapStarts, [iLength]))
+        abKeep = npArRights > npArLefts
+        return [(int(iLeft) + 1, int(iRight)) for iLeft, iRight in zip(npArLefts[abKeep], npArRights[abKeep])]
+
+    def sequence(self, strName):
+        """ The bases of one entry as a string, with Ns and lower-case mask blocks restored """
+        iLength, npArNStarts, npArNSizes, npArMaskStarts, npArMaskSizes = self.blocks(strName)
+        self.fh.read(4)  # Reserved
+        npArPacked = np.frombuffer(self.fh.read((iLength + 3) // 4), dtype=np.uint8)
+        npArCodes = np.empty((len(npArPacked), 4), dtype=np.uint8)
+        for i in range(4):
+            npArCodes[:, i] = (npArPacked >> (6 - 2 * i)) & 3
+        npArBases = np.frombuffer("TCAG", dtype=np.uint8)[npArCodes.ravel()[:iLength]]
+        for iStart, iSize in zip(npArNStarts, npArNSizes):
+            npArBases[iStart:iStart + iSize] = ord("N")
+        for iStart, iSize in zip(npArMaskStarts, npArMaskSizes):
+            npArBases[iStart:iStart + iSize] += 32
+        return npArBases.tostring()
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement random access to reference sequences in "
+          "the nonNcoordinates.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
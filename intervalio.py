@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+'''
+Module to implement compressed and indexed interval file input and output for the scripts in this package
+
+Inputs may be plain text, gzip or bgzip-compressed, recognised from their first bytes. A bgzip file is a series of
+independently compressed blocks of at most 64 kB, so batches of blocks are inflated on a pool of threads while the
+lines of the previous batch are read. Plain gzip files are inflated in a background thread. The number of threads is
+taken from the UCE_IO_THREADS environment variable (default: up to 4, one per CPU).
+
+Interval outputs may be written bgzip-compressed with a tabix index (.tbi, generic format with 1-based chr, start,
+stop columns 1, 2 and 3, as made by tabix -s 1 -b 2 -e 3). Intervals must then be grouped by chromosome and sorted by
+start. query() reads the intervals overlapping a region through the index, inflating only the blocks it points to,
+and the files can also be read with tabix itself.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import argparse
+import multiprocessing
+import os
+import Queue
+import struct
+import sys
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
+
+GZIP_MAGIC = "\x1f\x8b"
+BGZF_MAGIC = "\x1f\x8b\x08\x04"
+BGZF_EOF = "1f8b08040000000000ff0600424302001b0003000000000000000000".decode("hex")
+BLOCK_DATA = 0xff00  # Uncompressed bytes per block, leaving room for incompressible data within 64 kB
+BATCH_BLOCKS = 64  # Blocks inflated or deflated together on the thread pool
+READ_SIZE = 1 << 20
+LINEAR_SHIFT = 14  # 16 kb windows of the linear index
+# First bin of each level of the binning scheme, with the bit shift of its bin size
+BIN_LEVELS = ((1, 26), (9, 23), (73, 20), (585, 17), (4681, 14))
+
+
+def threads():
+    """ Number of threads used to inflate or deflate blocks """
+    try:
+        return max(1, int(os.environ["UCE_IO_THREADS"]))
+    except (KeyError, ValueError):
+        return min(4, multiprocessing.cpu_count())
+
+
+def compression(strPath):
+    """ "bgzip", "gzip" or None, from the first bytes of the file """
+    with open(strPath, "rb") as fh:
+        strHead = fh.read(14)
+    # bgzip files are gzip files whose first extra subfield is "BC"
+    if strHead.startswith(BGZF_MAGIC) and strHead[12:14] == "BC":
+        return "bgzip"
+    if strHead.startswith(GZIP_MAGIC):
+        return "gzip"
+    return None
+
+
+def read_block(fh):
+    """ The deflated data of the next bgzip block, or None at the end of the file """
+    strHeader = fh.read(12)
+    if not strHeader:
+        return None
+    if len(strHeader) < 12 or not strHeader.startswith(BGZF_MAGIC):
+        raise IOError("{0} is not a valid bgzip file".format(fh.name))
+    iExtraLength = struct.unpack("<H", strHeader[10:12])[0]
+    strExtra = fh.read(iExtraLength)
+    iBlockSize = None
+    i = 0
+    while i + 4 <= len(strExtra):
+        iFieldLength = struct.unpack("<H", strExtra[i + 2:i + 4])[0]
+        if strExtra[i:i + 2] == "BC":
+            iBlockSize = struct.unpack("<H", strExtra[i + 4:i + 6])[0] + 1
+        i += 4 + iFieldLength
+    if iBlockSize is None:
+        raise IOError("{0} is not a valid bgzip file".format(fh.name))
+    strData = fh.read(iBlockSize - 12 - iExtraLength)
+    # Drop the CRC and size that end the block
+    return strData[:-8]
+
+
+def inflate(strDeflated):
+    return zlib.decompress(strDeflated, -15)
+
+
+def deflate(strData):
+    """ One bgzip block holding strData """
+    oCompress = zlib.compressobj(6, zlib.DEFLATED, -15)
+    strDeflated = oCompress.compress(strData) + oCompress.flush()
+    return BGZF_MAGIC + "\0\0\0\0\0\xff\x06\0BC\x02\0" + struct.pack("<H", len(strDeflated) + 25) + strDeflated + \
+        struct.pack("<II", zlib.crc32(strData) & 0xffffffff, len(strData))
+
+
+def bgzf_chunks(fh, oPool=None):
+    """ Yield the inflated data of each block of a bgzip file, inflating the next batch while one is being read """
+    def batch():
+        aDeflated = []
+        while len(aDeflated) < BATCH_BLOCKS:
+            strDeflated = read_block(fh)
+            if strDeflated is None:
+                break
+            aDeflated.append(strDeflated)
+        return aDeflated
+
+    if oPool is None:
+        for strDeflated in iter(lambda: read_block(fh), None):
+            yield inflate(strDeflated)
+        return
+    oPending = oPool.map_async(inflate, batch())
+    while True:
+        aData = oPending.get()
+        if not aData:
+            return
+        oPending = oPool.map_async(inflate, batch())
+        for strData in aData:
+            yield strData
+
+
+def gzip_chunks(fh):
+    """ Yield the inflated data of a gzip file, inflated in a background thread """
+    oQueue = Queue.Queue(16)
+
+    def producer():
+        try:
+            oDecompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for strData in iter(lambda: fh.read(READ_SIZE), ""):
+                while strData:
+                    oQueue.put(oDecompress.decompress(strData))
+                    # A new member starts after the end of the previous one
+                    strData = oDecompress.unused_data
+                    if strData:
+                        oDecompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            oQueue.put(oDecompress.flush())
+            oQueue.put(None)
+        except zlib.error as err:
+            oQueue.put(err)
+
+    oThread = threading.Thread(target=producer)
+    oThread.daemon = True
+    oThread.start()
+    for oData in iter(oQueue.get, None):
+        if isinstance(oData, zlib.error):
+            raise IOError("Cannot decompress {0}: {1}".format(fh.name, oData))
+        yield oData
+
+
+def chunk_lines(aChunks):
+    """ Yield the lines of a stream of text chunks, with universal newlines """
+    strRest = ""
+    for strData in aChunks:
+        aLines = (strRest + strData).split("\n")
+        strRest = aLines.pop()
+        for strLine in aLines:
+            yield strLine.rstrip("\r") + "\n"
+    if strRest:
+        yield strRest.rstrip("\r")
+
+
+class InputFile(object):
+    """ Lines of a gzip or bgzip-compressed file, iterated as those of a file opened with 'rU' """
+
+    def __init__(self, strPath, strCompression):
+        self.name = strPath
+        self.fh = open(strPath, "rb")
+        self.oPool = None
+        if strCompression == "bgzip":
+            if threads() > 1:
+                self.oPool = ThreadPool(threads())
+            self.aLines = chunk_lines(bgzf_chunks(self.fh, self.oPool))
+        else:
+            self.aLines = chunk_lines(gzip_chunks(self.fh))
+
+    def __iter__(self):
+        return self.aLines
+
+    def next(self):
+        return next(self.aLines)
+
+    def close(self):
+        self.fh.close()
+        if self.oPool is not None:
+            self.oPool.terminate()
+            self.oPool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_input(strPath):
+    """ Open a plain, gzip or bgzip-compressed text file for reading lines """
+    strCompression = compression(strPath)
+    if strCompression is None:
+        return open(strPath, "rU")
+    return InputFile(strPath, strCompression)
+
+
+def input_file(strPath):
+    """ argparse type opening an input file with open_input, or stdin for - """
+    if strPath == "-":
+        return sys.stdin
+    try:
+        return open_input(strPath)
+    except IOError as err:
+        raise argparse.ArgumentTypeError("can't open '{0}': {1}".format(strPath, err))
+
+
+class BgzfWriter(object):
+    """ Writes a bgzip file, deflating batches of full blocks on a pool of threads """
+
+    def __init__(self, strPath):
+        self.fh = open(strPath, "wb")
+        self.oPool = ThreadPool(threads()) if threads() > 1 else None
+        self.aPending = []
+        self.iPending = 0
+        # Bytes written so far, and the compressed offset of the start of each block written
+        self.iOffset = 0
+        self.aBlockStarts = [0]
+
+    def write(self, strData):
+        self.aPending.append(strData)
+        self.iPending += len(strData)
+        self.iOffset += len(strData)
+        if self.iPending >= BLOCK_DATA * BATCH_BLOCKS:
+            self.flush_blocks(False)
+
+    def flush_blocks(self, bAll):
+        """ Write the full blocks of pending data, and the last partial block too if bAll """
+        strData = "".join(self.aPending)
+        iEnd = len(strData) if bAll else len(strData) // BLOCK_DATA * BLOCK_DATA
+        aBlocks = [strData[i:i + BLOCK_DATA] for i in xrange(0, iEnd, BLOCK_DATA)]
+        for strBlock in (self.oPool.map(deflate, aBlocks) if self.oPool else map(deflate, aBlocks)):
+            self.fh.write(strBlock)
+            self.aBlockStarts.append(self.aBlockStarts[-1] + len(strBlock))
+        self.aPending = [strData[iEnd:]]
+        self.iPending = len(strData) - iEnd
+
+    def virtual_offset(self, iOffset):
+        """ Virtual offset (compressed block start << 16 | offset in block) of a written uncompressed offset """
+        iBlock, iWithin = divmod(iOffset, BLOCK_DATA)
+        return (self.aBlockStarts[iBlock] << 16) | iWithin
+
+    def close(self):
+        self.flush_blocks(True)
+        self.fh.write(BGZF_EOF)
+        self.fh.close()
+        if self.oPool is not None:
+            self.oPool.close()
+
+
+def region_bin(iBegin, iEnd):
+    """ Smallest bin holding the 0-based, half-open region [iBegin, iEnd) """
+    iEnd -= 1
+    for iFirst, iShift in BIN_LEVELS[::-1]:
+        if iBegin >> iShift == iEnd >> iShift:
+            return iFirst + (iBegin >> iShift)
+    return 0
+
+
+def region_bins(iBegin, iEnd):
+    """ Every bin that may hold intervals overlapping the 0-based, half-open region [iBegin, iEnd) """
+    iEnd -= 1
+    aBins = [0]
+    for iFirst, iShift in BIN_LEVELS:
+        aBins.extend(xrange(iFirst + (iBegin >> iShift), iFirst + (iEnd >> iShift) + 1))
+    return aBins
+
+
+class TabixIndex(object):
+    """ Bins and linear index of each chromosome of an interval file, by uncompressed offset until written """
+
+    def __init__(self):
+        self.aChromosomes = []
+        self.hBins = {}
+        self.hLinear = {}
+        self.tPrevious = None
+
+    def add(self, strChr, iStart, iStop, iBegin, iEnd):
+        """ Add the interval at uncompressed offsets [iBegin, iEnd) of the file """
+        if self.tPrevious is None or strChr != self.tPrevious[0]:
+            if strChr in self.hBins:
+                raise ValueError("Intervals must be grouped by chromosome to be indexed")
+            self.aChromosomes.append(strChr)
+            self.hBins[strChr] = {}
+            self.hLinear[strChr] = []
+        elif iStart < self.tPrevious[1]:
+            raise ValueError("Intervals must be sorted by start to be indexed")
+        self.tPrevious = (strChr, iStart)
+        # 1-based, inclusive coordinates are indexed as the 0-based, half-open [start - 1, stop)
+        aChunks = self.hBins[strChr].setdefault(region_bin(iStart - 1, iStop), [])
+        if aChunks and aChunks[-1][1] == iBegin:
+            aChunks[-1][1] = iEnd
+        else:
+            aChunks.append([iBegin, iEnd])
+        aLinear = self.hLinear[strChr]
+        iLast = (iStop - 1) >> LINEAR_SHIFT
+        if len(aLinear) <= iLast:
+            # Windows first reached by this interval start at it, as do any skipped ones before it
+            aLinear.extend([iBegin] * (iLast + 1 - len(aLinear)))
+
+    def write(self, strPath, oWriter):
+        """ Write the index as a bgzip-compressed .tbi file, converting offsets with oWriter.virtual_offset """
+        strNames = "".join([strChr + "\0" for strChr in self.aChromosomes])
+        aParts = ["TBI\1", struct.pack("<iiiiiiii", len(self.aChromosomes), 0, 1, 2, 3, ord("#"), 0, len(strNames)),
+                  strNames]
+        for strChr in self.aChromosomes:
+            hBins = self.hBins[strChr]
+            aParts.append(struct.pack("<i", len(hBins)))
+            for iBin in sorted(hBins):
+                aParts.append(struct.pack("<Ii", iBin, len(hBins[iBin])))
+                for iBegin, iEnd in hBins[iBin]:
+                    aParts.append(struct.pack("<QQ", oWriter.virtual_offset(iBegin), oWriter.virtual_offset(iEnd)))
+            aParts.append(struct.pack("<i", len(self.hLinear[strChr])))
+            aParts.extend([struct.pack("<Q", oWriter.virtual_offset(iBegin)) for iBegin in self.hLinear[strChr]])
+        oIndexWriter = BgzfWriter(strPath)
+        oIndexWriter.write("".join(aParts))
+        oIndexWriter.close()
+
+
+class IntervalWriter(object):
+    """ Writes 3-column intervals to stdout or a file, optionally bgzip-compressed with a tabix index """
+
+    def __init__(self, strPath=None, bBgzip=False):
+        self.strPath = strPath
+        self.oIndex = None
+        if bBgzip:
+            if not strPath:
+                raise ValueError("A bgzip-compressed output needs a file name")
+            self.fh = BgzfWriter(strPath)
+            self.oIndex = TabixIndex()
+        elif strPath:
+            self.fh = open(strPath, "w")
+        else:
+            self.fh = sys.stdout
+
+    def write(self, aInterval):
+        strLine = "{0}\t{1}\t{2}\n".format(*aInterval)
+        if self.oIndex is not None:
+            iBegin = self.fh.iOffset
+            self.fh.write(strLine)
+            self.oIndex.add(aInterval[0], int(aInterval[1]), int(aInterval[2]), iBegin, self.fh.iOffset)
+        else:
+            self.fh.write(strLine)
+
+    def close(self):
+        if self.fh is sys.stdout:
+            return
+        self.fh.close()
+        if self.oIndex is not None:
+            self.oIndex.write(self.strPath + ".tbi", self.fh)
+
+    def abort(self):
+        """ Close the output without finishing it, removing the partial file and any index """
+        if self.fh is sys.stdout:
+            return
+        self.fh.close()
+        for strPath in (self.strPath, self.strPath + ".tbi"):
+            if os.path.isfile(strPath):
+                os.remove(strPath)
+
+
+def write_intervals(aaIntervals, strPath=None, bBgzip=False):
+    """
+    Write 3-column intervals (any iterable) to stdout or a file as IntervalWriter does. An indexed bgzip output needs
+    intervals grouped by chromosome and sorted by start; if they are not, the partial output is removed and the
+    script exits. The partial output is also removed if anything else (such as reading the intervals) stops the write
+
+    """
+    oWriter = IntervalWriter(strPath, bBgzip)
+    try:
+        for aInterval in aaIntervals:
+            try:
+                oWriter.write(aInterval)
+            except ValueError as err:
+                print "{0}, cannot write {1}, exiting...".format(err, strPath)
+                sys.exit(1)
+    except BaseException:
+        oWriter.abort()
+        raise
+    oWriter.close()
+
+
+def read_index(strPath):
+    """ Chromosome names, and the bins and linear index of each, from a .tbi file """
+    with open(strPath, "rb") as fh:
+        strData = "".join(bgzf_chunks(fh))
+    if not strData.startswith("TBI\1"):
+        raise IOError("{0} is not a tabix index".format(strPath))
+    iChromosomes = struct.unpack("<i", strData[4:8])[0]
+    iNameLength = struct.unpack("<i", strData[32:36])[0]
+    aChromosomes = strData[36:36 + iNameLength].split("\0")[:iChromosomes]
+    i = 36 + iNameLength
+    hIndex = {}
+    for strChr in aChromosomes:
+        hBins = {}
+        iBins = struct.unpack("<i", strData[i:i + 4])[0]
+        i += 4
+        for j in xrange(iBins):
+            iBin, iChunks = struct.unpack("<Ii", strData[i:i + 8])
+            i += 8
+            hBins[iBin] = [struct.unpack("<QQ", strData[i + 16 * k:i + 16 * k + 16]) for k in xrange(iChunks)]
+            i += 16 * iChunks
+        iLinear = struct.unpack("<i", strData[i:i + 4])[0]
+        aLinear = list(struct.unpack("<{0}Q".format(iLinear), strData[i + 4:i + 4 + 8 * iLinear]))
+        i += 4 + 8 * iLinear
+        hIndex[strChr] = (hBins, aLinear)
+    return hIndex
+
+
+def query(strPath, strChr, iStart, iStop, hIndex=None):
+    """
+    Yield the intervals of an indexed bgzip file that overlap the 1-based, inclusive region, inflating only the blocks
+    the index points to. hIndex may be given from read_index to reuse it between queries
+
+    """
+    if hIndex is None:
+        hIndex = read_index(strPath + ".tbi")
+    if strChr not in hIndex:
+        return
+    hBins, aLinear = hIndex[strChr]
+    iWindow = (iStart - 1) >> LINEAR_SHIFT
+    iMinOffset = aLinear[iWindow] if iWindow < len(aLinear) else (aLinear[-1] if aLinear else 0)
+    aChunks = sorted([tChunk for iBin in region_bins(iStart - 1, iStop) for tChunk in hBins.get(iBin, [])
+                      if tChunk[1] > iMinOffset])
+    # Merge chunks that overlap or share a block
+    aMerged = []
+    for iBegin, iEnd in aChunks:
+        if aMerged and iBegin >> 16 <= aMerged[-1][1] >> 16:
+            aMerged[-1][1] = max(aMerged[-1][1], iEnd)
+        else:
+            aMerged.append([iBegin, iEnd])
+    with open(strPath, "rb") as fh:
+        for iBegin, iEnd in aMerged:
+            fh.seek(iBegin >> 16)
+            aData = []
+            # Inflate blocks up to and including the one holding the chunk end
+            while fh.tell() <= iEnd >> 16:
+                strDeflated = read_block(fh)
+                if strDeflated is None:
+                    break
+                aData.append(inflate(strDeflated))
+            iLastBlockLength = len(aData[-1]) if aData else 0
+            strData = "".join(aData)
+            strData = strData[iBegin & 0xffff:len(strData) - iLastBlockLength + (iEnd & 0xffff)]
+            for strLine in strData.splitlines():
+                aLine = strLine.split("\t")
+                if aLine[0] != strChr:
+                    continue
+                aInterval = [aLine[0], int(aLine[1]), int(aLine[2])]
+                if aInterval[1] > iStop:
+                    break
+                if aInterval[2] >= iStart:
+                    yield aInterval
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement compressed and indexed interval files for "
+          "the scripts in this package. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Optional compiled kernels for the hot interval loops in randomoverlaps.py, clustermodule.py and nonNcoordinates.py.
+
+The kernels work on numpy arrays and are compiled with Numba when it is installed. They are switched on for every
+script by setting the environment variable UCE_KERNELS=jit (or by calling set_backend("jit")). If Numba cannot be
+imported, the scripts fall back to their pure-Python loops and a warning is logged. Both backends give identical
+results; run this script with --check to compare them on random inputs.
+
+Kernels provided:
+collapse       -- randomoverlaps.collapse and clustermodule.ccollapse
+overlap        -- randomoverlaps.overlap (and the partial_overlap calls it makes), using a binary search over the
+                  running maximum stop of each chromosome instead of a scan from the start of the against list
+pick           -- randomoverlaps.picker, with the same subtraction order so the same random draw gives the same pick
+non_n_runs     -- the per-base loop in nonNcoordinates.py
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import numpy as np
+
+try:
+    from numba import njit
+    bNumba = True
+except ImportError:
+    bNumba = False
+
+    def njit(*args, **kwargs):
+        """ Stand-in used only so the kernels can be defined without Numba, they are never called through it """
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+ENABLED = False
+_hPrepared = {}
+
+
+def set_backend(strBackend):
+    """ Select the "jit" or "python" backend, returning True if compiled kernels are now in use """
+    global ENABLED
+    if strBackend == "jit" and not bNumba:
+        logging.warning("Numba is not installed, using pure-Python loops")
+        ENABLED = False
+    else:
+        ENABLED = strBackend == "jit"
+    return ENABLED
+
+
+@njit(cache=True)
+def collapse_kernel(npArCodes, npArStarts, npArStops, npArOut):
+    # Same walk as randomoverlaps.collapse, including restarting a block whenever the stored start is 0
+    iOut = 0
+    iCode = -1
+    iStart = iStop = 0
+    for i in range(len(npArCodes)):
+        if iCode >= 0:
+            if iCode != npArCodes[i] or npArStarts[i] > (iStop + 1):
+                npArOut[iOut, 0] = iCode
+                npArOut[iOut, 1] = iStart
+                npArOut[iOut, 2] = iStop
+                iOut += 1
+                iStart = iStop = 0
+        iCode = npArCodes[i]
+        if iStart == 0:
+            iStart = npArStarts[i]
+        if npArStops[i] > iStop:
+            iStop = npArStops[i]
+    npArOut[iOut, 0] = iCode
+    npArOut[iOut, 1] = iStart
+    npArOut[iOut, 2] = iStop
+    return iOut + 1
+
+
+@njit(cache=True)
+def overlap_kernel(npArCodes, npArStarts, npArStops, npArBlockStart, npArBlockEnd, npArAgainstStarts,
+                   npArAgainstStops, npArRunningStops):
+    iOverlapCount = iTotalBPOverlap = 0
+    for i in range(len(npArCodes)):
+        iCode = npArCodes[i]
+        if iCode < 0:
+            continue
+        iLow = npArBlockStart[iCode]
+        iHigh = npArBlockEnd[iCode]
+        # First against interval on this chromosome whose stop reaches the test start, as found by the linear scan
+        j = iLow + np.searchsorted(npArRunningStops[iLow:iHigh], npArStarts[i])
+        if j < iHigh and npArAgainstStarts[j] <= npArStops[i]:
+            iOverlapCount += 1
+            iTotalBPOverlap += min(npArStops[i], npArAgainstStops[j]) - max(npArStarts[i], npArAgainstStarts[j]) + 1
+    return iOverlapCount, iTotalBPOverlap
+
+
+@njit(cache=True)
+def pick_kernel(npArWeights, x):
+    for i in range(len(npArWeights)):
+        if x <= npArWeights[i]:
+            return i
+        x -= npArWeights[i]
+    return -1
+
+
+@njit(cache=True)
+def non_n_kernel(npArBases, bNonrep, npArOut):
+    # Gaps are N/n, plus lower-case a/c/g/t when repeat-masked bases are removed
+    iOut = 0
+    iLeft = 0
+    for i in range(len(npArBases)):
+        b = npArBases[i]
+        bGap = b == 78 or b == 110
+        if bNonrep and (b == 97 or b == 99 or b == 103 or b == 116):
+            bGap = True
+        if bGap:
+            if iLeft:
+                npArOut[iOut, 0] = iLeft
+                npArOut[iOut, 1] = i
+                iOut += 1
+                iLeft = 0
+        elif not iLeft:
+            iLeft = i + 1
+    if iLeft:
+        npArOut[iOut, 0] = iLeft
+        npArOut[iOut, 1] = len(npArBases)
+        iOut += 1
+    return iOut
+
+
+def prepared(aList, fPrepare):
+    """ Arrays derived from a list that is reused between calls (the against set or weighted space) """
+    tEntry = _hPrepared.get(id(aList))
+    # Keep a reference to the list so its id cannot be reused while the entry exists
+    if tEntry is None or tEntry[0] is not aList or tEntry[1] != len(aList):
+        if len(_hPrepared) > 16:
+            _hPrepared.clear()
+        tEntry = (aList, len(aList), fPrepare(aList))
+        _hPrepared[id(aList)] = tEntry
+    return tEntry[2]
+
+
+def encode(aaIntervals, hCodes):
+    """ Chromosome codes, starts and stops of a list of intervals """
+    npArCodes = np.array([hCodes.get(aInterval[0], -1) for aInterval in aaIntervals], dtype=np.int64)
+    npArStarts = np.array([aInterval[1] for aInterval in aaIntervals], dtype=np.int64)
+    npArStops = np.array([aInterval[2] for aInterval in aaIntervals], dtype=np.int64)
+    return npArCodes, npArStarts, npArStops
+
+
+def collapse(aList):
+    """ Compiled equivalent of randomoverlaps.collapse """
+    if not aList:
+        return [[0, 0, 0]]
+    aChromosomes = []
+    hCodes = {}
+    for aInterval in aList:
+        if aInterval[0] not in hCodes:
+            hCodes[aInterval[0]] = len(aChromosomes)
+            aChromosomes.append(aInterval[0])
+    npArOut = np.zeros((len(aList), 3), dtype=np.int64)
+    iOut = collapse_kernel(*(encode(aList, hCodes) + (npArOut,)))
+    return [[aChromosomes[iCode], int(iStart), int(iStop)] for iCode, iStart, iStop in npArOut[:iOut]]
+
+
+def prepare_against(aaAgainst):
+    """ Chromosome blocks, coordinates and running maximum stops of a sorted against list """
+    hCodes = {}
+    aBlockStart = []
+    aBlockEnd = []
+    for i, aInterval in enumerate(aaAgainst):
+        if aInterval[0] not in hCodes:
+            hCodes[aInterval[0]] = len(aBlockStart)
+            aBlockStart.append(i)
+            aBlockEnd.append(i)
+        aBlockEnd[hCodes[aInterval[0]]] = i + 1
+    npArCodes, npArStarts, npArStops = encode(aaAgainst, hCodes)
+    npArRunningStops = np.empty(len(aaAgainst), dtype=np.int64)
+    for iLow, iHigh in zip(aBlockStart, aBlockEnd):
+        npArRunningStops[iLow:iHigh] = np.maximum.accumulate(npArStops[iLow:iHigh])
+    return (hCodes, np.array(aBlockStart, dtype=np.int64), np.array(aBlockEnd, dtype=np.int64), npArStarts, npArStops,
+            npArRunningStops)
+
+
+def overlap(aaIntervals, aaAgainst):
+    """ Compiled equivalent of randomoverlaps.overlap. The against list must be sorted by chr, start, stop """
+    if not aaIntervals or not aaAgainst:
+        return 0, 0
+    tAgainst = prepared(aaAgainst, prepare_against)
+    iOverlapCount, iTotalBPOverlap = overlap_kernel(*(encode(aaIntervals, tAgainst[0]) + tAgainst[1:]))
+    return int(iOverlapCount), int(iTotalBPOverlap)
+
+
+def picker(aList):
+    """ Compiled equivalent of randomoverlaps.picker, drawing from the same random stream """
+    npArWeights = prepared(aList, lambda aWeighted: np.array([weight for elmt, weight in aWeighted], dtype=np.float64))
+    i = pick_kernel(npArWeights, random.random())
+    if i < 0:
+        return None
+    return aList[i][0]
+
+
+def non_n_runs(strSeq, bNonrep):
+    """ 1-based (left, right) bounds of the stretches of strSeq without Ns, relative to the start of strSeq """
+    npArBases = np.frombuffer(strSeq, dtype=np.uint8)
+    npArOut = np.zeros(((len(npArBases) + 1) // 2 + 1, 2), dtype=np.int64)
+    iOut = non_n_kernel(npArBases, bNonrep, npArOut)
+    return [(int(iLeft), int(iRight)) for iLeft, iRight in npArOut[:iOut]]
+
+
+def check(iTrials):
+    """ Compare both backends on random inputs, returning the number of mismatches """
+    import randomoverlaps
+    import clustermodule
+    iMismatch = 0
+    rng = random.Random(1)
+    for iTrial in range(iTrials):
+        aChromosomes = ["chr{0}".format(i) for i in range(1, rng.randint(2, 5))]
+        aaA = []
+        for i in range(rng.randint(1, 300)):
+            iStart = rng.randint(1, 100000)
+            aaA.append([rng.choice(aChromosomes), iStart, iStart + rng.randint(0, 3000)])
+        aaB = []
+        for i in range(rng.randint(1, 300)):
+            iStart = rng.randint(1, 100000)
+            aaB.append([rng.choice(aChromosomes[:-1] or aChromosomes), iStart, iStart + rng.randint(0, 3000)])
+        aaA.sort(key=lambda x: (x[0], x[1], x[2]))
+        aaB.sort(key=lambda x: (x[0], x[1], x[2]))
+        aWeighted = randomoverlaps.weight(aaA)
+        iSeed = rng.randint(0, 10 ** 6)
+        hResults = {}
+        for strBackend in ("python", "jit"):
+            set_backend(strBackend)
+            random.seed(iSeed)
+            hResults[strBackend] = (randomoverlaps.collapse(aaA), clustermodule.ccollapse(aaA),
+                                    randomoverlaps.overlap(aaA, aaB), randomoverlaps.overlap(aaB, aaA),
+                                    [randomoverlaps.picker(aWeighted) for i in range(50)])
+        for strName, oPython, oJit in zip(("collapse", "ccollapse", "overlap", "overlap", "picker"),
+                                          hResults["python"], hResults["jit"]):
+            if oPython != oJit:
+                iMismatch += 1
+                print "Mismatch in {0} on trial {1}".format(strName, iTrial)
+    try:
+        import nonNcoordinates
+    except SystemExit:
+        print "Skipping nonNcoordinates check, BioPython is not installed"
+        return iMismatch
+    for iTrial in range(iTrials):
+        strSeq = "".join([rng.choice("ACGTacgtNNNnn") for i in range(rng.randint(0, 500))])
+        for bNonrep in (False, True):
+            aResults = []
+            for strBackend in ("python", "jit"):
+                set_backend(strBackend)
+                aResults.append(nonNcoordinates.non_n_intervals("chr1", strSeq, bNonrep, 100))
+            if aResults[0] != aResults[1]:
+                iMismatch += 1
+                print "Mismatch in non_n_runs on trial {0}".format(iTrial)
+    return iMismatch
+
+
+set_backend(os.environ.get("UCE_KERNELS", "python").lower())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that the compiled kernels give the same results as the "
+                                                 "pure-Python loops on random inputs.")
+    parser.add_argument("--check", action="store_true", required=True,
+                        help="Run the equivalence check")
+    parser.add_argument("-n", "--trials", type=int, default=200,
+                        help="Number of random inputs to compare [default=200]")
+    args = parser.parse_args()
+    if not bNumba:
+        sys.exit("Numba is not installed, only the pure-Python backend is available")
+    iMismatch = check(args.trials)
+    if iMismatch:
+        sys.exit("{0} mismatches between backends".format(iMismatch))
+    print "All kernels match the pure-Python implementations over {0} trials".format(args.trials)
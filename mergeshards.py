@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Merge shards
+
+Combines the partial distributions written by randomoverlaps.py --shard k/n into the final randommatches.dist and
+stats_ outputs. The shards of a run draw disjoint blocks of iterations from seeds derived from --seed, so the merged
+results are identical to those of a single randomoverlaps.py run with the same seed.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import sys
+import intervalio
+
+try:
+    import randomoverlaps as ro
+except ImportError:
+    print "Cannot find randomoverlaps.py. Ensure file is in working directory, exiting..."
+    sys.exit(1)
+import numpy as np
+
+
+def getArgs(strInput=None):
+    parser = argparse.ArgumentParser(description="Merges the partial distributions written by randomoverlaps.py "
+                                                 "--shard k/n and prints the statistics of the full run. Every shard "
+                                                 "of the run must be given, in any order.")
+    parser.add_argument('shards', type=intervalio.input_file, nargs='+',
+                        help="Shard files (shard<k>of<n>_randommatches.dist...)")
+    parser.add_argument("-v", "--verbose", action="store_false",
+                        help="-v flag prevents the storage of the merged distribution and stats files to current "
+                             "directory")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+def read_shard(fileobj):
+    """ Return the header fields and the [count, bp] rows of a shard file """
+    hHeader = {}
+    aOverlapDistribution = []
+    for line in fileobj:
+        aLine = line.rstrip("\n").split("\t")
+        if aLine[0].startswith("#"):
+            hHeader[aLine[0][1:]] = aLine[1:]
+        elif line.strip():
+            aOverlapDistribution.append([int(aLine[0]), int(aLine[1])])
+    if "shard" not in hHeader or "observed" not in hHeader:
+        print "{0} is not a shard written by randomoverlaps.py --shard".format(fileobj.name)
+        sys.exit(1)
+    return hHeader, aOverlapDistribution
+
+
+def merge(aShards):
+    """
+    Check that the shards (header, rows) cover one run exactly once, and return the run header and the full
+    distribution in iteration order
+
+    """
+    hRun = None
+    hShards = {}
+    for hHeader, aOverlapDistribution in aShards:
+        iShard, iShards = [int(strPart) for strPart in hHeader["shard"]]
+        hFields = dict([(strKey, aValue) for strKey, aValue in hHeader.items() if strKey != "shard"])
+        if hRun is None:
+            hRun = hFields
+            iRunShards = iShards
+        elif hFields != hRun or iShards != iRunShards:
+            print "Shard {0}/{1} is from a different run than the other shards".format(iShard, iShards)
+            sys.exit(1)
+        if iShard in hShards:
+            print "Shard {0}/{1} was given more than once".format(iShard, iShards)
+            sys.exit(1)
+        hShards[iShard] = aOverlapDistribution
+    aMissing = [str(iShard) for iShard in range(1, iRunShards + 1) if iShard not in hShards]
+    if aMissing:
+        print "Missing shards {0} of {1}".format(", ".join(aMissing), iRunShards)
+        sys.exit(1)
+    aOverlapDistribution = []
+    for iShard in range(1, iRunShards + 1):
+        aOverlapDistribution.extend(hShards[iShard])
+    if len(aOverlapDistribution) != int(hRun["iterations"][0]):
+        print "Shards hold {0} iterations, expected {1}".format(len(aOverlapDistribution), hRun["iterations"][0])
+        sys.exit(1)
+    return hRun, aOverlapDistribution
+
+
+def main(args):
+    hRun, aOverlapDistribution = merge([read_shard(fileobj) for fileobj in args.shards])
+    uceName = hRun["uces"][0]
+    againstName = hRun["against"][0]
+    if args.verbose:
+        ro.write_distribution(aOverlapDistribution, uceName, againstName)
+    # Seed the KS test reference sample as the single run does
+    np.random.seed(int(hRun["seed"][0]))
+    aUCEOverlaps = [int(strValue) for strValue in hRun["observed"]]
+    aStats = ro.statistics(aUCEOverlaps, aOverlapDistribution)
+    return aStats, uceName, againstName
+
+
+if __name__ == "__main__":
+    args = getArgs()
+    aStats, uceName, againstName = main(args)
+    ro.writer(aStats, uceName, againstName, args.verbose)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+'''
+Module to implement scoring against several against files at once in randomoverlaps.py
+
+The intervals of every against set are merged by chromosome into one sorted set of start and stop arrays, each
+interval labeled with the set it came from. Alongside them is kept, for each set, the index of its own intervals in
+the merged arrays and the running maximum stop along them, so the arrays kept grow with the total number of
+intervals however many sets there are. For the first-hit scoring of randomoverlaps.overlap, a binary search of a
+set's running maximum finds the first of its intervals reaching a query start. With --union, each set is collapsed
+from its own intervals into its own coverage track. Each block of placement sets is grouped by chromosome once and
+then scored against all sets, so drawing and sorting random sets is done once however many sets are tested.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import sys
+import numpy as np
+
+try:
+    import coveragetrack
+except ImportError:
+    print "Cannot find coveragetrack.py. Ensure file is in working directory, exiting..."
+    sys.exit(1)
+
+
+class LabeledAgainst(object):
+    """ Several against sets merged into labeled, sorted arrays per chromosome """
+
+    def __init__(self, aaaAgainst, bUnion=False):
+        self.iLabels = len(aaaAgainst)
+        self.bUnion = bUnion
+        self.hStarts = {}
+        self.hStops = {}
+        self.hLabels = {}
+        self.hIndex = {}
+        self.hRunning = {}
+        self.aTracks = [coveragetrack.CoverageTrack([]) for iLabel in xrange(self.iLabels)]
+        hGrouped = {}
+        for iLabel, aaAgainst in enumerate(aaaAgainst):
+            for aInterval in aaAgainst:
+                hGrouped.setdefault(aInterval[0], []).append((aInterval[1], aInterval[2], iLabel))
+        for strChr, aCoords in hGrouped.items():
+            # Within each set, intervals stay in the chr, start, stop order of a single against list
+            aCoords.sort()
+            npArCoords = np.array(aCoords, dtype=np.int64)
+            self.hStarts[strChr] = npArCoords[:, 0].copy()
+            self.hStops[strChr] = npArCoords[:, 1].copy()
+            self.hLabels[strChr] = npArCoords[:, 2].copy()
+            # Index of the intervals of each set in the merged arrays, still sorted by start
+            aiByLabel = np.argsort(self.hLabels[strChr], kind='mergesort')
+            aiBounds = np.searchsorted(self.hLabels[strChr][aiByLabel], np.arange(self.iLabels + 1), side='left')
+            self.hIndex[strChr] = [aiByLabel[aiBounds[iLabel]:aiBounds[iLabel + 1]] for iLabel in xrange(self.iLabels)]
+            if bUnion:
+                for iLabel, aiIndex in enumerate(self.hIndex[strChr]):
+                    if len(aiIndex):
+                        self.aTracks[iLabel].add_chromosome(strChr, *coveragetrack.collapse_arrays(
+                            self.hStarts[strChr][aiIndex], self.hStops[strChr][aiIndex]))
+            else:
+                # Running maximum stop of each set along its own intervals
+                self.hRunning[strChr] = [np.maximum.accumulate(self.hStops[strChr][aiIndex])
+                                         for aiIndex in self.hIndex[strChr]]
+
+    def first_hits(self, iLabel, strChr, npArStarts, npArStops):
+        """
+        bp overlap of each query interval with the first interval of set iLabel whose stop reaches the query start,
+        or 0 if that interval does not overlap it, as randomoverlaps.overlap scores a single against list
+
+        """
+        if strChr not in self.hRunning or not len(self.hRunning[strChr][iLabel]):
+            return np.zeros(npArStarts.shape, dtype=np.int64)
+        npArRunning = self.hRunning[strChr][iLabel]
+        aiFirst = np.searchsorted(npArRunning, npArStarts, side='left')
+        abFound = aiFirst < len(npArRunning)
+        aiFirst = self.hIndex[strChr][iLabel][np.minimum(aiFirst, len(npArRunning) - 1)]
+        npArAgainstStarts = self.hStarts[strChr][aiFirst]
+        npArBP = np.minimum(npArStops, self.hStops[strChr][aiFirst]) - np.maximum(npArStarts, npArAgainstStarts) + 1
+        return np.where(abFound & (npArAgainstStarts <= npArStops), npArBP, 0)
+
+    def covered(self, iLabel, strChr, npArStarts, npArStops):
+        """ bp overlap of each query interval with set iLabel """
+        if self.bUnion:
+            return self.aTracks[iLabel].covered(strChr, npArStarts, npArStops)
+        return self.first_hits(iLabel, strChr, npArStarts, npArStops)
+
+    def batch_overlap(self, npArChr, npArStarts, npArStops):
+        """
+        Score many placement sets against every set at once. Each argument is an array with one row per iteration and
+        one column per placed interval. Returns arrays with one row per set of the number of overlapping intervals
+        and total bp overlap of each iteration
+
+        """
+        npArChr = np.atleast_2d(npArChr)
+        npArStarts = np.atleast_2d(np.asarray(npArStarts, dtype=np.int64))
+        npArStops = np.atleast_2d(np.asarray(npArStops, dtype=np.int64))
+        npArCovered = np.zeros((self.iLabels,) + npArStarts.shape, dtype=np.int64)
+        for strChr in np.unique(npArChr):
+            abMask = npArChr == strChr
+            npArChrStarts = npArStarts[abMask]
+            npArChrStops = npArStops[abMask]
+            for iLabel in xrange(self.iLabels):
+                npArCovered[iLabel][abMask] = self.covered(iLabel, strChr, npArChrStarts, npArChrStops)
+        return (npArCovered > 0).sum(axis=2), npArCovered.sum(axis=2)
+
+    def overlap(self, aaIntervals):
+        """ (count, bp) overlap of a list of intervals with each set """
+        if not aaIntervals:
+            return [(0, 0)] * self.iLabels
+        aaCounts, aaBP = self.batch_overlap(*coveragetrack.to_arrays([aaIntervals]))
+        return [(int(aCounts[0]), int(aBP[0])) for aCounts, aBP in zip(aaCounts, aaBP)]
+
+    def distribution(self, npArChr, npArStarts, npArStops):
+        """ [count, bp] overlaps of each placement set with each set, as one list per set """
+        aaCounts, aaBP = self.batch_overlap(npArChr, npArStarts, npArStops)
+        return [[[int(iCount), int(iBP)] for iCount, iBP in zip(aCounts, aBP)] for aCounts, aBP in zip(aaCounts, aaBP)]
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement scoring against several against files in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -9,6 +9,11 @@ per chromosome, and assumes the start coordinate is 0. Otherwise, it will expect
 multiple entries per chromosome and parse them accordingly, reading in the start
 and end coordinates from the header.
 
+Indexed inputs are read one entry at a time by random access: FASTA files with a samtools .fai index (built when
+missing, or when --chromosomes is given), bgzip-compressed FASTA files, and UCSC .2bit files, whose N runs and
+repeat-masked runs are taken from the file header without reading any bases. Use --chromosomes to process only
+some entries.
+
 Requirement: BioPython to parse FASTA files
 
 Copyright 2017 Harvard University, Wu Lab
@@ -27,6 +32,7 @@ limitations under the License.
 """
 try:
     import argparse
+    import os
     import re
     import sys
     from Bio import SeqIO
@@ -35,16 +41,39 @@ except ImportError as err:
     print "Missing a required module: {0}".format(err)
     sys.exit("Exiting...")
 
+try:
+    import kernels
+except ImportError:
+    kernels = None
+
+try:
+    import intervalio
+except ImportError:
+    intervalio = None
+
+try:
+    import indexedsequence
+except ImportError:
+    indexedsequence = None
+
 # Catch command-line arguments 
 parser = argparse.ArgumentParser(description="Returns coordinates of non-N stretches in the input FASTA file in "
                                              "interval format (1-based starts).")
-parser.add_argument("input", type=argparse.FileType("rU"),
-                    help="FASTA file")
+parser.add_argument("input",
+                    help="FASTA file, optionally gzip or bgzip-compressed, or a .2bit file. Use - to stream FASTA "
+                         "from stdin")
 parser.add_argument("-n", "--nonrep", action="store_true",
                     help="Convert repeat-masked bases to N and remove those regions from output intervals.")
 parser.add_argument("-g", "--genomic", action="store_true",
                     help="Expect one FASTA entry per chromosme and header that is only the chromosome number "
                          "(ex. >chr1)")
+parser.add_argument("-c", "--chromosomes", nargs="+",
+                    help="Only output intervals on these chromosomes, reading just their entries from an indexed "
+                         "input")
+parser.add_argument("-o", "--output",
+                    help="Write intervals to this file instead of stdout")
+parser.add_argument("-z", "--bgzip", action="store_true",
+                    help="bgzip-compress the output file and write a tabix index (.tbi) beside it. Requires -o")
 
 
 # Compile patterns for sequence parsing
@@ -52,7 +81,84 @@ repmasked_bases = re.compile(r'[actg]')
 unsequenced_bases = re.compile(r'[Nn]')
 
 
-def single_FASTA_parser(FileIn, nonrep):
+def non_n_intervals(strChr, strSeq, nonrep, iOffset):
+    """ Return intervals of the stretches of strSeq without Ns, with coordinates offset by iOffset """
+    if kernels and kernels.ENABLED:
+        return ["{0}\t{1}\t{2}".format(strChr, left + iOffset, right + iOffset)
+                for left, right in kernels.non_n_runs(strSeq, nonrep)]
+    if nonrep:
+        # Mask lower-case bases to Ns
+        strSeq = repmasked_bases.sub("N", strSeq)
+
+    # Reset counters and lists, adjust abs_count so that it correctly counts bases
+    abs_count = iOffset
+    left = 0
+    aCoordinates = []
+    # Count bases, excluding Ns
+    for base in strSeq:
+        abs_count += 1
+        if unsequenced_bases.match(str(base)):
+            if left:
+                # Subtract 1 because abs_count is at an N
+                right = (abs_count - 1)
+                aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
+                # Clear line and left/right counts
+                left = 0
+            else:
+                pass
+        else:
+            if not left:
+                # Set left boundary to first non-N base
+                left = abs_count
+            else:
+                pass
+    if left:
+        # If interval is open but not closed and parser has run through all
+        # bases for that entry, close interval and append to output
+        right = abs_count
+        aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
+    return aCoordinates
+
+
+def entry_location(strName, genomic):
+    """ Chromosome and offset of a FASTA entry, from its header as described above """
+    if genomic:
+        return strName, 0
+    astrSeqRecord = strName.strip().split("_")
+    return astrSeqRecord[1], int(astrSeqRecord[2]) - 1
+
+
+def indexed_parser(strPath, nonrep, genomic, aChromosomes=None):
+    """ Yield the intervals of each selected entry of an indexed FASTA, bgzip FASTA or 2bit file """
+    if indexedsequence is None:
+        print "Cannot find indexedsequence.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    oSequences = indexedsequence.open_indexed(strPath)
+    if nonrep:
+        sys.stderr.write("Removing repeat-masked elements..." + "\n")
+    for strName in oSequences.names():
+        strChr, iOffset = entry_location(strName, genomic)
+        if aChromosomes and strChr not in aChromosomes:
+            continue
+        if isinstance(oSequences, indexedsequence.TwoBitFile):
+            # N runs and repeat-masked runs are read from the 2bit header
+            aCoordinates = ["{0}\t{1}\t{2}".format(strChr, left + iOffset, right + iOffset)
+                            for left, right in oSequences.runs(strName, nonrep)]
+        else:
+            aCoordinates = non_n_intervals(strChr, oSequences.sequence(strName), nonrep, iOffset)
+        yield aCoordinates
+
+
+def use_index(strPath, aChromosomes):
+    """ Read the input by random access if it is compressed, 2bit or indexed, or if only some chromosomes are wanted """
+    if strPath == "-" or indexedsequence is None:
+        return False
+    if aChromosomes or os.path.isfile(strPath + ".fai"):
+        return True
+    return indexedsequence.file_format(strPath) != "fasta"
+
+
+def single_FASTA_parser(FileIn, nonrep, aChromosomes=None):
     # Write message before looping through FASTA file
     if nonrep:
         sys.stderr.write("Removing repeat-masked elements..." + "\n")
@@ -62,45 +168,17 @@ def single_FASTA_parser(FileIn, nonrep):
         # Parse seq_record to give the chromosome name and sequence as a string
         # Expects that FASTA entry header is only the chromosome line (ex. chr1)
         strChr = seq_record.id
+        if aChromosomes and strChr not in aChromosomes:
+            continue
         strSeq = str(seq_record.seq)
 
-        if nonrep:
-            # Mask lower-case bases to Ns
-            strSeq = repmasked_bases.sub("N", strSeq)
-
-        # Reset counters and lists, assumes FASTA entry starts at the beginning
-        # of chromosome
-        abs_count = 0
-        left = 0
-        aCoordinates = []
-        # Count bases, excluding Ns
-        for base in strSeq:
-            abs_count += 1
-            if unsequenced_bases.match(str(base)):
-                if left:
-                    # Subtract 1 because abs_count is at an N
-                    right = (abs_count - 1)
-                    aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
-                    # Clear line and left/right counts
-                    left = 0
-                else:
-                    pass
-            else:
-                if not left:
-                    # Set left boundary to first non-N base
-                    left = abs_count
-                else:
-                    pass
-        if left:
-            # If interval is open but not closed and parser has run through all
-            # bases for that entry, close interval and append to output
-            right = abs_count
-            aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
-            # Write intervals to stdout
-        stdout_writer(aCoordinates)
-
-
-def multi_FASTA_parser(FileIn, nonrep):
+        # Assumes FASTA entry starts at the beginning of chromosome
+        aCoordinates = non_n_intervals(strChr, strSeq, nonrep, 0)
+        # Pass on the intervals of each entry to be written
+        yield aCoordinates
+
+
+def multi_FASTA_parser(FileIn, nonrep, aChromosomes=None):
     # Write message before looping through FASTA file
     if nonrep:
         sys.stdout.write("Removing repeat-masked elements..." + "\n")
@@ -112,51 +190,50 @@ def multi_FASTA_parser(FileIn, nonrep):
         astrSeqRecord = str(seq_record.id).strip().split("_")
         strChr = astrSeqRecord[1]
         strRecStart = astrSeqRecord[2]
+        if aChromosomes and strChr not in aChromosomes:
+            continue
         strSeq = str(seq_record.seq)
 
-        if nonrep:
-            # Mask lower-case bases to Ns
-            strSeq = repmasked_bases.sub("N", strSeq)
-
-        # Reset counters and lists, assign interval start and end
-        # Adjust abs_count so that it correctly counts bases
-        abs_count = int(strRecStart) - 1
-        left = 0
-        aCoordinates = []
-        # Count bases, excluding Ns
-        for base in strSeq:
-            abs_count += 1
-            if unsequenced_bases.match(str(base)):
-                if left:
-                    # Subtract 1 because abs_count is at an N
-                    right = (abs_count - 1)
-                    aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
-                    # Clear line and left/right counts
-                    left = 0
-                else:
-                    pass
-            else:
-                if not left:
-                    # Set left boundary to first non-N base
-                    left = abs_count
-                else:
-                    pass
-        if left:
-            # If interval is open but not closed and parser has run through all
-            # bases for that entry, close interval and append to output
-            right = abs_count
-            aCoordinates.append("{0}\t{1}\t{2}".format(strChr, left, right))
-            # Write intervals to stdout
-        stdout_writer(aCoordinates)
+        # Offset coordinates by the entry start given in the header
+        aCoordinates = non_n_intervals(strChr, strSeq, nonrep, int(strRecStart) - 1)
+        # Pass on the intervals of each entry to be written
+        yield aCoordinates
 
 
 def stdout_writer(aList):
     print '\n'.join(aList)
 
 
+def entry_intervals(strInput, nonrep, genomic, aChromosomes=None):
+    """ Yield the intervals of each entry of the input, reading it by random access where possible """
+    if use_index(strInput, aChromosomes):
+        return indexed_parser(strInput, nonrep, genomic, aChromosomes)
+    if strInput == "-":
+        FileIn = sys.stdin
+    elif intervalio:
+        FileIn = intervalio.open_input(strInput)
+    else:
+        FileIn = open(strInput, "rU")
+    if genomic:
+        return single_FASTA_parser(FileIn, nonrep, aChromosomes)
+    return multi_FASTA_parser(FileIn, nonrep, aChromosomes)
+
+
 if __name__ == "__main__":
     args = parser.parse_args()
-    if args.genomic:
-        single_FASTA_parser(args.input, args.nonrep)
+    if args.bgzip and not args.output:
+        parser.error("-z/--bgzip requires -o/--output")
+    if args.output and intervalio is None:
+        print "Cannot find intervalio.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    if args.output:
+        aaIntervals = (strLine.split("\t") for aCoordinates in
+                       entry_intervals(args.input, args.nonrep, args.genomic, args.chromosomes)
+                       for strLine in aCoordinates)
+        if args.bgzip:
+            # Entries of a multi-FASTA file may come in any order, but an indexed output must be sorted
+            aaIntervals = sorted(aaIntervals, key=lambda x: (x[0], int(x[1]), int(x[2])))
+        intervalio.write_intervals(aaIntervals, args.output, args.bgzip)
     else:
-        multi_FASTA_parser(args.input, args.nonrep)
+        for aCoordinates in entry_intervals(args.input, args.nonrep, args.genomic, args.chromosomes):
+            stdout_writer(aCoordinates)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+'''
+Module to implement the constant-memory statistics mode (--online) of randomoverlaps.py
+
+The [count, bp] overlaps of random sets are summarised as each iteration finishes instead of being kept in a list:
+the mean and variance of bp are updated with Welford's method, min, max and the number of random sets at or beyond
+the observed overlap on either side are counted, and a uniform reservoir sample of bounded size is kept for the KS
+test. Memory does not grow with the number of iterations.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import random
+import sys
+
+
+class RunningDistribution(object):
+    """
+    Stand-in for the list of [count, bp] overlaps built by randomoverlaps.distribution, summarising each row as it is
+    appended. The reservoir draws from its own random generator so that random sets are not changed by it, and rows
+    may be written to fhOut as they arrive
+
+    """
+
+    def __init__(self, iObservedBP, iReservoir=10000, iSeed=None, fhOut=None):
+        self.iObservedBP = iObservedBP
+        self.iReservoir = iReservoir
+        self.oRandom = random.Random(iSeed)
+        self.fhOut = fhOut
+        self.iCount = 0
+        self.iSum = 0
+        self.dMean = 0.0
+        self.dM2 = 0.0
+        self.iMin = self.iMax = None
+        self.iLessOrEqual = 0
+        self.iGreaterOrEqual = 0
+        self.aReservoir = []
+
+    def __len__(self):
+        return self.iCount
+
+    def append(self, aRow):
+        iBP = aRow[1]
+        if self.fhOut:
+            # Rows are separated, not terminated, by newlines as in write_distribution
+            self.fhOut.write(("\n" if self.iCount else "") + "\t".join(map(str, aRow)))
+        self.iCount += 1
+        self.iSum += iBP
+        dDelta = iBP - self.dMean
+        self.dMean += dDelta / self.iCount
+        self.dM2 += dDelta * (iBP - self.dMean)
+        if self.iMin is None or iBP < self.iMin:
+            self.iMin = iBP
+        if self.iMax is None or iBP > self.iMax:
+            self.iMax = iBP
+        if iBP <= self.iObservedBP:
+            self.iLessOrEqual += 1
+        if iBP >= self.iObservedBP:
+            self.iGreaterOrEqual += 1
+        # Keep a uniform sample of the bp overlaps seen so far (Algorithm R)
+        if len(self.aReservoir) < self.iReservoir:
+            self.aReservoir.append(iBP)
+        else:
+            j = self.oRandom.randrange(self.iCount)
+            if j < self.iReservoir:
+                self.aReservoir[j] = iBP
+
+    def extend(self, aRows):
+        for aRow in aRows:
+            self.append(aRow)
+
+    def close(self):
+        if self.fhOut:
+            self.fhOut.close()
+
+    def variance(self):
+        """ Sample variance of the bp overlaps """
+        return self.dM2 / (self.iCount - 1)
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the constant-memory statistics mode in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Submits a randomoverlaps.py job to a running overlapserver.py and prints the stats row in the same format as
+randomoverlaps.py. Only the standard library is imported, so each call starts quickly.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import urllib2
+
+HEADER = "n\tbp\tmean\ts.d.\tmin\tmax\tproportion\tksPval\tKSresult\tp-value\tObs/Exp\tZtestResult\n"
+
+
+def cluster_input(string):
+    value = int(string)
+    if not value > 0:
+        msg = "Cluster width must be greater than 0 kb"
+        raise argparse.ArgumentTypeError(msg)
+    return value
+
+
+def getArgs(strInput=None):
+    parser = argparse.ArgumentParser(description="Runs a depletion analysis on a running overlapserver.py. The UCE "
+                                                 "subset and its genome space are those loaded by the server; the "
+                                                 "against file is read by the server, so its path must be visible to "
+                                                 "it. Give either --socket or --port.")
+    parser.add_argument("-s", "--subset", required=True,
+                        help="Name of the UCE subset loaded by the server")
+    parser.add_argument("-a", "--against", required=True,
+                        help="The set of intervals that are being tested for overlap with UCEs")
+    parser.add_argument("-i", "--iterations", type=int, default=1000,
+                        help="The number of random sets created to build an expected distribution [default=1000]")
+    parser.add_argument("-c", "--cluster", type=cluster_input,
+                        help="The maximum size to cluster adjacent intervals (kb)")
+    parser.add_argument("--union", action="store_true",
+                        help="Score bp overlap as coverage of the collapsed against set")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--socket",
+                       help="Unix socket the server is listening on")
+    group.add_argument("--port", type=int,
+                       help="Port the server is listening on for HTTP requests")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Host of the HTTP server [default=127.0.0.1]")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+def submit(hJob, strSocket=None, iPort=None, strHost="127.0.0.1"):
+    """ Send a job to the server and return the decoded response """
+    strRequest = json.dumps(hJob)
+    if strSocket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(strSocket)
+            sock.sendall(strRequest + "\n")
+            strResponse = sock.makefile().readline()
+        finally:
+            sock.close()
+    else:
+        strResponse = urllib2.urlopen("http://{0}:{1}/".format(strHost, iPort), strRequest).read()
+    return json.loads(strResponse)
+
+
+def main(args):
+    hJob = {"subset": args.subset, "against": os.path.abspath(args.against), "iterations": args.iterations,
+            "cluster": args.cluster, "union": args.union}
+    try:
+        hResponse = submit(hJob, args.socket, args.port, args.host)
+    except (socket.error, urllib2.URLError) as err:
+        print "Could not reach the server: {0}".format(err)
+        sys.exit(1)
+    if "error" in hResponse:
+        print "Server could not run job: {0}".format(hResponse["error"])
+        sys.exit(1)
+    return hResponse["stats"]
+
+
+if __name__ == "__main__":
+    args = getArgs()
+    aStats = main(args)
+    print HEADER
+    print "\t".join(map(str, aStats))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Long-running server for randomoverlaps.py. Genome spaces, UCE subsets and their weighted sampling spaces are read once
+at startup and kept in memory, so each job only pays for reading its against file and running the iterations. Jobs are
+accepted as single JSON lines over a local Unix socket, or as JSON POST requests over HTTP on localhost, and answered
+with the same stats row that randomoverlaps.writer prints. Use overlapclient.py to submit jobs.
+
+Each UCE subset is given as a name, the UCE file and the genome space it is drawn from, for example:
+
+$ python overlapserver.py --socket /tmp/uce.sock -s all all_uces.txt hg18.genomic.coordinates.nonN \
+    -s exonic exonic_uces.txt exonic.boundaries.nonN
+
+Jobs are run one at a time, in the order they arrive.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import BaseHTTPServer
+import json
+import logging
+import os
+import SocketServer
+import sys
+import traceback
+from collections import OrderedDict
+
+import intervalio
+import randomoverlaps as ro
+
+
+def get_args(strInput=None):
+    parser = argparse.ArgumentParser(description="Runs randomoverlaps.py as a server, keeping genome spaces and UCE "
+                                                 "subsets in memory between jobs. Give either --socket or --port.")
+    parser.add_argument('-s', '--subset', nargs=3, action='append', required=True,
+                        metavar=('NAME', 'UCES', 'SPACE'),
+                        help="A UCE subset name, its UCE file and its genome space file. May be given several times")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--socket',
+                       help="Path of the Unix socket to listen on")
+    group.add_argument('--port', type=int,
+                       help="Port to listen on for HTTP requests (localhost only)")
+    parser.add_argument('-c', '--cluster', type=ro.cluster_input, nargs='+', default=[],
+                        help="Cluster widths (kb) whose reduced sampling spaces are built at startup. Other widths "
+                             "are built on first use")
+    parser.add_argument('--against-cache', type=int, default=4,
+                        help="Number of parsed against files kept in memory [default=4]")
+    parser.add_argument('-d', '--debug',
+                        help="Debug level [default = None]")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+class ResidentData(object):
+    """ Parsed inputs and derived sampling structures shared by every job """
+
+    def __init__(self, aaSubsets, iAgainstCache):
+        self.hSubsets = {}
+        self.hUCEs = {}
+        self.hSpaces = {}
+        self.hWeighted = {}
+        self.hAgainst = OrderedDict()
+        self.iAgainstCache = iAgainstCache
+        for strName, strUCEs, strSpace in aaSubsets:
+            self.hSubsets[strName] = (strUCEs, strSpace)
+            if strUCEs not in self.hUCEs:
+                with intervalio.open_input(strUCEs) as fh:
+                    aUCEs = ro.read_intervals(fh)
+                aUCEs.sort(key=lambda x: (x[0], x[1], x[2]))
+                self.hUCEs[strUCEs] = aUCEs
+            if strSpace not in self.hSpaces:
+                with intervalio.open_input(strSpace) as fh:
+                    aSpace = ro.read_intervals(fh)
+                aSpace.sort(key=lambda x: (x[0], x[1]))
+                self.hSpaces[strSpace] = aSpace
+            logging.info("Loaded subset {} ({} UCEs, {} space intervals)".format(strName, len(self.hUCEs[strUCEs]),
+                                                                                len(self.hSpaces[strSpace])))
+
+    def weighted(self, strSpace, iCluster):
+        """ Weighted sampling space and chromosome ends for a genome space and cluster width, built once """
+        tKey = (strSpace, iCluster)
+        if tKey not in self.hWeighted:
+            self.hWeighted[tKey] = ro.weighted_space(self.hSpaces[strSpace], iCluster)
+        return self.hWeighted[tKey]
+
+    def against(self, strPath, bUnion):
+        """ Sorted against intervals and coverage track, reused while the file is unchanged """
+        oStat = os.stat(strPath)
+        tKey = (strPath, oStat.st_mtime, oStat.st_size, bUnion)
+        if tKey in self.hAgainst:
+            self.hAgainst[tKey] = self.hAgainst.pop(tKey)
+            return self.hAgainst[tKey]
+        oTrack = None
+        if bUnion and ro.genomemask and ro.genomemask.is_mask(strPath):
+            aAgainst = []
+            oTrack = ro.genomemask.GenomeMask(strPath)
+        else:
+            with intervalio.open_input(strPath) as fh:
+                aAgainst = ro.read_intervals(fh)
+            aAgainst.sort(key=lambda x: (x[0], x[1], x[2]))
+            if bUnion:
+                oTrack = ro.coverage_track(aAgainst)
+        self.hAgainst[tKey] = (aAgainst, oTrack)
+        while len(self.hAgainst) > self.iAgainstCache:
+            self.hAgainst.popitem(last=False)
+        return aAgainst, oTrack
+
+    def run(self, hJob):
+        """ Run one job and return its stats row """
+        strSubset = hJob["subset"]
+        if strSubset not in self.hSubsets:
+            raise Exception("Unknown UCE subset {0}, loaded subsets are: {1}".format(
+                strSubset, ", ".join(sorted(self.hSubsets))))
+        strUCEs, strSpace = self.hSubsets[strSubset]
+        iIterations = int(hJob.get("iterations", 1000))
+        iCluster = hJob.get("cluster")
+        if iCluster is not None:
+            iCluster = ro.cluster_input(iCluster)
+        bUnion = bool(hJob.get("union", False))
+        strAgainst = hJob["against"]
+        logging.info("Running {} against {} {} times".format(strSubset, strAgainst, iIterations))
+        aUCEs = self.hUCEs[strUCEs]
+        aAgainst, oTrack = self.against(strAgainst, bUnion)
+        # No intermediate files are written from the server
+        return ro.analyse(aUCEs, aAgainst, None, iIterations, iCluster, bUnion, None, self.weighted(strSpace, iCluster),
+                          oTrack).stats
+
+
+def handle_job(oData, strRequest):
+    """ Decode a JSON job, run it and return the JSON response """
+    try:
+        hJob = json.loads(strRequest)
+        hResponse = {"stats": oData.run(hJob)}
+    except SystemExit as err:
+        # randomoverlaps exits on unplaceable inputs, which must not stop the server
+        hResponse = {"error": str(err.code)}
+    except Exception as err:
+        logging.debug(traceback.format_exc())
+        hResponse = {"error": "{0}: {1}".format(type(err).__name__, err)}
+    return json.dumps(hResponse)
+
+
+class SocketHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        strRequest = self.rfile.readline()
+        if strRequest.strip():
+            self.wfile.write(handle_job(self.server.oData, strRequest) + "\n")
+
+
+class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        strRequest = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        strResponse = handle_job(self.server.oData, strRequest)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(strResponse)))
+        self.end_headers()
+        self.wfile.write(strResponse)
+
+    def do_GET(self):
+        strResponse = json.dumps({"subsets": sorted(self.server.oData.hSubsets)})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(strResponse)))
+        self.end_headers()
+        self.wfile.write(strResponse)
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+
+def main(args):
+    if args.debug:
+        log_level = ro.LOGGING_LEVELS.get(args.debug.lower(), logging.NOTSET)
+        logging.basicConfig(level=log_level, format='%(asctime)s\t%(levelname)s\t%(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S')
+    else:
+        logging.basicConfig()
+    oData = ResidentData(args.subset, args.against_cache)
+    for strName, strUCEs, strSpace in args.subset:
+        oData.weighted(strSpace, None)
+        for iCluster in args.cluster:
+            oData.weighted(strSpace, iCluster)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = SocketServer.UnixStreamServer(args.socket, SocketHandler)
+        strAddress = args.socket
+    else:
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", args.port), HTTPHandler)
+        strAddress = "http://127.0.0.1:{0}".format(args.port)
+    server.oData = oData
+    sys.stderr.write("Serving {0} UCE subsets on {1}\n".format(len(oData.hSubsets), strAddress))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write("Shutting down...\n")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+"""
+Runs the depletion analysis workflow in one process, as set out in a config file
+
+The separate scripts (nonNcoordinates.py -> collapsecoordinates.py -> sumcoordinates.py -> randomoverlaps_driver.py ->
+recurrentUCEs.py) hand text files from one step to the next, each parsing and sorting them again. Here each stage
+passes its intervals, sorted by chromosome, start and stop, to the next in memory, and files between stages are only
+written where the config names them. Each stage is keyed on a checksum of its options and input files, chained
+through the keys of the stages it reads from, and the keys of finished stages are kept in a stamps file. A stage whose
+key and output files are unchanged is skipped, and a stage is only run when a later one needs it.
+
+Example config (paths are relative to the config file, lists are separated by whitespace):
+
+    [pipeline]
+    ; Keys of finished stages [default: <config>.stamps]
+    stamps = pipeline.stamps
+
+    [genome]
+    ; nonNcoordinates.py: the genome space of non-N stretches
+    fasta = hg18.fa
+    genomic = yes
+    nonrep = no
+    chromosomes = chr1 chr2
+    ; Write the genome space here, and read it back while the FASTA and options are unchanged
+    output = hg18.genomic.coordinates.nonN
+
+    [against]
+    ; collapsecoordinates.py: the variant files, collapsed for summary and overlaps
+    files = cnv1.txt cnv2.txt
+    ; Write collapsed copies (<file name>.collapsed) to this directory
+    output_dir = collapsed
+
+    [summary]
+    ; sumcoordinates.py
+    output = summary.txt
+    chromosomes = no
+    uncollapse = no
+
+    [overlaps]
+    ; randomoverlaps_driver.py: each UCE file against each collapsed variant file
+    uces = all.uces exonic.uces
+    ; A genome space file to use instead of the [genome] stage
+    space =
+    iterations = 1000
+    seed = 1
+    cluster =
+    output = results.txt
+    db =
+
+    [recurrence]
+    ; recurrentUCEs.py: the UCE master file checked against the uncollapsed variant files
+    uces = uce_master.txt
+    output = recurrent_UCEs.txt
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import ConfigParser
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import collapsecoordinates
+import intervalio
+import randomoverlaps as ro
+import randomoverlaps_driver as driver
+import recurrentUCEs
+import sumcoordinates
+
+STAGES = ("genome", "against", "summary", "overlaps", "recurrence")  # Config sections, in the order they are run
+READ_SIZE = 1 << 20
+
+
+def get_args(strInput=None):
+    """
+
+    Collect arguments from command-line, or from strInput if given (only used for debugging)
+    """
+    parser = argparse.ArgumentParser(description="Runs the nonNcoordinates.py, collapsecoordinates.py, "
+                                                 "sumcoordinates.py, randomoverlaps_driver.py and recurrentUCEs.py "
+                                                 "steps in one process, as set out in a config file (see the top of "
+                                                 "this script for an example). Intervals are passed between stages in "
+                                                 "memory, and stages whose inputs are unchanged since the last run "
+                                                 "are skipped")
+    parser.add_argument("config", help="The pipeline config file")
+    parser.add_argument("-s", "--stages", nargs="+", choices=STAGES,
+                        help="Only run these stages, and any they need [default: every stage in the config]")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Run every stage again, even if its inputs are unchanged")
+    if strInput:
+        print "Given debug argument string: {0}".format(strInput)
+        return parser.parse_args(strInput.split())
+    return parser.parse_args()
+
+
+def file_state(strPath):
+    """ Size and modification time of a file """
+    oStat = os.stat(strPath)
+    return [oStat.st_size, oStat.st_mtime]
+
+
+def load_stamps(strPath):
+    """ Read the stamps file, starting afresh if it is missing or unreadable """
+    if os.path.isfile(strPath):
+        try:
+            with open(strPath) as fh:
+                return json.load(fh)
+        except ValueError:
+            logging.warning("Could not read stamps file {0}, running every stage".format(strPath))
+    return {"files": {}, "stages": {}}
+
+
+def save_stamps(strPath, hStamps):
+    """ Write the stamps file, replacing the previous one only once it is complete """
+    iHandle, strTemp = tempfile.mkstemp(dir=os.path.dirname(strPath), suffix=".tmp")
+    with os.fdopen(iHandle, "w") as fh:
+        json.dump(hStamps, fh, indent=1, sort_keys=True)
+    os.rename(strTemp, strPath)
+
+
+def write_intervals(aIntervals, strPath):
+    with open(strPath, "w") as fh:
+        for aInterval in aIntervals:
+            fh.write("{0}\t{1}\t{2}\n".format(*aInterval))
+
+
+def non_n(strFasta, bNonrep, bGenomic, aChromosomes=None):
+    """ Sorted non-N intervals of a FASTA or 2bit file, as written by nonNcoordinates.py """
+    try:
+        import nonNcoordinates
+    except ImportError:
+        print "Cannot find nonNcoordinates.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    aIntervals = [ro.formatInt(strLine.split("\t"))
+                  for aCoordinates in nonNcoordinates.entry_intervals(strFasta, bNonrep, bGenomic, aChromosomes)
+                  for strLine in aCoordinates]
+    aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
+    return aIntervals
+
+
+class Pipeline(object):
+    """ The stages of one config, each computed at most once, and only when needed """
+
+    def __init__(self, strConfig, bForce=False):
+        self.oConfig = ConfigParser.SafeConfigParser()
+        try:
+            if not self.oConfig.read(strConfig):
+                print "Cannot find config file {0}, exiting...".format(strConfig)
+                sys.exit(1)
+        except ConfigParser.Error as err:
+            print "Cannot read config file {0} ({1}), exiting...".format(strConfig, err)
+            sys.exit(1)
+        self.strDir = os.path.dirname(os.path.abspath(strConfig))
+        self.bForce = bForce
+        self.strStamps = self.path(self.get("pipeline", "stamps") or os.path.basename(strConfig) + ".stamps")
+        self.hStamps = load_stamps(self.strStamps)
+        # Results of stages that have been computed, and sorted intervals of each variant file read so far
+        self.hResults = {}
+        self.hRaw = {}
+
+    def has(self, strSection):
+        return self.oConfig.has_section(strSection)
+
+    def get(self, strSection, strOption, default=None):
+        if self.oConfig.has_option(strSection, strOption) and self.oConfig.get(strSection, strOption).strip():
+            return self.oConfig.get(strSection, strOption).strip()
+        return default
+
+    def require(self, strSection, strOption):
+        strValue = self.get(strSection, strOption)
+        if strValue is None:
+            print "Config must give {0} in the [{1}] section, exiting...".format(strOption, strSection)
+            sys.exit(1)
+        return strValue
+
+    def get_list(self, strSection, strOption):
+        return self.get(strSection, strOption, "").split()
+
+    def get_int(self, strSection, strOption, default=None):
+        strValue = self.get(strSection, strOption)
+        if strValue is None:
+            return default
+        try:
+            return int(strValue)
+        except ValueError:
+            print "{0} in the [{1}] section must be a whole number, exiting...".format(strOption, strSection)
+            sys.exit(1)
+
+    def get_bool(self, strSection, strOption):
+        if self.get(strSection, strOption) is None:
+            return False
+        try:
+            return self.oConfig.getboolean(strSection, strOption)
+        except ValueError:
+            print "{0} in the [{1}] section must be yes or no, exiting...".format(strOption, strSection)
+            sys.exit(1)
+
+    def path(self, strPath):
+        """ A path from the config, relative to the config file """
+        return os.path.join(self.strDir, strPath) if strPath else None
+
+    def digest(self, strPath):
+        """ Checksum of an input file, reusing the recorded one while its size and modification time are unchanged """
+        if not os.path.isfile(strPath):
+            print "Cannot find {0}, exiting...".format(strPath)
+            sys.exit(1)
+        aState = file_state(strPath)
+        aRecord = self.hStamps["files"].get(strPath)
+        if aRecord and aRecord[:2] == aState:
+            return aRecord[2]
+        oHash = hashlib.sha256()
+        with open(strPath, "rb") as fh:
+            for strData in iter(lambda: fh.read(READ_SIZE), ""):
+                oHash.update(strData)
+        self.hStamps["files"][strPath] = aState + [oHash.hexdigest()]
+        return oHash.hexdigest()
+
+    def key(self, strStage, aInputs, aUpstream=()):
+        """ Checksum of a stage's options, its input files and the keys of the stages it reads from """
+        aOptions = sorted(self.oConfig.items(strStage)) if self.has(strStage) else []
+        aDigests = [(strPath, self.digest(strPath)) for strPath in aInputs]
+        return hashlib.sha256(json.dumps([strStage, aOptions, aDigests, list(aUpstream)])).hexdigest()
+
+    def current(self, strStage, strKey, aOutputs):
+        """ True if the stage last finished with this key, and its outputs are as it left them """
+        hStamp = self.hStamps["stages"].get(strStage)
+        if self.bForce or not hStamp or hStamp["key"] != strKey:
+            return False
+        for strPath in aOutputs:
+            if not os.path.isfile(strPath) or hStamp["outputs"].get(strPath) != file_state(strPath):
+                return False
+        return True
+
+    def finish(self, strStage, strKey, aOutputs):
+        """ Record that the stage finished with this key """
+        self.hStamps["stages"][strStage] = {"key": strKey,
+                                            "outputs": dict([(strPath, file_state(strPath)) for strPath in aOutputs])}
+        save_stamps(self.strStamps, self.hStamps)
+
+    def genome_key(self):
+        if "genome_key" not in self.hResults:
+            self.hResults["genome_key"] = self.key("genome", [self.path(self.require("genome", "fasta"))])
+        return self.hResults["genome_key"]
+
+    def genome_output(self):
+        return [self.path(self.get("genome", "output"))] if self.get("genome", "output") else []
+
+    def genome(self):
+        """ Non-N intervals of the [genome] FASTA, sorted by chr, start, stop """
+        if "genome" not in self.hResults:
+            strFasta = self.path(self.require("genome", "fasta"))
+            aOutputs = self.genome_output()
+            if aOutputs and self.current("genome", self.genome_key(), aOutputs):
+                print "Reading genome space from {0}, its inputs are unchanged".format(aOutputs[0])
+                self.hResults["genome"] = ro.load_intervals(aOutputs[0])
+            else:
+                print "Finding non-N intervals of {0}".format(strFasta)
+                self.hResults["genome"] = non_n(strFasta, self.get_bool("genome", "nonrep"),
+                                                self.get_bool("genome", "genomic"),
+                                                self.get_list("genome", "chromosomes"))
+                if aOutputs:
+                    write_intervals(self.hResults["genome"], aOutputs[0])
+                    self.finish("genome", self.genome_key(), aOutputs)
+                    print "Wrote genome space to {0}".format(aOutputs[0])
+        return self.hResults["genome"]
+
+    def against_files(self):
+        """ (name in the config, path) of each variant file """
+        aFiles = [(strName, self.path(strName)) for strName in self.get_list("against", "files")]
+        if not aFiles:
+            print "Config must give files in the [against] section, exiting..."
+            sys.exit(1)
+        return aFiles
+
+    def against_key(self):
+        if "against_key" not in self.hResults:
+            self.hResults["against_key"] = self.key("against", [strPath for strName, strPath in self.against_files()])
+        return self.hResults["against_key"]
+
+    def against_output(self):
+        strDir = self.path(self.get("against", "output_dir"))
+        if not strDir:
+            return []
+        return [os.path.join(strDir, os.path.basename(strPath) + ".collapsed")
+                for strName, strPath in self.against_files()]
+
+    def raw(self, strPath):
+        """ Uncollapsed intervals of a variant file, sorted by chr, start, stop """
+        if strPath not in self.hRaw:
+            self.hRaw[strPath] = ro.load_intervals(strPath)
+        return self.hRaw[strPath]
+
+    def collapsed(self):
+        """ (name, path, collapsed intervals) of each variant file """
+        if "collapsed" not in self.hResults:
+            aFiles = self.against_files()
+            aOutputs = self.against_output()
+            if aOutputs and self.current("against", self.against_key(), aOutputs):
+                print "Reading collapsed variant files, their inputs are unchanged"
+                aCollapsed = [ro.load_intervals(strOutput) for strOutput in aOutputs]
+            else:
+                # Intervals are already sorted, so they are collapsed without sorting again
+                aCollapsed = [collapsecoordinates.collapse(self.raw(strPath)) if self.raw(strPath) else []
+                              for strName, strPath in aFiles]
+                if aOutputs:
+                    if not os.path.isdir(os.path.dirname(aOutputs[0])):
+                        os.makedirs(os.path.dirname(aOutputs[0]))
+                    for aIntervals, strOutput in zip(aCollapsed, aOutputs):
+                        write_intervals(aIntervals, strOutput)
+                    self.finish("against", self.against_key(), aOutputs)
+                    print "Wrote collapsed variant files to {0}".format(os.path.dirname(aOutputs[0]))
+            self.hResults["collapsed"] = [(strName, strPath, aIntervals)
+                                          for (strName, strPath), aIntervals in zip(aFiles, aCollapsed)]
+        return self.hResults["collapsed"]
+
+    def make_genome(self):
+        """ Write the genome space, if the config names a file for it and it is out of date """
+        aOutputs = self.genome_output()
+        if not aOutputs:
+            return
+        if self.current("genome", self.genome_key(), aOutputs):
+            print "Skipping genome, its inputs are unchanged"
+        else:
+            self.genome()
+
+    def make_against(self):
+        """ Write the collapsed variant files, if the config names a directory for them and they are out of date """
+        aOutputs = self.against_output()
+        if not aOutputs:
+            return
+        if self.current("against", self.against_key(), aOutputs):
+            print "Skipping against, its inputs are unchanged"
+        else:
+            self.collapsed()
+
+    def make_summary(self):
+        """ Intervals and bases of each variant file, as sumcoordinates.py reports them """
+        strOutput = self.path(self.require("summary", "output"))
+        strKey = self.key("summary", [], [self.against_key()])
+        if self.current("summary", strKey, [strOutput]):
+            print "Skipping summary, its inputs are unchanged"
+            return
+        if self.get_bool("summary", "uncollapse"):
+            aaFiles = [(strName, self.raw(strPath)) for strName, strPath in self.against_files()]
+        else:
+            aaFiles = [(strName, aIntervals) for strName, strPath, aIntervals in self.collapsed()]
+        with open(strOutput, "w") as fh:
+            for strName, aIntervals in aaFiles:
+                iCount, iCoverage, aChromosomes = sumcoordinates.tally(aIntervals)
+                fh.write("{0}\t{1}\t{2}\n".format(strName, iCount, iCoverage))
+                if self.get_bool("summary", "chromosomes"):
+                    for strChr, iChrCount, iChrCoverage in aChromosomes:
+                        fh.write("{0}\t{1}\t{2}\t{3}\n".format(strName, strChr, iChrCount, iChrCoverage))
+        self.finish("summary", strKey, [strOutput])
+        print "Wrote summary to {0}".format(strOutput)
+
+    def make_overlaps(self):
+        """ Depletion analysis of each UCE file against each collapsed variant file, as randomoverlaps_driver.py """
+        aUCEFiles = [self.path(strPath) for strPath in self.get_list("overlaps", "uces")]
+        if not aUCEFiles:
+            print "Config must give uces in the [overlaps] section, exiting..."
+            sys.exit(1)
+        strSpace = self.path(self.get("overlaps", "space"))
+        if strSpace:
+            strKey = self.key("overlaps", aUCEFiles + [strSpace], [self.against_key()])
+        else:
+            if not self.has("genome"):
+                print "Config must give a space in the [overlaps] section or a [genome] section, exiting..."
+                sys.exit(1)
+            strKey = self.key("overlaps", aUCEFiles, [self.against_key(), self.genome_key()])
+        strOutput = self.path(self.get("overlaps", "output"))
+        strDb = self.path(self.get("overlaps", "db"))
+        if not strOutput and not strDb:
+            strOutput = self.path("results.txt")
+        # The results store is an output like the text file, so the stage reruns if it is removed or changed
+        aOutputs = [strPath for strPath in (strOutput, strDb) if strPath]
+        if self.current("overlaps", strKey, aOutputs):
+            print "Skipping overlaps, its inputs are unchanged"
+            return
+        iCluster = self.get_int("overlaps", "cluster")
+        iIterations = self.get_int("overlaps", "iterations", 1000)
+        iSeed = self.get_int("overlaps", "seed")
+        if strSpace:
+            aSpace = ro.load_intervals(strSpace)
+        else:
+            aSpace = self.genome()
+            strSpace = self.genome_output()[0] if self.genome_output() else self.path(self.get("genome", "fasta"))
+        tWeightedSpace = ro.weighted_space(aSpace, iCluster)
+        aSubsets = []
+        for strUCEFile in aUCEFiles:
+            aUCEs = ro.load_intervals(strUCEFile)
+            aSubsets.append((os.path.basename(strUCEFile), aUCEs, tWeightedSpace, len(aUCEs), strUCEFile, strSpace))
+        if strOutput:
+            driver.write_header(strOutput)
+        oStore = driver.open_store(strDb) if strDb else None
+        strRun = datetime.datetime.now().isoformat()
+        for strName, strPath, aAgainst in self.collapsed():
+            driver.run(strPath, aSubsets, iCluster, strOutput, iIterations, iSeed, oStore, strRun, aAgainst)
+        if oStore:
+            oStore.close()
+            print "Added results to " + strDb
+        self.finish("overlaps", strKey, aOutputs)
+        if strOutput:
+            print "Wrote results to " + strOutput
+
+    def make_recurrence(self):
+        """ Number of intervals of each uncollapsed variant file overlapping each UCE, as recurrentUCEs.py """
+        strUCEs = self.path(self.require("recurrence", "uces"))
+        strOutput = self.path(self.get("recurrence", "output", "recurrent_UCEs.txt"))
+        strKey = self.key("recurrence", [strUCEs], [self.against_key()])
+        if self.current("recurrence", strKey, [strOutput]):
+            print "Skipping recurrence, its inputs are unchanged"
+            return
+        aFiles = self.against_files()
+        with intervalio.open_input(strUCEs) as fh:
+            hUCEs = recurrentUCEs.uceDict(fh, len(aFiles))
+        oIndex = recurrentUCEs.uceIndex(hUCEs)
+        for n, (strName, strPath) in enumerate(aFiles):
+            print "Checking for UCE reoccurence in {0}".format(os.path.basename(strPath))
+            recurrentUCEs.count(self.raw(strPath), hUCEs, n, False, oIndex)
+        recurrentUCEs.write(hUCEs, strOutput, [os.path.basename(strPath) for strName, strPath in aFiles], False)
+        self.finish("recurrence", strKey, [strOutput])
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    oPipeline = Pipeline(args.config, args.force)
+    aStages = [strStage for strStage in STAGES if oPipeline.has(strStage) and
+               (not args.stages or strStage in args.stages)]
+    if not aStages:
+        print "Config has none of the stages to run ({0}), exiting...".format(", ".join(args.stages or STAGES))
+        sys.exit(1)
+    for strStage in aStages:
+        getattr(oPipeline, "make_" + strStage)()
+    # Record checksums of input files read by stages that were skipped as well
+    save_stamps(oPipeline.strStamps, oPipeline.hStamps)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    main(args)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+'''
+Module to implement the persistent null-placement cache in randomoverlaps.py
+
+Random placement sets depend only on the UCEs, the genome space, the cluster width, the seed and the number of
+iterations, so with a fixed seed they can be stored once and scored against any number of against files. Entries are
+content-addressed: the key is a hash of the parsed UCE and genome space intervals together with the run parameters.
+Each entry stores a checksum of its arrays, which is verified on load, and the cache evicts least recently used
+entries once it grows beyond its size limit.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 4
+
+
+def intervals_digest(aaIntervals):
+    """ Hash of a list of 3-column intervals, independent of their order """
+    oHash = hashlib.sha256()
+    for aInterval in sorted(aaIntervals, key=lambda x: (x[0], x[1], x[2])):
+        oHash.update("{0}\t{1}\t{2}\n".format(*aInterval))
+    return oHash.hexdigest()
+
+
+def cache_key(aUCEs, aGenomeSpaceIntervals, iCluster, iSeed, iIterations, aBlocks=None, strNull=None):
+    """
+    Content-addressed key for the placements of one run, or of the seed blocks drawn by one shard. strNull names a
+    null model other than independent random placement
+
+    """
+    oHash = hashlib.sha256()
+    oHash.update("version={0}\n".format(CACHE_VERSION))
+    oHash.update("uces={0}\n".format(intervals_digest(aUCEs)))
+    oHash.update("space={0}\n".format(intervals_digest(aGenomeSpaceIntervals)))
+    oHash.update("cluster={0}\nseed={1}\niterations={2}\n".format(iCluster, iSeed, iIterations))
+    if aBlocks:
+        oHash.update("blocks={0}-{1}\n".format(aBlocks[0][0], aBlocks[-1][0]))
+    if strNull:
+        oHash.update("null={0}\n".format(strNull))
+    return oHash.hexdigest()
+
+
+def arrays_checksum(aArrays):
+    oHash = hashlib.sha256()
+    for npAr in aArrays:
+        oHash.update(str(npAr.dtype))
+        oHash.update(str(npAr.shape))
+        oHash.update(np.ascontiguousarray(npAr).tobytes())
+    return oHash.hexdigest()
+
+
+def smallest_int(npAr):
+    """ Store coordinates in the smallest unsigned type that holds them """
+    return npAr.astype(np.min_scalar_type(int(npAr.max()) if npAr.size else 0))
+
+
+class PlacementCache(object):
+    """ Directory of cached placement arrays with a total size limit """
+
+    def __init__(self, strDir, iMaxBytes):
+        self.strDir = strDir
+        self.iMaxBytes = iMaxBytes
+        if not os.path.isdir(strDir):
+            os.makedirs(strDir)
+
+    def path(self, strKey):
+        return os.path.join(self.strDir, strKey + ".npz")
+
+    def get(self, strKey):
+        """ Return (chromosomes, codes, starts, stops) for the key, or None if absent or corrupt """
+        strPath = self.path(strKey)
+        if not os.path.isfile(strPath):
+            return None
+        try:
+            with np.load(strPath) as hEntry:
+                aChromosomes = [str(strChr) for strChr in hEntry["chromosomes"]]
+                aArrays = [hEntry["codes"], hEntry["starts"], hEntry["stops"]]
+                strChecksum = str(hEntry["checksum"])
+        except Exception as err:
+            logging.warning("Could not read cached placements {}: {}".format(strPath, err))
+            self.discard(strPath)
+            return None
+        if arrays_checksum(aArrays) != strChecksum:
+            logging.warning("Cached placements {} failed integrity check, discarding".format(strPath))
+            self.discard(strPath)
+            return None
+        # Mark as recently used
+        os.utime(strPath, None)
+        npArCodes, npArStarts, npArStops = aArrays
+        return aChromosomes, npArCodes, npArStarts.astype(np.int64), npArStops.astype(np.int64)
+
+    def put(self, strKey, aChromosomes, npArCodes, npArStarts, npArStops):
+        """ Store placement arrays under the key, then evict old entries beyond the size limit """
+        aArrays = [npArCodes, smallest_int(npArStarts), smallest_int(npArStops)]
+        # Write to a temporary file first so that readers never see a partial entry
+        iHandle, strTemp = tempfile.mkstemp(dir=self.strDir, suffix=".tmp")
+        with os.fdopen(iHandle, "wb") as fh:
+            np.savez(fh, chromosomes=np.array(aChromosomes), codes=aArrays[0], starts=aArrays[1], stops=aArrays[2],
+                     checksum=np.array(arrays_checksum(aArrays)))
+        os.rename(strTemp, self.path(strKey))
+        self.evict()
+
+    def discard(self, strPath):
+        try:
+            os.remove(strPath)
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits its size limit """
+        aEntries = []
+        for strName in os.listdir(self.strDir):
+            if strName.endswith(".npz"):
+                strPath = os.path.join(self.strDir, strName)
+                oStat = os.stat(strPath)
+                aEntries.append((oStat.st_mtime, oStat.st_size, strPath))
+        aEntries.sort()
+        iTotal = sum([iSize for iTime, iSize, strPath in aEntries])
+        # Always keep the newest entry, even if it alone exceeds the limit
+        while iTotal > self.iMaxBytes and len(aEntries) > 1:
+            iTime, iSize, strPath = aEntries.pop(0)
+            logging.info("Evicting cached placements {}".format(strPath))
+            self.discard(strPath)
+            iTotal -= iSize
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the placement cache in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
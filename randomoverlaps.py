@@ -31,18 +31,96 @@ if sys.version_info < (2, 7):
     raise Exception("Python 2.7+ is required")
 
 import argparse
+import hashlib
 import logging
 import random
 import math
+import time
+from collections import namedtuple
 import numpy as np
 from scipy import stats
 
-global bVerbose
-bVerbose = True
+import intervalio
+
+try:
+    import genomemask
+except ImportError:
+    genomemask = None
+
+try:
+    import kernels
+except ImportError:
+    kernels = None
+
+try:
+    import shiftnull
+except ImportError:
+    shiftnull = None
+
+SEED_BLOCK = 100  # Iterations in each block of a seeded run, the unit split between shards
+ESTIMATE_CALIBRATION = 20  # Random sets drawn and scored to time each phase with --estimate
 
 class FoundException(Exception): pass
 
 
+class PlacementArrays(object):
+    """
+    Random placement sets stored compactly as chromosome codes, starts and stops, one row per iteration. Sets drawn in
+    this run also keep the order of each row: the index of the UCE (sorted by chr, start, stop) placed in each column
+
+    """
+
+    def __init__(self, aChromosomes=None, npArCodes=None, npArStarts=None, npArStops=None):
+        self.aChromosomes = list(aChromosomes or [])
+        self.hCodes = dict([(strChr, i) for i, strChr in enumerate(self.aChromosomes)])
+        self.aRows = []
+        self.aOrders = []
+        if npArCodes is not None:
+            self.extend(npArCodes, npArStarts, npArStops)
+
+    def __len__(self):
+        return len(self.aRows)
+
+    def append(self, aaIntervals, aiOrder=None):
+        """ Store one placement set, with the index of the UCE placed as each interval if known """
+        for aInterval in aaIntervals:
+            if aInterval[0] not in self.hCodes:
+                self.hCodes[aInterval[0]] = len(self.aChromosomes)
+                self.aChromosomes.append(aInterval[0])
+        self.aRows.append((np.array([self.hCodes[aInterval[0]] for aInterval in aaIntervals], dtype=np.uint16),
+                           np.array([aInterval[1] for aInterval in aaIntervals], dtype=np.int64),
+                           np.array([aInterval[2] for aInterval in aaIntervals], dtype=np.int64)))
+        if aiOrder is not None:
+            self.aOrders.append(np.array(aiOrder, dtype=np.int64))
+
+    def extend(self, npArCodes, npArStarts, npArStops, npArOrders=None):
+        """ Store placement sets given as arrays of chromosome codes, starts and stops with one row per set """
+        self.aRows.extend([(npArCodes[j], npArStarts[j], npArStops[j]) for j in xrange(len(npArCodes))])
+        if npArOrders is not None:
+            self.aOrders.extend(list(npArOrders))
+
+    def codes(self):
+        """ Chromosome codes, starts and stops as arrays with one row per placement set """
+        return tuple([np.vstack([aRow[i] for aRow in self.aRows]) for i in range(3)])
+
+    def orders(self):
+        """ Index of the UCE in each column as an array with one row per placement set, or None if not kept """
+        if not self.aRows or len(self.aOrders) != len(self.aRows):
+            return None
+        return np.vstack(self.aOrders)
+
+    def arrays(self):
+        """ Chromosome names, starts and stops as arrays with one row per placement set """
+        npArCodes, npArStarts, npArStops = self.codes()
+        return np.array(self.aChromosomes)[npArCodes], npArStarts, npArStops
+
+    def intervals(self, j):
+        """ Placement set j as a list of 3-column intervals """
+        npArCodes, npArStarts, npArStops = self.aRows[j]
+        return [[self.aChromosomes[iCode], int(iStart), int(iStop)] for iCode, iStart, iStop in
+                zip(npArCodes, npArStarts, npArStops)]
+
+
 LOGGING_LEVELS = {'critical': logging.CRITICAL,
                   'error': logging.ERROR,
                   'warning': logging.WARNING,
@@ -64,6 +142,8 @@ def full_overlap(aIntervalA, aIntervalB):
 
 
 def collapse(aList):
+    if kernels and kernels.ENABLED:
+        return kernels.collapse(aList)
     # Initialize variables
     strChr = iStart = iStop = 0
     aOut = []
@@ -196,6 +276,8 @@ def random_interval(aInputInterval, aWeightedSpace):
 
 
 def overlap(aaIntervals, aaAgainst):
+    if kernels and kernels.ENABLED:
+        return kernels.overlap(aaIntervals, aaAgainst)
     iOverlapCount = iTotalBPOverlap = 0
     iIntervalCount = 0
     for aTestInterval in aaIntervals:
@@ -217,10 +299,12 @@ def overlap(aaIntervals, aaAgainst):
     return iOverlapCount, iTotalBPOverlap
 
 
-def norm_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations, uceName, againstName):
-    # Create list for distribution 
-    aOverlapDistribution = []
-    bLocPrint = bPrint
+def norm_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations, uceName, againstName, oPlacements=None,
+                      bPrintRun1=False, aOverlapDistribution=None):
+    # Create list for distribution, unless rows are added to a given one
+    if aOverlapDistribution is None:
+        aOverlapDistribution = []
+    bLocPrint = not bPrintRun1
     iWrong = 0
     # Loop as many times as specified by iIterations
     for j in xrange(1, (iIterations + 1)):
@@ -233,10 +317,11 @@ def norm_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations, uceNa
                 # Check # of matches and # of UCEs are concordant
                 if not len(aUCEs) == len(aRandomMatches):
                     raise Exception("Error in creating random matches, could not find a 1 to 1 concordance")
-                    # Sort random matches
-                aRandomMatches.sort(key=lambda x: (x[0], x[1], x[2]))
+                # Sort random matches, keeping the UCE each was drawn for
+                aiOrder = sorted(xrange(len(aRandomMatches)), key=lambda i: aRandomMatches[i])
+                aRandomMatches = [aRandomMatches[i] for i in aiOrder]
 
-                if bVerbose and not bLocPrint:
+                if not bLocPrint:
                     # Print random matches once
                     strRun1RandomFileName = 'run1_randommatches.dist' + str(uceName) + str(againstName) + '.txt'
                     print "Writing file to: " + strRun1RandomFileName
@@ -264,6 +349,10 @@ def norm_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations, uceNa
             except NameError:
                 print "found it"
             except FoundException:
+                if oPlacements is not None:
+                    # Keep the placement set to be scored later instead of scoring it now
+                    oPlacements.append(aRandomMatches, aiOrder)
+                    break
                 # Calculate # of overlaps and bp overlap for all random matches
                 iOverlapCount, iTotalBPOverlap = overlap(aRandomMatches, aAgainst)
                 logging.debug("Overlaps calculated for iteration {}".format(j))
@@ -273,21 +362,19 @@ def norm_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations, uceNa
     return aOverlapDistribution
 
 
-def cluster_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iClusterWidth, iIterations, hChrEnds, uceName, againstName):
-    try:
-        import clustermodule
-    except ImportError:
-        print "Cannot find clustermodule.py. Ensure file is in working directory, exiting..."
-        sys.exit(1)
-    bLocPrint = bPrint
+def cluster_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iClusterWidth, iIterations, hChrEnds, uceName,
+                         againstName, oPlacements=None, bPrintRun1=False, aAssocClusterUCEs=None,
+                         aOverlapDistribution=None):
+    bLocPrint = not bPrintRun1
     iWrong = 0
-    # Cluster UCEs, then associate clusters with UCEs
-    aClusteredUCEs = clustermodule.cluster(aUCEs, iClusterWidth, hChrEnds)
-    aAssocClusterUCEs = clustermodule.c_trackuces(aClusteredUCEs, aUCEs)
-    # Create list for distribution 
-    aOverlapDistribution = []
+    # Cluster UCEs, then associate clusters with UCEs, unless already done by cluster_sweep
+    if aAssocClusterUCEs is None:
+        aAssocClusterUCEs = clusters(aUCEs, [iClusterWidth], hChrEnds)[iClusterWidth]
+    # Create list for distribution, unless rows are added to a given one
+    if aOverlapDistribution is None:
+        aOverlapDistribution = []
     # Check that there is enough space available to place clusters
-    iClusterCoverage = sum([interval_len(line) for line in aClusteredUCEs])
+    iClusterCoverage = sum([interval_len(line[0]) for line in aAssocClusterUCEs])
     iSpaceCoverage = sum([interval_len(line[0]) for line in aGenomeSpaceIntervals])
     logging.info("{} cluster coverage, {} space coverage".format(iClusterCoverage, iSpaceCoverage))
     if iSpaceCoverage < iClusterCoverage:
@@ -310,10 +397,12 @@ def cluster_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iClusterWidth,
                         iStop = iStart + UCE[1]
                         aRandomClusterMatches.append([strChr, iStart, iStop])
                 logging.debug("Random clusters created for iteration {}".format(j))
-                # Sort clustered random matches
-                aRandomClusterMatches.sort(key=lambda x: (x[0], x[1], x[2]))
+                # Sort clustered random matches, keeping the UCE each was drawn for (clusters list their UCEs in the
+                # order of the sorted UCEs)
+                aiOrder = sorted(xrange(len(aRandomClusterMatches)), key=lambda i: aRandomClusterMatches[i])
+                aRandomClusterMatches = [aRandomClusterMatches[i] for i in aiOrder]
 
-                if bVerbose and not bLocPrint:
+                if not bLocPrint:
                     # Print random matches once
                     strRun1RandomFileName = 'run1_randommatches.dist' + str(uceName) + str(againstName) + '.txt'
                     print "Writing file to: " + strRun1RandomFileName
@@ -338,6 +427,9 @@ def cluster_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iClusterWidth,
                         print "Exiting..."
                         sys.exit(1)
             except FoundException:
+                if oPlacements is not None:
+                    oPlacements.append(aRandomClusterMatches, aiOrder)
+                    break
                 # Calculate # of overlaps and bp overlap for clustered random matches
                 iOverlapCount, iTotalBPOverlap = overlap(aRandomClusterMatches, aAgainst)
                 logging.debug("Overlaps calculated for iteration {}".format(j))
@@ -348,6 +440,16 @@ def cluster_distribution(aUCEs, aAgainst, aGenomeSpaceIntervals, iClusterWidth,
     return aOverlapDistribution
 
 
+def clusters(aUCEs, aClusterWidths, hChrEnds):
+    """ Clusters and associated UCEs for each cluster width, from clustermodule.cluster_hierarchy """
+    try:
+        import clustermodule
+    except ImportError:
+        print "Cannot find clustermodule.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    return clustermodule.cluster_hierarchy(aUCEs, aClusterWidths, hChrEnds)
+
+
 def cluster_input(string):
     value = int(string)
     if not value > 0:
@@ -356,46 +458,61 @@ def cluster_input(string):
     return value
 
 
+def shard_input(string):
+    try:
+        iShard, iShards = [int(strPart) for strPart in string.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must be given as k/n")
+    if not 1 <= iShard <= iShards:
+        raise argparse.ArgumentTypeError("Shard k/n must have 1 <= k <= n")
+    return iShard, iShards
+
+
 def cdf(x, mu, sigma):
     y = 0.5 * (1 + math.erf((x - mu) / math.sqrt(2 * sigma ** 2)))
     return y
 
 
-def Proportion(bp, aOverlapBP):
-    "Returns the proportion of random overlaps at or more extreme than the UCE overlaps"
+def Proportion(bp, aOverlapBP, bPrint=True):
+    "Returns the proportion of random overlaps at or more extreme than the UCE overlaps, printing the side if bPrint"
     mean = float(sum(aOverlapBP) / len(aOverlapBP))
     iMean = int(mean)
     #Determine if the uce overlaps value is greater or less than the mean of the randomoverlaps
     if iMean > bp:
-        print 'UCE overlaps below random overlaps mean: set may be depleted'
+        if bPrint:
+            print 'UCE overlaps below random overlaps mean: set may be depleted'
         #Return all values in npArSortedRandomOverlaps that are smaller than or equal to ibpUCEoverlap
         arRandomsLessorEqual = [x for x in aOverlapBP if x <= bp]
         #Calculate the length of this list
         iSmallerOrEqualRandomOverlaps = len(arRandomsLessorEqual)
         proportion = float(float(iSmallerOrEqualRandomOverlaps)/float(len(aOverlapBP)))
     elif iMean <= bp:
-        print 'UCE overlaps above random overlaps mean: set may be enriched'
+        if bPrint:
+            print 'UCE overlaps above random overlaps mean: set may be enriched'
         arRandomsGreaterOrEqual = [x for x in aOverlapBP if x >= bp]
         iRandomsGreaterOrEqualNumber = len(arRandomsGreaterOrEqual)
         proportion = float(iRandomsGreaterOrEqualNumber)/float(len(aOverlapBP))
     return proportion
 
-def KSTest(aOverlapBP):
-    "Returns the KS test statistic and p value for rejecting the null hypothesis that aOverlapBP follows a normal distribution with mean and sd equal to those of aOverlapBP"
-    mean = float(sum(aOverlapBP) / len(aOverlapBP))
-    sd = stdev(aOverlapBP)
+def KSTest(aOverlapBP, mean=None, sd=None, bPrint=True):
+    "Returns the KS test statistic and p value for rejecting the null hypothesis that aOverlapBP follows a normal distribution with mean and sd equal to those of aOverlapBP, or to those given"
+    if mean is None:
+        mean = float(sum(aOverlapBP) / len(aOverlapBP))
+        sd = stdev(aOverlapBP)
     rvNormMatched = stats.norm.rvs(loc=mean, scale=sd, size=1000)
     npArOverlapBP = np.array(aOverlapBP)
     ksStat, KsPval = stats.ks_2samp(npArOverlapBP, rvNormMatched)
     if KsPval <= 0.05:
         strKSresult = "No"
-        print 'KS statistic is significant: attention needed'
+        if bPrint:
+            print 'KS statistic is significant: attention needed'
     else:
         strKSresult = "Yes"
-        print 'KS statistic not significant: random overlaps appear normally distributed'
+        if bPrint:
+            print 'KS statistic not significant: random overlaps appear normally distributed'
     return ksStat, KsPval, strKSresult
 
-def statistics(aUCEOverlaps, aOverlapDistribution):
+def statistics(aUCEOverlaps, aOverlapDistribution, bPrint=True):
     n = aUCEOverlaps[0]
     bp = aUCEOverlaps[1]
     aOverlapBP = zip(*aOverlapDistribution)[1]
@@ -405,8 +522,8 @@ def statistics(aUCEOverlaps, aOverlapDistribution):
     maximum = max(aOverlapBP)
     pvalue = cdf(bp, mean, sd)
     obsExp = float(bp) / mean
-    proportion = Proportion(bp, aOverlapBP)
-    ksStat, ksPval, strKSresult = KSTest(aOverlapBP)
+    proportion = Proportion(bp, aOverlapBP, bPrint)
+    ksStat, ksPval, strKSresult = KSTest(aOverlapBP, bPrint=bPrint)
     if pvalue >= 0.975:
         strZtestResult = "Enriched"
     elif pvalue <= 0.025:
@@ -420,6 +537,140 @@ def statistics(aUCEOverlaps, aOverlapDistribution):
         return [n, bp, mean, sd, minimum, maximum, ksPval, strKSresult, proportion, pvalue, obsExp, strZtestResult]
 
 
+def online_statistics(aUCEOverlaps, oRunning):
+    """
+    Statistics from an onlinestats.RunningDistribution, as statistics gives for the full list of overlaps. The KS test
+    compares the reservoir sample against a normal with the mean and s.d. of all iterations
+
+    """
+    n = aUCEOverlaps[0]
+    bp = aUCEOverlaps[1]
+    if len(oRunning) < 2:
+        print "Cannot calculate statistical variance with only 1 iteration."
+        print "Exiting..."
+        sys.exit(1)
+    mean = float(oRunning.iSum / len(oRunning))
+    sd = math.sqrt(oRunning.variance())
+    minimum = oRunning.iMin
+    maximum = oRunning.iMax
+    pvalue = cdf(bp, mean, sd)
+    obsExp = float(bp) / mean
+    # As Proportion, counting random overlaps on the side of the observed overlap away from the mean
+    if int(mean) > bp:
+        print 'UCE overlaps below random overlaps mean: set may be depleted'
+        proportion = float(oRunning.iLessOrEqual) / len(oRunning)
+    else:
+        print 'UCE overlaps above random overlaps mean: set may be enriched'
+        proportion = float(oRunning.iGreaterOrEqual) / len(oRunning)
+    ksStat, ksPval, strKSresult = KSTest(oRunning.aReservoir, mean, sd)
+    if pvalue >= 0.975:
+        strZtestResult = "Enriched"
+    elif pvalue <= 0.025:
+        strZtestResult = "Depleted"
+    else:
+        strZtestResult = "Neither"
+    if pvalue > 0.5:
+        pvalue = float(1 - pvalue)
+    return [n, bp, mean, sd, minimum, maximum, ksPval, strKSresult, proportion, pvalue, obsExp, strZtestResult]
+
+
+def running_distribution(iObservedBP, args, againstName):
+    """ An onlinestats.RunningDistribution for --online, streaming rows to the randommatches.dist file if verbose """
+    try:
+        import onlinestats
+    except ImportError:
+        print "Cannot find onlinestats.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    fhOut = None
+    if args.verbose:
+        strRandomMatchFileName = 'randommatches.dist' + str(args.uces.name) + str(againstName) + '.txt'
+        print "Writing file to: " + strRandomMatchFileName
+        fhOut = open(strRandomMatchFileName, "w")
+    return onlinestats.RunningDistribution(iObservedBP, args.reservoir, args.seed, fhOut)
+
+
+def analytic_statistics(aUCEOverlaps, mean, sd):
+    """
+    Statistics from analytic null moments. Columns that need simulated random sets (min, max, KS test and
+    proportion) are reported as NA
+
+    """
+    n = aUCEOverlaps[0]
+    bp = aUCEOverlaps[1]
+    pvalue = cdf(bp, mean, sd)
+    obsExp = float(bp) / mean
+    if pvalue >= 0.975:
+        strZtestResult = "Enriched"
+    elif pvalue <= 0.025:
+        strZtestResult = "Depleted"
+    else:
+        strZtestResult = "Neither"
+    if pvalue > 0.5:
+        pvalue = float(1 - pvalue)
+    return [n, bp, mean, sd, "NA", "NA", "NA", "NA", "NA", pvalue, obsExp, strZtestResult]
+
+
+def analytic_null(aUCEs, aWeightedSpace, oTrack):
+    """ Mean and s.d. of the bp overlap of random sets, computed from the genome space instead of simulated """
+    try:
+        import analyticnull
+    except ImportError:
+        print "Cannot find analyticnull.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    dMean, dVariance = analyticnull.null_moments(aUCEs, [line[0] for line in aWeightedSpace], oTrack)
+    logging.info("Analytic null mean {}, variance {}".format(dMean, dVariance))
+    return dMean, math.sqrt(dVariance)
+
+
+def importance_statistics(aUCEs, aAgainst, aWeightedSpace, iIterations, oTrack, iSeed):
+    """
+    Statistics from importance-sampled random sets tilted towards the observed overlap. The proportion column holds the
+    reweighted tail probability. Mean and s.d. are the analytic null moments when bp is scored as union coverage, and
+    reweighted estimates otherwise
+
+    """
+    try:
+        import importancesampling
+    except ImportError:
+        print "Cannot find importancesampling.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    # The proposal is tilted in the overlap with the collapsed against set whichever scoring is used
+    oSampler = importancesampling.TiltedSampler(aUCEs, [line[0] for line in aWeightedSpace],
+                                                oTrack or coverage_track(aAgainst))
+    aUCEOverlaps = uce_overlaps(aUCEs, aAgainst, oTrack)
+    bp = aUCEOverlaps[1]
+    bLower = bp < oSampler.null_mean()
+    dTheta = oSampler.solve_theta(bp)
+    logging.info("Tilting placements by {} per bp towards {} bp".format(dTheta, bp))
+    npArCodes, npArStarts, npArStops, npArLogWeights = oSampler.sample(iIterations, dTheta,
+                                                                       np.random.RandomState(iSeed))
+    oPlacements = PlacementArrays(oSampler.aChromosomes, npArCodes, npArStarts, npArStops)
+    npArBP = np.array([line[1] for line in score_placements(oPlacements, aAgainst, oTrack)])
+    dTail, dSE, dESS = importancesampling.tail_probability(npArBP, npArLogWeights, bp, bLower)
+    if oTrack:
+        dMean, dSD = analytic_null(aUCEs, aWeightedSpace, oTrack)
+    else:
+        dMean, dSD = importancesampling.weighted_moments(npArBP, npArLogWeights)
+    print "Importance sampling: tail probability {0} (s.e. {1}, effective sample size {2:.1f})".format(dTail, dSE,
+                                                                                                     dESS)
+    aStats = analytic_statistics(aUCEOverlaps, dMean, dSD)
+    aStats[8] = dTail
+    return aStats
+
+
+def validate_analytic(dMean, dSD, aOverlapDistribution):
+    """ Print analytic moments next to those of the simulated distribution """
+    aOverlapBP = zip(*aOverlapDistribution)[1]
+    dSimMean = float(sum(aOverlapBP)) / len(aOverlapBP)
+    dSimSD = stdev(aOverlapBP)
+    # Standard error of the simulated mean, to judge whether the difference is within sampling noise
+    dSE = dSimSD / math.sqrt(len(aOverlapBP))
+    print "\tanalytic\tsimulated\trelative difference"
+    print "mean\t{0}\t{1}\t{2}".format(dMean, dSimMean, (dMean - dSimMean) / dSimMean)
+    print "s.d.\t{0}\t{1}\t{2}".format(dSD, dSimSD, (dSD - dSimSD) / dSimSD)
+    print "Analytic mean is {0} standard errors from the simulated mean".format((dMean - dSimMean) / dSE)
+
+
 def stdev(aList):
     dMean = float(sum(aList)) / len(aList)
     dSumOfSquares = sum([((number - dMean) ** 2) for number in aList])
@@ -432,7 +683,7 @@ def stdev(aList):
     return math.sqrt(dVariance)
 
 
-def writer(aList, uceName, againstName):
+def writer(aList, uceName, againstName, bVerbose=True):
     if bVerbose:
         strStatsFileName = 'stats_' + str(uceName) + str(againstName) + '.txt'
         sys.stderr.write("Writing matches to " + strStatsFileName + "\n")
@@ -443,6 +694,59 @@ def writer(aList, uceName, againstName):
     print "\t".join(map(str, aList))
 
 
+def sweep_writer(aaStats, uceName, againstName, bVerbose=True):
+    """ As writer, for the stats rows of a cluster sweep, each led by its cluster width """
+    if bVerbose:
+        strStatsFileName = 'stats_' + str(uceName) + str(againstName) + '.txt'
+        sys.stderr.write("Writing matches to " + strStatsFileName + "\n")
+        with open(strStatsFileName, "w") as out:
+            out.write("cluster\tn\tbp\tmean\ts.d.\tmin\tmax\tksPval\tKSresult\tproportion\tp-value\tObs/Exp\t"
+                      "ZtestResult\n")
+            out.write("\n".join(["\t".join(map(str, aList)) for aList in aaStats]))
+    print "cluster\tn\tbp\tmean\ts.d.\tmin\tmax\tksPval\tKSresult\tproportion\tp-value\tObs/Exp\tZtestResult\n"
+    for aList in aaStats:
+        print "\t".join(map(str, aList))
+
+
+def multi_writer(aaStats, uceName, bVerbose=True):
+    """ As writer, for the stats rows of several against files, each led by the file name """
+    if bVerbose:
+        for aList in aaStats:
+            strStatsFileName = 'stats_' + str(uceName) + str(aList[0]) + '.txt'
+            sys.stderr.write("Writing matches to " + strStatsFileName + "\n")
+            with open(strStatsFileName, "w") as out:
+                out.write("n\tbp\tmean\ts.d.\tmin\tmax\tksPval\tKSresult\tproportion\tp-value\tObs/Exp\tZtestResult\n")
+                out.write("\t".join(map(str, aList[1:])))
+    print "against\tn\tbp\tmean\ts.d.\tmin\tmax\tksPval\tKSresult\tproportion\tp-value\tObs/Exp\tZtestResult\n"
+    for aList in aaStats:
+        print "\t".join(map(str, aList))
+
+
+def write_distribution(aOverlapDistribution, uceName, againstName):
+    strRandomMatchFileName = 'randommatches.dist' + str(uceName) + str(againstName) + '.txt'
+    print "Writing file to: " + strRandomMatchFileName
+    with open(strRandomMatchFileName, "w") as out:
+        aWriteDistribution = ["\t".join(map(str, line)) for line in aOverlapDistribution]
+        out.write("\n".join(aWriteDistribution))
+
+
+def write_shard(aOverlapDistribution, aUCEOverlaps, args):
+    """ Write the partial distribution of one shard, headed by the run parameters that mergeshards.py checks """
+    iShard, iShards = args.shard
+    strShardFileName = 'shard{0}of{1}_randommatches.dist'.format(iShard, iShards) + str(args.uces.name) + \
+                       str(args.against.name) + '.txt'
+    print "Writing shard {0}/{1} to: {2}".format(iShard, iShards, strShardFileName)
+    with open(strShardFileName, "w") as out:
+        out.write("#shard\t{0}\t{1}\n".format(iShard, iShards))
+        for strField, oValue in (("uces", args.uces.name), ("against", args.against.name),
+                                 ("genomespace", args.genomespace.name), ("iterations", args.iterations),
+                                 ("cluster", args.cluster), ("union", args.union), ("seed", args.seed)):
+            out.write("#{0}\t{1}\n".format(strField, oValue))
+        out.write("#observed\t{0}\t{1}\n".format(*aUCEOverlaps))
+        for line in aOverlapDistribution:
+            out.write("\t".join(map(str, line)) + "\n")
+
+
 def interval_len(aInterval):
     """Given a 3 column interval, return the length of the interval """
     return aInterval[2] - aInterval[1] + 1
@@ -459,6 +763,8 @@ def weight(aList):
 
 
 def picker(aList):
+    if kernels and kernels.ENABLED:
+        return kernels.picker(aList)
     x = random.random()
     for elmt, weight in aList:
         if x <= weight:
@@ -471,6 +777,365 @@ def formatInt(aInterval):
     return [aInterval[0], int(aInterval[1]), int(aInterval[2])]
 
 
+def weighted_space(aGenomeSpaceIntervals, iCluster=None):
+    """
+    Weight genome space intervals (sorted by chr, start) for picking. When clustering, only intervals wider than the
+    cluster width (kb) are kept. Returns the sorted weighted space and the max stop of each chromosome, which is
+    taken before the space is reduced
+
+    """
+    hEnds = maxend(aGenomeSpaceIntervals)
+    if iCluster:
+        # Convert to bp
+        iClusterWidth = iCluster * 1000
+        aSpace = [line for line in aGenomeSpaceIntervals if interval_len(line) > iClusterWidth]
+        logging.info("{} intervals reduced to {} intervals over {} bp".format(len(aGenomeSpaceIntervals), len(aSpace),
+                                                                              iClusterWidth))
+        if len(aSpace) < 1:
+            logging.error("{} intervals over {} bp found, exited".format(len(aSpace), iClusterWidth))
+            sys.exit("Cluster size exceeds any one interval in the genome space file, try reducing cluster size")
+        aWeightedSpace = weight(aSpace)
+    else:
+        aWeightedSpace = weight(aGenomeSpaceIntervals)
+    aWeightedSpace.sort(key=lambda e: e[0])
+    return aWeightedSpace, hEnds
+
+
+def shift_space(aUCEs, aGenomeSpaceIntervals, strBy):
+    """ Circular-shift null model, used in place of the weighted genome space to draw random sets with --null shift """
+    if shiftnull is None:
+        print "Cannot find shiftnull.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    oShift = shiftnull.CircularShift(aUCEs, aGenomeSpaceIntervals, strBy)
+    logging.info("Shifting {} UCEs along {} line(s) of {} bp".format(len(aUCEs), len(oShift.npArLineLengths),
+                                                                    int(oShift.npArLineLengths.sum())))
+    return oShift
+
+
+def is_shift(aWeightedSpace):
+    """ True if random sets are drawn by the circular-shift null model rather than from a weighted space """
+    return shiftnull is not None and isinstance(aWeightedSpace, shiftnull.CircularShift)
+
+
+def null_name(aWeightedSpace):
+    """ Name of the null model other than independent random placement, used to key cached placements """
+    return aWeightedSpace.name if is_shift(aWeightedSpace) else None
+
+
+def coverage_track(aAgainst):
+    """ Build the prefix-sum coverage track used for union scoring """
+    try:
+        import coveragetrack
+    except ImportError:
+        print "Cannot find coveragetrack.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    oTrack = coveragetrack.CoverageTrack(aAgainst)
+    logging.info("Coverage track built over {} bp".format(oTrack.coverage()))
+    return oTrack
+
+
+def iteration_seed(iSeed, iIteration):
+    """ Seed of the random stream of one iteration (counted from 0), derived from the run seed """
+    return int(hashlib.sha256("{0}:{1}".format(iSeed, iIteration)).hexdigest()[:16], 16)
+
+
+def shard_blocks(iIterations, iShard=1, iShards=1):
+    """ (block, iterations) pairs of the contiguous run of seed blocks drawn by shard iShard of iShards """
+    iBlocks = (iIterations + SEED_BLOCK - 1) // SEED_BLOCK
+    return [(iBlock, min(SEED_BLOCK, iIterations - iBlock * SEED_BLOCK))
+            for iBlock in xrange((iShard - 1) * iBlocks // iShards, iShard * iBlocks // iShards)]
+
+
+def seeded_blocks(iIterations, iSeed=None, aBlocks=None, bPrintRun1=False):
+    """
+    Yield the number of iterations to draw in each call, and whether the call prints the first placement set of the
+    run. When seeded, each iteration is drawn alone from its own random stream, seeded from the run seed and its
+    index, so any run of blocks (a shard) is drawn exactly as in a single run and any iteration can be replayed
+
+    """
+    if iSeed is None:
+        yield iIterations, bPrintRun1
+        return
+    for iBlock, iCount in aBlocks or shard_blocks(iIterations):
+        for iIteration in xrange(iBlock * SEED_BLOCK, iBlock * SEED_BLOCK + iCount):
+            random.seed(iteration_seed(iSeed, iIteration))
+            yield 1, bPrintRun1
+            bPrintRun1 = False
+
+
+def distribution(aUCEs, aAgainst, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName, oTrack=None,
+                 iSeed=None, aBlocks=None, bPrintRun1=False, aClusters=None, aOverlapDistribution=None):
+    """
+    Create the distribution of random overlaps, clustering UCEs if a cluster width is given. With a coverage track,
+    placement sets from every iteration are kept and scored in a single vectorized call. With a seed, only the
+    iterations of aBlocks are drawn (all of them by default). bPrintRun1 writes the first placement set to the
+    run1_randommatches.dist file. aClusters may hold the clusters of this width from clusters(), which are otherwise
+    built here. Rows are appended to aOverlapDistribution if given (such as an onlinestats.RunningDistribution), in
+    which case placement sets for the coverage track are scored one block at a time rather than all kept
+
+    """
+    if iCluster and aClusters is None:
+        aClusters = clusters(aUCEs, [iCluster], hEnds)[iCluster]
+    if oTrack and aOverlapDistribution is None:
+        oPlacements = placements(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName, iSeed,
+                                 aBlocks, bPrintRun1, aClusters)
+        return score_placements(oPlacements, aAgainst, oTrack)
+    if aOverlapDistribution is None:
+        aOverlapDistribution = []
+    if oTrack:
+        for oPlacements in placement_blocks(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName,
+                                            iSeed, aBlocks, bPrintRun1, aClusters):
+            aOverlapDistribution.extend(score_placements(oPlacements, aAgainst, oTrack))
+        return aOverlapDistribution
+    if is_shift(aWeightedSpace):
+        # Shifted sets are made a block at a time, so are scored a block at a time by vectorized first hits
+        oLabeled = labeled_against([aAgainst])
+        for oPlacements in placement_blocks(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName,
+                                            iSeed, aBlocks, bPrintRun1, aClusters):
+            aOverlapDistribution.extend(oLabeled.distribution(*oPlacements.arrays())[0])
+        return aOverlapDistribution
+    for iCount, bPrintBlock in seeded_blocks(iIterations, iSeed, aBlocks, bPrintRun1):
+        if iCluster:
+            cluster_distribution(aUCEs, aAgainst, aWeightedSpace, iCluster, iCount, hEnds, uceName, againstName, None,
+                                 bPrintBlock, aClusters, aOverlapDistribution)
+        else:
+            norm_distribution(aUCEs, aAgainst, aWeightedSpace, iCount, uceName, againstName, None, bPrintBlock,
+                              aOverlapDistribution)
+    return aOverlapDistribution
+
+
+def placements(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName, iSeed=None, aBlocks=None,
+               bPrintRun1=False, aClusters=None):
+    """ Create the random placement sets for every iteration without scoring them """
+    if iCluster and aClusters is None:
+        aClusters = clusters(aUCEs, [iCluster], hEnds)[iCluster]
+    if is_shift(aWeightedSpace):
+        # Candidate offsets are drawn from the stream of each iteration, then all sets are shifted together
+        aOffsets = [aWeightedSpace.offsets(iCount) for iCount, bPrintBlock in
+                    seeded_blocks(iIterations, iSeed, aBlocks, bPrintRun1)]
+        oPlacements = PlacementArrays(aWeightedSpace.aChromosomes)
+        oPlacements.extend(*aWeightedSpace.shift(np.vstack(aOffsets)))
+        if bPrintRun1:
+            # Print the first shifted set, as random matches are printed
+            strRun1RandomFileName = 'run1_randommatches.dist' + str(uceName) + str(againstName) + '.txt'
+            print "Writing file to: " + strRun1RandomFileName
+            with open(strRun1RandomFileName, "w") as out:
+                out.write("\n".join(["\t".join(map(str, line)) for line in oPlacements.intervals(0)]))
+        return oPlacements
+    oPlacements = PlacementArrays()
+    for iCount, bPrintBlock in seeded_blocks(iIterations, iSeed, aBlocks, bPrintRun1):
+        if iCluster:
+            cluster_distribution(aUCEs, None, aWeightedSpace, iCluster, iCount, hEnds, uceName, againstName,
+                                 oPlacements, bPrintBlock, aClusters)
+        else:
+            norm_distribution(aUCEs, None, aWeightedSpace, iCount, uceName, againstName, oPlacements, bPrintBlock)
+    return oPlacements
+
+
+def placement_blocks(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName, iSeed=None,
+                     aBlocks=None, bPrintRun1=False, aClusters=None):
+    """
+    Yield the random placement sets of the run a block at a time (one seed block each when seeded, otherwise up to
+    SEED_BLOCK iterations), drawn exactly as placements draws them all at once
+
+    """
+    if iSeed is None:
+        aChunks = [(None, min(SEED_BLOCK, iIterations - i)) for i in xrange(0, iIterations, SEED_BLOCK)]
+    else:
+        aChunks = aBlocks or shard_blocks(iIterations)
+    for iBlock, iCount in aChunks:
+        yield placements(aUCEs, aWeightedSpace, iCount, iCluster, hEnds, uceName, againstName, iSeed,
+                         [(iBlock, iCount)] if iSeed is not None else None, bPrintRun1, aClusters)
+        bPrintRun1 = False
+
+
+def cached_placements(strCacheDir, iCacheSize, aUCEs, aGenomeSpaceIntervals, aWeightedSpace, iIterations, iCluster,
+                      hEnds, iSeed, uceName, againstName, aBlocks=None, bPrintRun1=False, aClusters=None):
+    """ Load the placement sets for this run (or shard) from the cache, creating and storing them if they are not there
+    """
+    try:
+        import placementcache
+    except ImportError:
+        print "Cannot find placementcache.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    oCache = placementcache.PlacementCache(strCacheDir, iCacheSize * 1024 * 1024)
+    strKey = placementcache.cache_key(aUCEs, aGenomeSpaceIntervals, iCluster, iSeed, iIterations, aBlocks,
+                                      null_name(aWeightedSpace))
+    aEntry = oCache.get(strKey)
+    if aEntry:
+        logging.info("Loaded {} cached placement sets from {}".format(len(aEntry[1]), oCache.path(strKey)))
+        oPlacements = PlacementArrays(*aEntry)
+        if bPrintRun1:
+            # Print random matches once, as when they are created
+            strRun1RandomFileName = 'run1_randommatches.dist' + str(uceName) + str(againstName) + '.txt'
+            print "Writing file to: " + strRun1RandomFileName
+            with open(strRun1RandomFileName, "w") as out:
+                out.write("\n".join(["\t".join(map(str, line)) for line in oPlacements.intervals(0)]))
+        return oPlacements
+    oPlacements = placements(aUCEs, aWeightedSpace, iIterations, iCluster, hEnds, uceName, againstName, iSeed, aBlocks,
+                             bPrintRun1, aClusters)
+    oCache.put(strKey, oPlacements.aChromosomes, *oPlacements.codes())
+    logging.info("Cached {} placement sets in {}".format(len(oPlacements), oCache.path(strKey)))
+    return oPlacements
+
+
+def incremental_distribution(args, aUCEs, aGenomeSpaceIntervals, aWeightedSpace, hEnds, bPrintRun1=False):
+    """
+    Union-scored distribution from the --incremental state, updated with the lines appended to the against file since
+    the last run, or built from scratch (and stored) if there is no usable state. Returns the distribution and the
+    coverage track of the whole against set
+
+    """
+    try:
+        import incrementalstate
+        import placementcache
+    except ImportError as err:
+        print "Cannot find {0}.py. Ensure file is in working directory, exiting...".format(err.message.split()[-1])
+        sys.exit(1)
+    strRunKey = placementcache.cache_key(aUCEs, aGenomeSpaceIntervals, args.cluster, args.seed, args.iterations,
+                                         None, null_name(aWeightedSpace))
+    oState = incrementalstate.IncrementalState.load(args.incremental)
+    tAppended = None
+    if oState is not None:
+        if oState.strRunKey != strRunKey:
+            logging.warning("Incremental state {} is for other UCEs, genome space or parameters, starting "
+                            "again".format(args.incremental))
+        else:
+            tAppended = oState.appended(args.against.name)
+            if tAppended is None:
+                logging.warning("{} has changed other than by appending lines, starting again".format(
+                    args.against.name))
+    if tAppended is not None:
+        strAppended = tAppended[0]
+        aNew = [formatInt(line.strip().split("\t")) for line in strAppended.splitlines() if line.strip()]
+        iNewBP, iRescored = oState.add_against(aNew, *tAppended[1:])
+        logging.info("Added {} appended intervals covering {} new bp, rescoring {} placed intervals".format(
+            len(aNew), iNewBP, iRescored))
+    else:
+        aAgainst = read_intervals(args.against)
+        if args.cache and args.seed is not None:
+            oPlacements = cached_placements(args.cache, args.cache_size, aUCEs, aGenomeSpaceIntervals, aWeightedSpace,
+                                            args.iterations, args.cluster, hEnds, args.seed, args.uces.name,
+                                            args.against.name, None, bPrintRun1)
+        else:
+            oPlacements = placements(aUCEs, aWeightedSpace, args.iterations, args.cluster, hEnds, args.uces.name,
+                                     args.against.name, args.seed, None, bPrintRun1)
+        oState = incrementalstate.IncrementalState.from_intervals(
+            strRunKey, oPlacements.aChromosomes, *(oPlacements.codes() + (aAgainst,) +
+                                                   incrementalstate.file_state(args.against.name)))
+    oState.save(args.incremental)
+    return oState.distribution(), oState.track()
+
+
+def multi_against(args, aUCEs, aGenomeSpaceIntervals, bPrintRun1=False):
+    """
+    Score the same random sets against each of several against files, returning one stats row per file led by its
+    name. The against sets are merged into one labeled structure and each block of placement sets is scored against
+    all of them together. With a seed, each row is the one a run against that file alone would give
+
+    """
+    oLabeled = labeled_against([read_intervals(fileobj) for fileobj in args.against], args.union)
+    logging.info("Merged {} against sets".format(oLabeled.iLabels))
+    aWeightedSpace, hEnds = weighted_space(aGenomeSpaceIntervals, args.cluster)
+    if args.null == "shift":
+        aWeightedSpace = shift_space(aUCEs, aGenomeSpaceIntervals, args.shift_by)
+    aClusters = clusters(aUCEs, [args.cluster], hEnds)[args.cluster] if args.cluster else None
+    # The first placement set is shared by every against file, so is named after the first
+    againstName = args.against[0].name
+    if args.cache and args.seed is None:
+        logging.warning("No --seed given, placements will not be cached")
+    if args.cache and args.seed is not None:
+        aBlocks = [cached_placements(args.cache, args.cache_size, aUCEs, aGenomeSpaceIntervals, aWeightedSpace,
+                                     args.iterations, args.cluster, hEnds, args.seed, args.uces.name, againstName,
+                                     None, bPrintRun1, aClusters)]
+    else:
+        aBlocks = placement_blocks(aUCEs, aWeightedSpace, args.iterations, args.cluster, hEnds, args.uces.name,
+                                   againstName, args.seed, None, bPrintRun1, aClusters)
+    aaOverlapDistributions = [[] for fileobj in args.against]
+    for oPlacements in aBlocks:
+        for aOverlapDistribution, aRows in zip(aaOverlapDistributions,
+                                               oLabeled.distribution(*oPlacements.arrays())):
+            aOverlapDistribution.extend(aRows)
+    aaStats = []
+    for fileobj, aUCEOverlaps, aOverlapDistribution in zip(args.against, oLabeled.overlap(aUCEs),
+                                                           aaOverlapDistributions):
+        if args.seed is not None:
+            # The KS test of each file draws the reference sample a single run would
+            np.random.seed(args.seed)
+        if args.verbose:
+            write_distribution(aOverlapDistribution, args.uces.name, fileobj.name)
+        aaStats.append([fileobj.name] + statistics(aUCEOverlaps, aOverlapDistribution))
+    return aaStats
+
+
+def labeled_against(aaaAgainst, bUnion=False):
+    """ Merge against sets to score placement sets against all of them at once """
+    try:
+        import multiagainst
+    except ImportError:
+        print "Cannot find multiagainst.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    return multiagainst.LabeledAgainst(aaaAgainst, bUnion)
+
+
+def score_placements(oPlacements, aAgainst, oTrack=None):
+    """ Return [count, bp] overlaps for each stored placement set """
+    if oTrack:
+        aCounts, aBP = oTrack.batch_overlap(*oPlacements.arrays())
+        logging.debug("Union coverage calculated for {} iterations".format(len(oPlacements)))
+        return [[int(iCount), int(iBP)] for iCount, iBP in zip(aCounts, aBP)]
+    return [list(overlap(oPlacements.intervals(j), aAgainst)) for j in xrange(len(oPlacements))]
+
+
+def uce_overlaps(aUCEs, aAgainst, oTrack=None):
+    """ Number of UCEs overlapping the against set and their bp overlap """
+    if oTrack:
+        return oTrack.overlap(aUCEs)
+    return overlap(aUCEs, aAgainst)
+
+
+def read_intervals(fileobj):
+    """ Read a 3-column interval file, or the intervals of a genome mask built by genomemask.py """
+    if genomemask and genomemask.is_mask(fileobj.name):
+        return genomemask.GenomeMask(fileobj.name).intervals()
+    return [formatInt(line.strip().split("\t")) for line in fileobj]
+
+
+# Result of analyse: the stats row, the [count, bp] overlaps of each random set and the observed [count, bp]
+OverlapResult = namedtuple("OverlapResult", ["stats", "distribution", "observed"])
+
+
+def load_intervals(strPath):
+    """ Read an interval file (or genome mask) sorted by chr, start, stop, ready to be reused with analyse """
+    with intervalio.open_input(strPath) as fh:
+        aIntervals = read_intervals(fh)
+    aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
+    return aIntervals
+
+
+def analyse(aUCEs, aAgainst, aGenomeSpaceIntervals, iIterations=1000, iCluster=None, bUnion=False, iSeed=None,
+            tWeightedSpace=None, oTrack=None):
+    """
+    Run a depletion analysis on intervals already in memory, without writing any files, and return an OverlapResult.
+    Interval lists must be sorted by chr, start, stop, as returned by load_intervals. To reuse them between calls,
+    tWeightedSpace may be given as returned by weighted_space for this genome space and cluster width (the genome
+    space itself is then not needed), and oTrack as the coverage track of aAgainst for union scoring
+
+    """
+    if tWeightedSpace is None:
+        tWeightedSpace = weighted_space(aGenomeSpaceIntervals, iCluster)
+    aWeightedSpace, hEnds = tWeightedSpace
+    if bUnion and oTrack is None:
+        oTrack = coverage_track(aAgainst)
+    if iSeed is not None:
+        # The KS test draws its reference sample from numpy
+        np.random.seed(iSeed)
+    aOverlapDistribution = distribution(aUCEs, aAgainst, aWeightedSpace, iIterations, iCluster, hEnds, None, None,
+                                        oTrack, iSeed)
+    aUCEOverlaps = list(uce_overlaps(aUCEs, aAgainst, oTrack))
+    return OverlapResult(statistics(aUCEOverlaps, aOverlapDistribution, False), aOverlapDistribution, aUCEOverlaps)
+
+
 def getArgs(strInput=None, verbose=True):
     # Define arguments
     parser = argparse.ArgumentParser(description="This script performs a depletion analysis with the given arguments "
@@ -480,17 +1145,87 @@ def getArgs(strInput=None, verbose=True):
                                                  "terminal. Unless otherwise specified, interval files should be "
                                                  "provided as arguments. All interval files must be in 1-based and in "
                                                  "3-column format: chr, start, stop")
-    parser.add_argument("-u", "--uces", type=argparse.FileType("rU"), required=True,
-                        help="The intervals to test (normally UCEs).")
-    parser.add_argument("-g", "--genomespace", type=argparse.FileType("rU"), required=True,
-                        help="The set of intervals defining the genomic space random sets are to be drawn from")
-    parser.add_argument("-a", "--against", type=argparse.FileType("rU"), required=True,
+    parser.add_argument("-u", "--uces", type=intervalio.input_file, required=True,
+                        help="The intervals to test (normally UCEs). May be a genomemask.py mask file.")
+    parser.add_argument("-g", "--genomespace", type=intervalio.input_file, required=True,
+                        help="The set of intervals defining the genomic space random sets are to be drawn from. May "
+                             "be a genomemask.py mask file.")
+    parser.add_argument("-a", "--against", type=intervalio.input_file, required=True, nargs="+",
                         help="The set of intervals that are being tested for overlap with UCEs. Total coverage should "
-                             "be >= 20 Mb to provide sufficient statistical power.")
+                             "be >= 20 Mb to provide sufficient statistical power. May be a genomemask.py mask file, "
+                             "which is scored directly from the memory-mapped mask with --union. Several files may be "
+                             "given, in which case the same random sets are scored against all of them in one pass "
+                             "and one stats row is written per file")
     parser.add_argument("-i", "--iterations", type=int, default=1000,
                         help="The number of random sets created to build an expected distribution [default=1000]")
-    parser.add_argument("-c", "--cluster", type=cluster_input,
-                        help="The maximum size to cluster adjacent intervals (kb)")
+    parser.add_argument("-c", "--cluster", type=cluster_input, nargs="+",
+                        help="The maximum size to cluster adjacent intervals (kb). Several widths may be given, in "
+                             "which case inputs are read once, the clusters of each width are built from those of the "
+                             "next smaller width, and one stats row is written per width")
+    parser.add_argument("--null", choices=["random", "shift"], default="random",
+                        help="How random sets are made. random places each UCE independently, redrawing sets in "
+                             "which any overlap. shift rotates all UCEs together by one random offset along the genome "
+                             "space laid end to end, keeping the spacing between them; UCEs shifted into a gap are "
+                             "moved to the next genome space interval. Cannot be used with -c [default=random]")
+    parser.add_argument("--shift-by", choices=shiftnull.SHIFT_MODES if shiftnull else ["genome", "chromosome"],
+                        default="genome",
+                        help="With --null shift, rotate the whole UCE set along the genome space (genome) or the UCEs "
+                             "of each chromosome along its own space, keeping them on their chromosome "
+                             "[default=genome]")
+    parser.add_argument("--union", action="store_true",
+                        help="Score bp overlap as coverage of the collapsed against set, so that bases covered by "
+                             "several against intervals are counted once and every overlapping interval contributes. "
+                             "Uses a prefix-sum coverage track built once per run")
+    parser.add_argument("--analytic", action="store_true",
+                        help="Compute the mean and s.d. of the random overlap distribution directly from the genome "
+                             "space instead of simulating random sets. Implies --union; min, max, KS test and "
+                             "proportion are reported as NA. Cannot be used with -c")
+    parser.add_argument("--validate-analytic", action="store_true",
+                        help="As --analytic, but also simulate --iterations random sets and print the analytic and "
+                             "simulated moments side by side")
+    parser.add_argument("--importance", action="store_true",
+                        help="Estimate the tail probability of the observed overlap by importance sampling, biasing "
+                             "random sets towards the observed overlap and reweighting them. Gives accurate small "
+                             "proportions with far fewer iterations; the standard error is printed. min, max and KS "
+                             "test are reported as NA. Cannot be used with -c")
+    parser.add_argument("--scan", type=int, metavar="WIDTH",
+                        help="Also scan windows of this width (kb) along each chromosome for local depletion, writing "
+                             "the observed and expected overlap of each window holding a UCE, and the proportion of "
+                             "random sets overlapping it no more, to scan_<uces><against>.txt. Windows are scored "
+                             "against the random sets of the whole UCE set. Implies --union")
+    parser.add_argument("--scan-step", type=int, metavar="STEP",
+                        help="Distance between the starts of scanned windows (kb) [default=the window width]")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for the random number generator, making random sets reproducible")
+    parser.add_argument("--replay", type=int, metavar="K",
+                        help="Redraw only iteration K (from 1) of the run with the given --seed and other options, "
+                             "writing its random set to replayK_randommatches.dist<uces><against>.txt and printing "
+                             "its overlap, without drawing any other iteration")
+    parser.add_argument("--shard", type=shard_input,
+                        help="Draw only shard k of n (given as k/n) of the iterations and write its partial "
+                             "distribution, to be combined with mergeshards.py. Requires --seed; merged shards give "
+                             "the same results as a single run with that seed")
+    parser.add_argument("--cache",
+                        help="Directory used to cache random placement sets between runs. Requires --seed; later runs "
+                             "with the same UCEs, genome space, cluster width, seed and iterations skip straight to "
+                             "scoring")
+    parser.add_argument("--cache-size", type=int, default=2048,
+                        help="Maximum size of the placement cache in MB, least recently used entries are evicted "
+                             "[default=2048]")
+    parser.add_argument("--incremental",
+                        help="State file kept between runs against a growing against file. Implies --union. The "
+                             "first run stores its random sets and their scores; later runs, if only lines were "
+                             "appended to the against file, read and score just the appended intervals")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Dry run: print the chance of hitting the placement and redraw limits, and the wall time "
+                             "and peak memory predicted from the genome space and a short calibration run, without "
+                             "running the analysis")
+    parser.add_argument("--online", action="store_true",
+                        help="Summarise random overlaps as each iteration finishes instead of keeping them all, so "
+                             "memory does not grow with --iterations. The KS test uses a reservoir sample of the "
+                             "random overlaps. Cannot be used with --shard or --cache")
+    parser.add_argument("--reservoir", type=int, default=10000,
+                        help="Size of the reservoir sample kept for the KS test with --online [default=10000]")
     parser.add_argument("-v", "--verbose", action="store_false",
                         help="-v flag prevents the storage of various intermediate files to current directory")
     parser.add_argument("-d", "--debug",
@@ -504,11 +1239,197 @@ def getArgs(strInput=None, verbose=True):
 
 
 
+def scan_windows(args, aUCEs, aAgainst, tWeightedSpace, oTrack):
+    """
+    Run the analysis of the whole UCE set and score windows along each chromosome against the same random sets, a
+    block at a time, writing them to the scan file. Returns the stats row of the whole set
+
+    """
+    try:
+        import windowscan
+    except ImportError:
+        print "Cannot find windowscan.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    aWeightedSpace, hEnds = tWeightedSpace
+    iWidth = args.scan * 1000
+    iStep = (args.scan_step or args.scan) * 1000
+    oScan = windowscan.WindowScan(aUCEs, oTrack, hEnds, iWidth, iStep)
+    aClusters = clusters(aUCEs, [args.cluster], hEnds)[args.cluster] if args.cluster else None
+    if args.seed is not None:
+        # The KS test draws its reference sample from numpy, as in analyse
+        np.random.seed(args.seed)
+    aOverlapDistribution = []
+    for oPlacements in placement_blocks(aUCEs, aWeightedSpace, args.iterations, args.cluster, hEnds, None, None,
+                                        args.seed, None, False, aClusters):
+        aOverlapDistribution.extend(oScan.add(oPlacements))
+    aStats = statistics(list(uce_overlaps(aUCEs, aAgainst, oTrack)), aOverlapDistribution)
+    if args.verbose:
+        write_distribution(aOverlapDistribution, args.uces.name, args.against.name)
+    aWindows = oScan.windows()
+    strScanFileName = 'scan_' + str(args.uces.name) + str(args.against.name) + '.txt'
+    print "Writing file to: " + strScanFileName
+    windowscan.write(aWindows, strScanFileName)
+    iDepleted = len([aWindow for aWindow in aWindows if aWindow[10] <= 0.05])
+    print "Scanned {0} windows holding UCEs, {1} depleted at q <= 0.05".format(len(aWindows), iDepleted)
+    return aStats
+
+
+def replay(args, aUCEs, aAgainst, aWeightedSpace, hEnds, oTrack):
+    """
+    Redraw iteration args.replay of a seeded run from its own random stream, write its placement set and print its
+    [count, bp] overlap, as scored in the run
+
+    """
+    random.seed(iteration_seed(args.seed, args.replay - 1))
+    oPlacements = placements(aUCEs, aWeightedSpace, 1, args.cluster, hEnds, args.uces.name, args.against.name)
+    aOverlap = score_placements(oPlacements, aAgainst, oTrack)[0]
+    strReplayFileName = 'replay{0}_randommatches.dist'.format(args.replay) + str(args.uces.name) + \
+                        str(args.against.name) + '.txt'
+    print "Writing file to: " + strReplayFileName
+    with open(strReplayFileName, "w") as out:
+        out.write("\n".join(["\t".join(map(str, line)) for line in oPlacements.intervals(0)]))
+    print "iteration\tn\tbp"
+    print "{0}\t{1}\t{2}".format(args.replay, *aOverlap)
+    return aOverlap
+
+
+def cluster_sweep(args, aWidths, aUCEs, aAgainst, aGenomeSpaceIntervals, oTrack=None, bPrintRun1=False):
+    """
+    Run the analysis at each cluster width (kb, ascending), returning one stats row per width led by the width.
+    Inputs, chromosome ends and the observed overlap are shared, the clusters of all widths are built together, and
+    each width reduces the genome space of the previous one. Each width draws the same random sets as a run with -c
+    at that width alone. Intermediate files are named after the against file and the width
+
+    """
+    hEnds = maxend(aGenomeSpaceIntervals)
+    hClusters = clusters(aUCEs, aWidths, hEnds)
+    aUCEOverlaps = uce_overlaps(aUCEs, aAgainst, oTrack)
+    if args.cache and args.seed is None:
+        logging.warning("No --seed given, placements will not be cached")
+    aaStats = []
+    aSpace = aGenomeSpaceIntervals
+    for iCluster in aWidths:
+        # Intervals wide enough for this width are a subset of those kept for the previous one
+        aWeightedSpace = weighted_space(aSpace, iCluster)[0]
+        aSpace = [line[0] for line in aWeightedSpace]
+        logging.info("Clustering at {} kb: {} clusters".format(iCluster, len(hClusters[iCluster])))
+        againstName = str(args.against.name) + ".c" + str(iCluster)
+        if args.seed is not None:
+            np.random.seed(args.seed)
+        oRunning = running_distribution(aUCEOverlaps[1], args, againstName) if args.online else None
+        if args.cache and args.seed is not None:
+            oPlacements = cached_placements(args.cache, args.cache_size, aUCEs, aGenomeSpaceIntervals, aWeightedSpace,
+                                            args.iterations, iCluster, hEnds, args.seed, args.uces.name, againstName,
+                                            None, bPrintRun1, hClusters[iCluster])
+            aOverlapDistribution = score_placements(oPlacements, aAgainst, oTrack)
+        else:
+            aOverlapDistribution = distribution(aUCEs, aAgainst, aWeightedSpace, args.iterations, iCluster, hEnds,
+                                                args.uces.name, againstName, oTrack, args.seed, None, bPrintRun1,
+                                                hClusters[iCluster], oRunning)
+        if oRunning is not None:
+            oRunning.close()
+            aaStats.append([iCluster] + online_statistics(aUCEOverlaps, oRunning))
+            continue
+        if args.verbose:
+            write_distribution(aOverlapDistribution, args.uces.name, againstName)
+        aaStats.append([iCluster] + statistics(aUCEOverlaps, aOverlapDistribution))
+    return aaStats
+
+
+def estimate_run(args, aUCEs, aAgainst, aGenomeSpaceIntervals, iCluster, oTrack, dSetup):
+    """
+    Print the predicted placement failure and retry rates, wall time and peak memory of a run, from the genome space
+    and a short calibration run, without running the analysis
+
+    """
+    try:
+        import runestimate
+    except ImportError:
+        print "Cannot find runestimate.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    aWeightedSpace, hEnds = weighted_space(aGenomeSpaceIntervals, iCluster)
+    aClusters = None
+    if iCluster:
+        # Clusters are placed as units, and a set is redrawn after 1000 collisions in one call
+        aClusters = clusters(aUCEs, [iCluster], hEnds)[iCluster]
+        aLengths = [aCluster[0][2] - aCluster[0][1] for aCluster in aClusters]
+        aaGroups = [[iLength for iOffset, iLength in aCluster[1]] for aCluster in aClusters]
+        iRetryLimit = 1000
+    else:
+        aLengths = [aUCE[2] - aUCE[1] for aUCE in aUCEs]
+        aaGroups = None
+        iRetryLimit = 100000
+    # Draws are split into calls of one iteration when seeded, or scored block by block online
+    if args.seed is not None:
+        iPerCall = 1
+    elif args.online and oTrack:
+        iPerCall = min(SEED_BLOCK, args.iterations)
+    else:
+        iPerCall = args.iterations
+    iCalls = (args.iterations + iPerCall - 1) // iPerCall
+    npArLengths, npArCounts, npArFit = runestimate.fit_probabilities(aLengths, aWeightedSpace)
+    dGiveUp = runestimate.limit_probability(aLengths, aWeightedSpace, len(aWeightedSpace) * 10)
+    dPairs = runestimate.collision_pairs(aLengths, aWeightedSpace, aaGroups)
+    dAccept = math.exp(-dPairs)
+    dExceed = abs(1 - (1 - runestimate.retry_exceed_probability(iPerCall, dAccept, iRetryLimit)) ** iCalls)
+    dRunGiveUp = abs(-math.expm1(args.iterations / dAccept * math.log1p(-min(dGiveUp, 1 - 1e-16))))
+
+    print "Estimate for {0} against {1}, {2} iterations{3}:".format(
+        args.uces.name, args.against.name, args.iterations, ", {0} kb clusters".format(iCluster) if iCluster else "")
+    print "  Intervals placed per set: {0} (lengths {1} to {2} bp)".format(len(aLengths), min(aLengths),
+                                                                           max(aLengths))
+    print "  Genome space intervals: {0}; lowest fit probability {1:.4g} for length {2} bp".format(
+        len(aWeightedSpace), npArFit.min(), npArLengths[np.argmin(npArFit)])
+    print "  Chance of hitting the placement limit: {0:.3g} per set, {1:.3g} over the run".format(abs(dGiveUp),
+                                                                                              dRunGiveUp)
+    print "  Expected colliding pairs per set: {0:.3g}; sets accepted {1:.3g}; expected redraws {2:.1f} per " \
+          "iteration".format(dPairs, dAccept, 1 / dAccept - 1)
+    print "  Chance of exceeding {0} redraws in a call of {1} iterations: {2:.3g} over the run".format(
+        iRetryLimit, iPerCall, dExceed)
+
+    # Time placement and scoring on a few random sets
+    iCalibration = min(ESTIMATE_CALIBRATION, args.iterations)
+    dStart = time.time()
+    try:
+        oPlacements = placements(aUCEs, aWeightedSpace, iCalibration, iCluster, hEnds, None, None, None, None, False,
+                                 aClusters)
+    except SystemExit:
+        print "  Calibration stopped at a placement or redraw limit: the run would exit"
+        return
+    dPlaced = time.time()
+    score_placements(oPlacements, aAgainst, oTrack)
+    dScored = time.time()
+    dPlaceTime = (dPlaced - dStart) / iCalibration
+    dScoreTime = (dScored - dPlaced) / iCalibration
+    print "  Calibration ({0} sets): placement {1}, scoring {2} per iteration".format(
+        iCalibration, runestimate.format_seconds(dPlaceTime), runestimate.format_seconds(dScoreTime))
+    print "  Predicted wall time: {0} (reading inputs {1})".format(
+        runestimate.format_seconds(dSetup + args.iterations * (dPlaceTime + dScoreTime)),
+        runestimate.format_seconds(dSetup))
+    # Placement sets are kept until scored when scoring union coverage
+    iBytes = runestimate.memory_bytes(args.iterations, len(aUCEs), oTrack is not None, args.online, args.reservoir,
+                                      SEED_BLOCK)
+    try:
+        import resource
+        # Peak resident memory so far, in kB on Linux
+        iBaseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        iBaseline = 0
+    print "  Predicted peak memory: {0} (inputs and calibration {1})".format(
+        runestimate.format_bytes(iBaseline + iBytes), runestimate.format_bytes(iBaseline))
+
+
 def main(args):
+    dStart = time.time()
+    # A single against file is handled as args.against, several are scored together by multi_against
+    bMultiAgainst = isinstance(args.against, list) and len(args.against) > 1
+    if isinstance(args.against, list) and not bMultiAgainst:
+        args.against = args.against[0]
+    strAgainstName = args.against[0].name if bMultiAgainst else args.against.name
     # Set debugging level
     if args.debug:
         log_level = LOGGING_LEVELS.get(args.debug.lower(), logging.NOTSET)
-        logging.basicConfig(level=log_level, filename=str("debug.log." + str(args.uces.name) + str(args.against.name)), filemode="w",
+        logging.basicConfig(level=log_level, filename=str("debug.log." + str(args.uces.name) + strAgainstName), filemode="w",
                             format='%(asctime)s\t%(levelname)s\t%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     else:
         logging.basicConfig()
@@ -520,59 +1441,188 @@ def main(args):
 
     # Create interval lists for UCEs, genome space regions and "against" regions
     logging.debug("Reading input files into lists...")
-    aUCEs = [formatInt(line.strip().split("\t")) for line in args.uces]
-    aAgainst = [formatInt(line.strip().split("\t")) for line in args.against]
-    aGenomeSpaceIntervals = [formatInt(line.strip().split("\t")) for line in args.genomespace]
+    aUCEs = read_intervals(args.uces)
+    if args.null == "shift" and (args.cluster or args.importance or args.analytic or args.validate_analytic or
+                                 args.estimate):
+        sys.exit("--null shift keeps the spacing of the UCEs and cannot be used with -c, --importance, --analytic or "
+                 "--estimate, which model independent placement")
+    if args.replay is not None:
+        if args.seed is None or args.replay < 1:
+            sys.exit("--replay K needs the --seed of the run and an iteration K of at least 1")
+        if (bMultiAgainst or args.importance or args.analytic or args.validate_analytic or args.incremental or
+                len(args.cluster or []) > 1):
+            sys.exit("--replay cannot be used with several against files, --importance, --analytic, --incremental "
+                     "or several cluster widths")
+    if args.scan is not None:
+        if args.scan < 1 or (args.scan_step is not None and args.scan_step < 1):
+            sys.exit("--scan and --scan-step must be at least 1 kb")
+        if (bMultiAgainst or args.shard or args.online or args.incremental or args.importance or args.analytic or
+                args.validate_analytic or args.estimate or args.cache or len(args.cluster or []) > 1):
+            sys.exit("--scan cannot be used with several against files, --shard, --online, --incremental, "
+                     "--importance, --analytic, --estimate, --cache or several cluster widths")
+        # Windows are scored by the bases of UCEs covered by the against set
+        args.union = True
+    if bMultiAgainst:
+        if (args.shard or args.online or args.incremental or args.importance or args.analytic or
+                args.validate_analytic or args.estimate or len(args.cluster or []) > 1):
+            sys.exit("Several against files cannot be used with --shard, --online, --incremental, --importance, "
+                     "--analytic, --estimate or several cluster widths")
+        args.cluster = args.cluster[0] if args.cluster else None
+        aGenomeSpaceIntervals = read_intervals(args.genomespace)
+        aGenomeSpaceIntervals.sort(key=lambda x: (x[0], x[1]))
+        aUCEs.sort(key=lambda x: (x[0], x[1], x[2]))
+        return multi_against(args, aUCEs, aGenomeSpaceIntervals, args.verbose)
+    # A mask against set is scored directly by rank queries in union mode, so it need not be expanded to intervals
+    bAgainstMask = args.union and genomemask and genomemask.is_mask(args.against.name)
+    if args.incremental:
+        if genomemask and genomemask.is_mask(args.against.name):
+            sys.exit("--incremental reads the lines appended to an interval file and cannot be used with masks")
+        if intervalio.compression(args.against.name):
+            sys.exit("--incremental reads the lines appended to an interval file and cannot be used with compressed "
+                     "files")
+        # Incremental runs score union coverage, reading the against file only as far as needed
+        args.union = True
+        aAgainst = []
+    elif bAgainstMask:
+        aAgainst = []
+    else:
+        aAgainst = read_intervals(args.against)
+    aGenomeSpaceIntervals = read_intervals(args.genomespace)
     aGenomeSpaceIntervals.sort(key=lambda x: (x[0], x[1]))
     logging.debug("Lists read and intervals formatted")
 
-    # Weight genome space intervals, only selecting big enough regions if clustered
-    if args.cluster:
-        # Convert to bp
-        iClusterWidth = args.cluster * 1000
-        # Get max stop for each chromosome before reducing space
-        hEnds = maxend(aGenomeSpaceIntervals)
-        aSpace = [line for line in aGenomeSpaceIntervals if interval_len(line) > iClusterWidth]
-        logging.info("{} intervals reduced to {} intervals over {} bp".format(len(aGenomeSpaceIntervals), len(aSpace),
-                                                                              iClusterWidth))
-        if len(aSpace) < 1:
-            logging.error("{} intervals over {} bp found, exited".format(len(aSpace), iClusterWidth))
-            sys.exit("Cluster size exceeds any one interval in the genome space file, try reducing cluster size")
-        aWeightedSpace = weight(aSpace)
-    else:
-        aWeightedSpace = weight(aGenomeSpaceIntervals)
-
     # Sort lists
     logging.debug("Sorting lists...")
     aUCEs.sort(key=lambda x: (x[0], x[1], x[2]))
-    aWeightedSpace.sort(key=lambda e: e[0])
     aAgainst.sort(key=lambda x: (x[0], x[1], x[2]))
     logging.debug("Lists sorted")
 
-    # Initialize global variables
-    global bVerbose
-    bVerbose = args.verbose
-    global bPrint
-    bPrint = False
+    # Build prefix-sum coverage track of the against set if union scoring was requested
+    oTrack = None
+    if bAgainstMask:
+        oTrack = genomemask.GenomeMask(args.against.name)
+        logging.info("Using mask {} covering {} bp".format(oTrack.name, oTrack.coverage()))
+    elif args.union and not args.incremental:
+        oTrack = coverage_track(aAgainst)
+
+    # Intermediate files, including the first random placement set, are only written in verbose mode
+    bPrintRun1 = args.verbose
+
+    if args.shard and (args.importance or args.analytic or args.validate_analytic):
+        sys.exit("--shard only applies to simulated random sets, not --importance or --analytic")
+    if args.shard and args.online:
+        sys.exit("--shard writes every random overlap for mergeshards.py and cannot be used with --online")
+    if args.cache and args.online:
+        sys.exit("--cache stores and loads every random set of the run at once and cannot be used with --online")
+    if args.incremental and (args.shard or args.online or args.importance or args.analytic or args.validate_analytic
+                             or len(args.cluster or []) > 1):
+        sys.exit("--incremental cannot be used with --shard, --online, --importance, --analytic or several cluster "
+                 "widths")
+
+    aWidths = sorted(set(args.cluster or []))
+    if args.estimate:
+        if args.incremental:
+            # Estimate the cost of a full incremental run
+            oTrack = coverage_track(read_intervals(args.against))
+        for iCluster in aWidths or [None]:
+            estimate_run(args, aUCEs, aAgainst, aGenomeSpaceIntervals, iCluster, oTrack, time.time() - dStart)
+        return None
+    if len(aWidths) > 1:
+        if args.shard or args.importance or args.analytic or args.validate_analytic:
+            sys.exit("Several cluster widths cannot be used with --shard, --importance or --analytic")
+        return cluster_sweep(args, aWidths, aUCEs, aAgainst, aGenomeSpaceIntervals, oTrack, bPrintRun1)
+    args.cluster = aWidths[0] if aWidths else None
 
-    # Create distribution of random overlaps, depending on cluster flag
-    if args.cluster:
-        aOverlapDistribution = cluster_distribution(aUCEs, aAgainst, aWeightedSpace, args.cluster, args.iterations,
-                                                    hEnds, args.uces.name, args.against.name)
+    # Weight genome space intervals, only selecting big enough regions if clustered
+    aWeightedSpace, hEnds = weighted_space(aGenomeSpaceIntervals, args.cluster)
+    if args.null == "shift":
+        aWeightedSpace = shift_space(aUCEs, aGenomeSpaceIntervals, args.shift_by)
+
+    if args.replay is not None:
+        replay(args, aUCEs, aAgainst, aWeightedSpace, hEnds, oTrack)
+        return None
+
+    if args.scan is not None:
+        return scan_windows(args, aUCEs, aAgainst, (aWeightedSpace, hEnds), oTrack)
+
+    if args.importance:
+        if args.cluster:
+            sys.exit("Importance sampling assumes independent placement of each UCE and cannot be used with -c")
+        return importance_statistics(aUCEs, aAgainst, aWeightedSpace, args.iterations, oTrack, args.seed)
+
+    if args.analytic or args.validate_analytic:
+        if args.cluster:
+            sys.exit("Analytic moments assume independent placement of each UCE and cannot be used with -c")
+        # Analytic moments are for union coverage, so the observed overlap is scored the same way
+        if not oTrack:
+            oTrack = coverage_track(aAgainst)
+        dMean, dSD = analytic_null(aUCEs, aWeightedSpace, oTrack)
+        if args.validate_analytic:
+            aOverlapDistribution = distribution(aUCEs, aAgainst, aWeightedSpace, args.iterations, None, hEnds,
+                                                args.uces.name, args.against.name, oTrack, args.seed, None, bPrintRun1)
+            validate_analytic(dMean, dSD, aOverlapDistribution)
+        return analytic_statistics(uce_overlaps(aUCEs, aAgainst, oTrack), dMean, dSD)
+
+    # Seeded runs reseed the random module for each iteration, so a shard draws its blocks exactly as a single run
+    # would
+    aBlocks = None
+    if args.shard:
+        if args.seed is None:
+            sys.exit("--shard requires --seed, so that shards draw disjoint, reproducible iterations")
+        aBlocks = shard_blocks(args.iterations, *args.shard)
+        if not aBlocks:
+            sys.exit("Cannot split {0} iterations into {1} shards of whole {2}-iteration blocks".format(
+                args.iterations, args.shard[1], SEED_BLOCK))
+        # The first placement set of the run is printed by the shard that draws it
+        bPrintRun1 = args.verbose and aBlocks[0][0] == 0
+        logging.info("Drawing shard {}/{}, iterations {} to {}".format(args.shard[0], args.shard[1],
+                                                                      aBlocks[0][0] * SEED_BLOCK + 1,
+                                                                      aBlocks[0][0] * SEED_BLOCK +
+                                                                      sum([iCount for iBlock, iCount in aBlocks])))
+    if args.seed is not None:
+        # The KS test draws its reference sample from numpy
+        np.random.seed(args.seed)
+
+    # Create distribution of random overlaps, depending on cluster flag. Placements are only cached when seeded,
+    # as otherwise they are not reproducible
+    if args.cache and args.seed is None:
+        logging.warning("No --seed given, placements will not be cached")
+    if args.incremental:
+        aOverlapDistribution, oTrack = incremental_distribution(args, aUCEs, aGenomeSpaceIntervals, aWeightedSpace,
+                                                                hEnds, bPrintRun1)
+        aUCEOverlaps = uce_overlaps(aUCEs, aAgainst, oTrack)
+        if args.verbose:
+            write_distribution(aOverlapDistribution, args.uces.name, args.against.name)
+        return statistics(aUCEOverlaps, aOverlapDistribution)
+
+    # Get UCE overlaps, which --online needs to count random overlaps beyond them as they are drawn
+    aUCEOverlaps = uce_overlaps(aUCEs, aAgainst, oTrack)
+    oRunning = running_distribution(aUCEOverlaps[1], args, args.against.name) if args.online else None
+    if args.cache and args.seed is not None:
+        oPlacements = cached_placements(args.cache, args.cache_size, aUCEs, aGenomeSpaceIntervals, aWeightedSpace,
+                                        args.iterations, args.cluster, hEnds, args.seed, args.uces.name,
+                                        args.against.name, aBlocks, bPrintRun1)
+        aOverlapDistribution = score_placements(oPlacements, aAgainst, oTrack)
     else:
-        aOverlapDistribution = norm_distribution(aUCEs, aAgainst, aWeightedSpace, args.iterations, args.uces.name, args.against.name)
+        aOverlapDistribution = distribution(aUCEs, aAgainst, aWeightedSpace, args.iterations, args.cluster, hEnds,
+                                            args.uces.name, args.against.name, oTrack, args.seed, aBlocks, bPrintRun1,
+                                            None, oRunning)
 
     logging.debug("Distribution created")
+    if oRunning is not None:
+        # The distribution was streamed to file as it was drawn
+        oRunning.close()
+        return online_statistics(aUCEOverlaps, oRunning)
+    if args.shard:
+        # Statistics are calculated once the shards are merged
+        write_shard(aOverlapDistribution, aUCEOverlaps, args)
+        return None
+
     # Write distribution to file
-    if bVerbose:
-        strRandomMatchFileName = 'randommatches.dist' + str(args.uces.name) + str(args.against.name) + '.txt'
-        print "Writing file to: " + strRandomMatchFileName
-        with open(strRandomMatchFileName, "w") as out:
-            aWriteDistribution = ["\t".join(map(str, line)) for line in aOverlapDistribution]
-            out.write("\n".join(aWriteDistribution))
+    if args.verbose:
+        write_distribution(aOverlapDistribution, args.uces.name, args.against.name)
 
-    # Get UCE overlaps and calculate statistics
-    aUCEOverlaps = overlap(aUCEs, aAgainst)
+    # Calculate statistics
     aStats = statistics(aUCEOverlaps, aOverlapDistribution)
     return aStats
 
@@ -580,4 +1630,9 @@ def main(args):
 if __name__ == "__main__":
     args = getArgs()
     aStats = main(args)
-    writer(aStats, args.uces.name, args.against.name)
+    if aStats is not None and isinstance(args.against, list):
+        multi_writer(aStats, args.uces.name, args.verbose)
+    elif aStats is not None and args.cluster and isinstance(args.cluster, list):
+        sweep_writer(aStats, args.uces.name, args.against.name, args.verbose)
+    elif aStats is not None:
+        writer(aStats, args.uces.name, args.against.name, args.verbose)
@@ -16,9 +16,13 @@ limitations under the License.
 """
 
 
+import datetime
+import logging
 import os.path
 import sys
-import randomoverlaps3_PlosG_10 as ro3
+import time
+import intervalio
+import randomoverlaps as ro
 import argparse
 
 
@@ -27,28 +31,35 @@ def get_args(strInput=None):
 
     Collect arguments from command-line, or from strInput if given (only used for debugging)
     """
-    parser = argparse.ArgumentParser(description="This program allows you to run the randomoverlaps3.py script against "
+    parser = argparse.ArgumentParser(description="This program allows you to run the randomoverlaps.py script against "
                                                  "multiple variant files automatically for the given UCE files. You "
                                                  "must pass at least one UCE file to the script to run. The script will"
                                                  " use the appropriate genome spacing files for each type, which must be"
                                                  " in the same directory")
-    parser.add_argument('file', type=argparse.FileType('rU'),
+    parser.add_argument('file', type=intervalio.input_file,
                         help="A file containing a list of paths to the files you want to process, separated by "
                              "newlines")
     parser.add_argument('-c', '--cluster', type=int,
                         help="The cluster size (kb)")
     parser.add_argument('-o', '--output', help="Output file for results [WARNING: Will overwrite any file with the "
-                                               "same name in the current directory]")
-    parser.add_argument('-a', '--all', type=argparse.FileType('rU'),
+                                               "same name in the current directory]. Defaults to results.txt unless "
+                                               "--db is given")
+    parser.add_argument('--db', help="SQLite database to append results to, one row per variant file and UCE subset "
+                                     "with its parameters, seed, iterations, run time and stats. Created if missing")
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help="The number of random sets created for each analysis [default=1000]")
+    parser.add_argument('--seed', type=int,
+                        help="Seed for the random number generator, making each analysis reproducible")
+    parser.add_argument('-a', '--all', type=intervalio.input_file,
                         help="A file containing [a]ll UCEs (exonic + intronic + intergenic)")
-    parser.add_argument('-e', '--exonic', type=argparse.FileType('rU'),
+    parser.add_argument('-e', '--exonic', type=intervalio.input_file,
                         help="A file containing [e]xonic UCEs")
-    parser.add_argument('-i', '--intronic', type=argparse.FileType('rU'),
+    parser.add_argument('-i', '--intronic', type=intervalio.input_file,
                         help="A file containing [i]ntronic UCEs")
-    parser.add_argument('-t', '--intergenic', type=argparse.FileType('rU'),
+    parser.add_argument('-t', '--intergenic', type=intervalio.input_file,
                         help="A file containing in[t]ergenic UCEs")
     parser.add_argument('-d', '--debug', action='store_true',
-                        help="Set logging level of randomoverlaps3.py to debug")
+                        help="Set logging level of randomoverlaps.py to debug")
     if strInput:
         return parser.parse_args(strInput.split())
     else:
@@ -67,28 +78,32 @@ def get_uces(args):
             allLen = len(list(args.all))
             aUCEFiles.append(('all', args.all.name, 'hg18.genomic.coordinates.nonN', allLen))
         else:
-            print "Cannot find appropriate spacing file for {0}, exiting...".format(args.all.name)
+            print "Cannot find appropriate spacing file for {0} (build it with genomespaces.py), " \
+                  "exiting...".format(args.all.name)
             sys.exit(1)
     if args.intergenic:
         if os.path.isfile('intergenic.boundaries.nonN'):
             interLen = len(list(args.intergenic))
             aUCEFiles.append(('intergenic', args.intergenic.name, 'intergenic.boundaries.nonN', interLen))
         else:
-            print "Cannot find appropriate spacing file for {0}, exiting...".format(args.intergenic.name)
+            print "Cannot find appropriate spacing file for {0} (build it with genomespaces.py), " \
+                  "exiting...".format(args.intergenic.name)
             sys.exit(1)
     if args.intronic:
         if os.path.isfile('intronic.boundaries.nonN'):
             inLen = len(list(args.intronic))
             aUCEFiles.append(('intronic', args.intronic.name, 'intronic.boundaries.nonN', inLen))
         else:
-            print "Cannot find appropriate spacing file for {0}, exiting...".format(args.intronic.name)
+            print "Cannot find appropriate spacing file for {0} (build it with genomespaces.py), " \
+                  "exiting...".format(args.intronic.name)
             sys.exit(1)
     if args.exonic:
         if os.path.isfile('exonic.boundaries.nonN'):
             exLen = len(list(args.exonic))
             aUCEFiles.append(('exonic', args.exonic.name, 'exonic.boundaries.nonN', exLen))
         else:
-            print "Cannot find appropriate spacing file for {0}, exiting...".format(args.exonic.name)
+            print "Cannot find appropriate spacing file for {0} (build it with genomespaces.py), " \
+                  "exiting...".format(args.exonic.name)
             sys.exit(1)
     if len(aUCEFiles) == 0:
         print "Script must be given at least one valid UCE file"
@@ -96,58 +111,113 @@ def get_uces(args):
     return aUCEFiles
 
 
-def run(inFile, aUCEs, cluster, debug, output):
+def load_subsets(aUCEFiles, cluster):
     """
 
-    Run randomoverlaps3.py on the given file using the given parameters
+    Load each UCE file and genome spacing file once, weighting the spacing for the given cluster size
 
-    inFile    -- A fileobject containing the test set of intervals
-    aUCEs     -- A list of UCE files
-    cluster   -- The cluster interval size to be passed to randomoverlaps3.py if given
-    debug     -- Boolean for whether randomoverlaps3.py logs to debug or not
-    output    -- The name of the output file
+    aUCEFiles -- A list of (subset, UCE file, spacing file, number of UCEs) tuples from get_uces
+    cluster   -- The cluster interval size (kb) if given
+    """
+    hSpaces = {}
+    aSubsets = []
+    for strSubset, strUCEFile, strSpaceFile, iLen in aUCEFiles:
+        if strSpaceFile not in hSpaces:
+            hSpaces[strSpaceFile] = ro.weighted_space(ro.load_intervals(strSpaceFile), cluster)
+        aSubsets.append((strSubset, ro.load_intervals(strUCEFile), hSpaces[strSpaceFile], iLen, strUCEFile,
+                         strSpaceFile))
+    return aSubsets
+
+
+def open_store(strPath):
+    """ Open the SQLite results store """
+    try:
+        import resultsstore
+    except ImportError:
+        print "Cannot find resultsstore.py. Ensure file is in working directory, exiting..."
+        sys.exit(1)
+    return resultsstore.ResultsStore(strPath)
+
+
+def write_header(outFile):
+    """ Start the text output file with its header line, erasing any previous output """
+    header = "CNV Set\tUCE subset\telements\tn\tbp\tmean\ts.d.\tmin\tmax\tKSp-value\tKStestResult\tproportion\tp-value\tObs/Exp\tZtestResult\n"
+    with open(outFile, 'w') as fh:
+        fh.write(header)
+
+
+def run(inFile, aSubsets, cluster, output, iterations=1000, seed=None, oStore=None, strRun=None, aAgainst=None):
+    """
+
+    Run the randomoverlaps.py analysis on the given file for each loaded UCE subset
+
+    inFile     -- The path of the test set of intervals
+    aSubsets   -- A list of loaded UCE subsets from load_subsets
+    cluster    -- The cluster interval size (kb) if given
+    output     -- The name of the output file, if text output is written
+    iterations -- The number of random sets for each analysis
+    seed       -- The random seed, if given
+    oStore     -- The results store to add each analysis to, if given
+    strRun     -- The start time of the driver run, stored with each analysis
+    aAgainst   -- The sorted intervals of inFile, if already loaded
     """
     filename = os.path.split(inFile)[1]
     print "Running " + filename
     counter = 0  # Initialize counter so header line is printed only once per run
-    if debug:
-        log = "debug"
-    else:
-        log = "warning"
-    for tup in aUCEs:
-        print "running {}".format(tup[0])
-        if cluster:
-            aStats = ro3.main(ro3.getArgs("-u {0} -g {1} -i {2} -a {3} -c {4}"
-                                          " -d {5}".format(tup[1], tup[2], 1000, inFile, cluster, log), False))
-        else:
-            aStats = ro3.main(ro3.getArgs("-u {0} -g {1} -i {2} -a {3} "
-                                          "-d {4}".format(tup[1], tup[2], 1000, inFile, log), False))
+    if aAgainst is None:
+        aAgainst = ro.load_intervals(inFile)
+    for strSubset, aUCEs, tWeightedSpace, iLen, strUCEFile, strSpaceFile in aSubsets:
+        print "running {}".format(strSubset)
+        dStart = time.time()
+        aStats = ro.analyse(aUCEs, aAgainst, None, iterations, cluster, iSeed=seed,
+                            tWeightedSpace=tWeightedSpace).stats
+        if oStore:
+            oStore.add({"run": strRun, "cnv_set": filename, "path": os.path.abspath(inFile), "subset": strSubset,
+                        "uce_file": strUCEFile, "genome_space": strSpaceFile, "elements": iLen, "cluster": cluster,
+                        "iterations": iterations, "seed": seed, "seconds": time.time() - dStart}, aStats)
+        if not output:
+            continue
         with open(output, 'a+') as fh:
             if counter == 0:
-                fh.write("{0}\t{1}\t{2}\t{3}\n".format(filename, tup[0], tup[3], "\t".join(map(str, aStats))))
+                fh.write("{0}\t{1}\t{2}\t{3}\n".format(filename, strSubset, iLen, "\t".join(map(str, aStats))))
                 counter += 1  # Print variant file name only once per run
             else:
-                fh.write("\t{0}\t{1}\t{2}\n".format(tup[0], tup[3], "\t".join(map(str, aStats))))
+                fh.write("\t{0}\t{1}\t{2}\n".format(strSubset, iLen, "\t".join(map(str, aStats))))
+    if oStore:
+        # Commit once per variant file, so finished files are kept if the run stops
+        oStore.commit()
 
 
 def main(args):
-    aUCEs = get_uces(args)
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+    # UCEs and genome spaces are loaded once and reused for every file
+    aSubsets = load_subsets(get_uces(args), args.cluster)
     aFiles = [line.strip() for line in args.file]
     # Create output file
     if args.output:
         outFile = args.output
+    elif args.db:
+        outFile = None
     else:
         outFile = 'results.txt'
+    if outFile:
         # Write header line once
-    header = "CNV Set\tUCE subset\telements\tn\tbp\tmean\ts.d.\tmin\tmax\tKSp-value\tKStestResult\tproportion\tp-value\tObs/Exp\tZtestResult\n"
-    with open(outFile, 'w') as fh:  # This also erases any previous output
-        fh.write(header)
+        write_header(outFile)
+    oStore = open_store(args.db) if args.db else None
+    strRun = datetime.datetime.now().isoformat()
     for inFile in aFiles:
         if not os.path.isfile(inFile):
             sys.stderr.write("Could not find {0}, skipping...\n".format(inFile))
             continue
-        run(inFile, aUCEs, args.cluster, args.debug, outFile)
-    print "Wrote results to " + outFile
+        run(inFile, aSubsets, args.cluster, outFile, args.iterations, args.seed, oStore, strRun)
+    if outFile:
+        print "Wrote results to " + outFile
+    if oStore:
+        oStore.close()
+        print "Added results to " + args.db
 
 
 if __name__ == "__main__":
@@ -25,15 +25,17 @@ from __future__ import print_function
 import argparse
 import os
 import sys
+import binindex
+import intervalio
 
 
 def getArgs(strInput=None):
     parser = argparse.ArgumentParser("Check one or more interval files for UCE recurrence, using a UCE master file to"
                                      "uniquely identify UCEs.")
-    parser.add_argument('-u', '--uces', type=argparse.FileType('rU'), required=True,
+    parser.add_argument('-u', '--uces', type=intervalio.input_file, required=True,
                         help="An input master UCE file (ID, chr, stop, str, type, gene)")
-    parser.add_argument('-a', '--against', type=argparse.FileType('rU'), required=True, nargs='+',
-                        help="One or more uncollapsed interval files")
+    parser.add_argument('-a', '--against', type=intervalio.input_file, required=True, nargs='+',
+                        help="One or more uncollapsed interval files, in any order. Use - to stream one from stdin")
     parser.add_argument('-o', '--output',
                         help="The name of the output file (default: 'recurrent_UCEs.txt')")
     if strInput:
@@ -56,8 +58,12 @@ def getBool(sPrompt, iDefault=None):
                 return False
             else:
                 raise ValueError
-        except (ValueError, EOFError):
+        except ValueError:
             print("Please enter [Y/n]")
+        except EOFError:
+            # No answer can come, so take the default or refuse
+            print("")
+            return iDefault if iDefault is not None else False
 
 
 def uceDict(fileobj, nFiles):
@@ -85,8 +91,21 @@ def formatInt(aInterval):
     return [aInterval[0], int(aInterval[1]), int(aInterval[2])]
 
 
-def check(interval, hUCEs, n):
+def uceIndex(hUCEs):
+    """ Binned index of the UCE intervals, each returning its UCE ID """
+    oIndex = binindex.BinIndex()
+    for UCE_ID in hUCEs:
+        oIndex.add(hUCEs[UCE_ID][0], UCE_ID)
+    return oIndex
+
+
+def check(interval, hUCEs, n, oIndex=None):
     col = n + 2  # Columns are from [2] onwards as [0] and [1] are UCE coords and type, respectively
+    if oIndex is not None:
+        # Only UCEs in the bins the interval can overlap are looked at
+        for start, stop, UCE_ID in oIndex.overlapping(*interval):
+            hUCEs[UCE_ID][col] += 1  # Increment count
+        return
     for UCE_ID in hUCEs:
         uce_interval = hUCEs[UCE_ID][0]  # Get interval corresponding to UCE ID
         if overlap(uce_interval, interval):
@@ -110,6 +129,16 @@ def overlap(intervalA, intervalB):
     return False
 
 
+def count(aIntervals, hUCEs, n, bProgress=False, oIndex=None):
+    """ Count the intervals of the nth file, in any order, overlapping each UCE """
+    if oIndex is None:
+        oIndex = uceIndex(hUCEs)
+    for lino, interval in enumerate(aIntervals, 1):
+        if bProgress:
+            print ("Checking interval {0}".format(lino), end='\r')
+        check(interval, hUCEs, n, oIndex)
+
+
 def overwriteCheck(filename):
     if os.path.isfile(filename):
         if getBool("{0} already exists in current directory, overwrite? [Y/n]: ".format(filename)):
@@ -119,13 +148,13 @@ def overwriteCheck(filename):
     return True
 
 
-def write(hDict, outputArg, againstFiles):
+def write(hDict, outputArg, againstFiles, bConfirm=True):
     if outputArg:
         filename = outputArg
     else:
         filename = "recurrent_UCEs.txt"
     againstHeader = " Count\t".join(againstFiles)
-    if overwriteCheck(filename):
+    if not bConfirm or overwriteCheck(filename):
         with open(filename, 'w') as fh:
             fh.write("UCE_ID\tChr\tStart\tStop\tType\tGene\t{0}\n".format(againstHeader))
             for key, val in hDict.items():
@@ -139,14 +168,14 @@ def write(hDict, outputArg, againstFiles):
 def main(args):
     nFiles = len(args.against)
     hUCEs = uceDict(args.uces, nFiles)
+    oIndex = uceIndex(hUCEs)
     for n, varfile in enumerate(args.against):
         print ("Checking for UCE reoccurence in {0}".format(os.path.basename(varfile.name)))
-        for lino, line in enumerate(varfile, 1):
-            print ("Checking interval {0}".format(lino), end='\r')
-            interval = formatInt(line.strip().split('\t'))
-            check(interval, hUCEs, n)
+        count((formatInt(line.strip().split('\t')) for line in varfile if line.strip()), hUCEs, n, True, oIndex)
         print ("", end='\n')
-    write(hUCEs, args.output, [os.path.basename(infile.name) for infile in args.against])
+    # Only ask before overwriting when someone can answer: not when stdin is streamed in or not a terminal
+    bConfirm = sys.stdin.isatty() and sys.stdin not in args.against
+    write(hUCEs, args.output, [os.path.basename(infile.name) for infile in args.against], bConfirm)
 
 
 if __name__ == "__main__":
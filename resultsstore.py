@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+Module to implement the SQLite results store of randomoverlaps_driver.py
+
+Each analysis (one variant file against one UCE subset) is stored as a row of the results table, with its
+parameters, seed, iteration count, timing and every stats column, so results of many driver runs can be appended
+to one database and queried without parsing text output, e.g.
+
+    SELECT subset, AVG("Obs/Exp") FROM results WHERE cluster IS NULL GROUP BY subset
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import sqlite3
+import sys
+
+# Parameter columns, then the stats columns in the order of randomoverlaps.statistics
+PARAMETER_COLUMNS = [("run", "TEXT"), ("cnv_set", "TEXT"), ("path", "TEXT"), ("subset", "TEXT"),
+                     ("uce_file", "TEXT"), ("genome_space", "TEXT"), ("elements", "INTEGER"),
+                     ("cluster", "INTEGER"), ("iterations", "INTEGER"), ("seed", "INTEGER"), ("seconds", "REAL")]
+STATS_COLUMNS = [("n", "INTEGER"), ("bp", "INTEGER"), ("mean", "REAL"), ("sd", "REAL"), ("min", "INTEGER"),
+                 ("max", "INTEGER"), ("ksPval", "REAL"), ("KSresult", "TEXT"), ("proportion", "REAL"),
+                 ("pvalue", "REAL"), ("Obs/Exp", "REAL"), ("ZtestResult", "TEXT")]
+INDEXES = [("results_cnv_set", ["cnv_set"]), ("results_subset", ["subset", "cluster"]), ("results_run", ["run"])]
+
+
+class ResultsStore(object):
+    """ Results table of an SQLite database, created on first use and appended to by later runs """
+
+    def __init__(self, strPath):
+        self.strPath = strPath
+        try:
+            self.oConnection = sqlite3.connect(strPath)
+            aColumns = ['"{0}" {1}'.format(strName, strType) for strName, strType in PARAMETER_COLUMNS + STATS_COLUMNS]
+            self.oConnection.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, {0})".format(
+                ", ".join(aColumns)))
+            for strIndex, aIndexColumns in INDEXES:
+                self.oConnection.execute("CREATE INDEX IF NOT EXISTS {0} ON results ({1})".format(
+                    strIndex, ", ".join(aIndexColumns)))
+            self.oConnection.commit()
+        except sqlite3.DatabaseError as err:
+            print "Cannot use {0} as a results database ({1}), exiting...".format(strPath, err)
+            sys.exit(1)
+
+    def add(self, hParameters, aStats):
+        """ Store one analysis, given its parameters by column name and its stats row """
+        aNames = [strName for strName, strType in PARAMETER_COLUMNS + STATS_COLUMNS]
+        aValues = [hParameters.get(strName) for strName, strType in PARAMETER_COLUMNS] + list(aStats)
+        # numpy scalars are stored as the matching Python values
+        aValues = [oValue.item() if hasattr(oValue, "item") else oValue for oValue in aValues]
+        self.oConnection.execute("INSERT INTO results ({0}) VALUES ({1})".format(
+            ", ".join(['"{0}"'.format(strName) for strName in aNames]), ", ".join(["?"] * len(aNames))), aValues)
+
+    def commit(self):
+        self.oConnection.commit()
+
+    def close(self):
+        self.oConnection.commit()
+        self.oConnection.close()
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the results store of "
+          "the randomoverlaps_driver.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
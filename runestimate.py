@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+'''
+Module to implement the run cost estimator (--estimate) in randomoverlaps.py
+
+The estimates follow how random sets are drawn. random_interval picks genome space intervals by weight until one can
+hold the length being placed, so each length fits with the total weight of the spaces at least that long, and gives
+up after a fixed number of picks. A placement set is redrawn when any two of its intervals overlap or touch. For
+intervals placed independently, the expected number of such pairs is the sum over spaces of the chance that both
+land in the space times the chance that their starts fall within (length + length + 3) bases of each other, and the
+set is accepted with probability exp(-pairs). Time per phase comes from a short calibration run.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import math
+import sys
+import numpy as np
+
+# Approximate bytes held per iteration by a [count, bp] row, and per placed interval by stored placement arrays
+# (chromosome code, start and stop, copied once when scored)
+ROW_BYTES = 250
+PLACED_BYTES = 60
+
+
+def space_arrays(aWeightedSpace):
+    """ Span (stop - start) and weight of each genome space interval """
+    npArSpans = np.array([aSpace[2] - aSpace[1] for aSpace, dWeight in aWeightedSpace], dtype=np.int64)
+    npArWeights = np.array([dWeight for aSpace, dWeight in aWeightedSpace], dtype=np.float64)
+    return npArSpans, npArWeights
+
+
+def fit_probabilities(aLengths, aWeightedSpace):
+    """
+    Each distinct length (stop - start), how many of the given lengths it is, and the chance that one pick from the
+    weighted space can hold it
+
+    """
+    npArSpans, npArWeights = space_arrays(aWeightedSpace)
+    aiOrder = np.argsort(npArSpans)
+    npArSpans = npArSpans[aiOrder]
+    # Weight of the spaces at least as long as each span, from the longest down
+    npArAbove = np.cumsum(npArWeights[aiOrder][::-1])[::-1]
+    npArLengths, npArCounts = np.unique(np.asarray(aLengths, dtype=np.int64), return_counts=True)
+    aiFirst = np.searchsorted(npArSpans, npArLengths, side='left')
+    npArFit = np.zeros(len(npArLengths))
+    abAny = aiFirst < len(npArSpans)
+    npArFit[abAny] = npArAbove[aiFirst[abAny]]
+    return npArLengths, npArCounts, np.minimum(npArFit, 1.0)
+
+
+def limit_probability(aLengths, aWeightedSpace, iTries):
+    """ Chance that placing one set of the given lengths gives up on some length after iTries picks """
+    npArLengths, npArCounts, npArFit = fit_probabilities(aLengths, aWeightedSpace)
+    if np.any(npArFit <= 0):
+        return 1.0
+    # P(all placed) is the product over lengths of (1 - (1 - fit) ** tries) ** count
+    with np.errstate(divide='ignore'):
+        npArFail = np.exp(iTries * np.log1p(-npArFit))
+    if np.any(npArFail >= 1):
+        return 1.0
+    return -math.expm1(np.sum(npArCounts * np.log1p(-npArFail)))
+
+
+def pair_distance(aLengths):
+    """ Sum over pairs of intervals of the distance between starts within which they overlap or touch """
+    iN = len(aLengths)
+    return (iN - 1) * float(sum(aLengths)) + 3.0 * iN * (iN - 1) / 2
+
+
+def collision_pairs(aLengths, aWeightedSpace, aaGroups=None):
+    """
+    Expected number of pairs of intervals in one placement set that overlap or touch. With clusters, aaGroups holds
+    the lengths of the UCEs of each cluster: UCEs move with their cluster, so only pairs from different clusters can
+    collide, each as two independently placed intervals would
+
+    """
+    npArSpans, npArWeights = space_arrays(aWeightedSpace)
+    # Chance that two placements share a space, over the number of starts available in it
+    dShared = np.sum(npArWeights ** 2 / (npArSpans + 1))
+    if aaGroups is None:
+        return dShared * pair_distance(aLengths)
+    dPairs = pair_distance([iLength for aGroup in aaGroups for iLength in aGroup]) - \
+        sum([pair_distance(aGroup) for aGroup in aaGroups])
+    return dShared * dPairs
+
+
+def retry_exceed_probability(iIterations, dAccept, iLimit):
+    """
+    Chance that the retries of iIterations placement sets, each accepted with probability dAccept, exceed iLimit,
+    from a normal approximation of the negative binomial
+
+    """
+    if dAccept >= 1.0:
+        return 0.0
+    if dAccept <= 0.0:
+        return 1.0
+    dMean = iIterations * (1 - dAccept) / dAccept
+    dSD = math.sqrt(iIterations * (1 - dAccept)) / dAccept
+    if dSD == 0:
+        return float(dMean > iLimit)
+    return 0.5 * math.erfc((iLimit + 0.5 - dMean) / (dSD * math.sqrt(2)))
+
+
+def memory_bytes(iIterations, iPlaced, bStoredPlacements, bOnline, iReservoir, iBlock):
+    """ Approximate memory for the distribution and any stored placement sets """
+    if bOnline:
+        iBytes = iReservoir * 40
+        if bStoredPlacements:
+            iBytes += iBlock * iPlaced * PLACED_BYTES
+        return iBytes
+    iBytes = iIterations * ROW_BYTES
+    if bStoredPlacements:
+        iBytes += iIterations * iPlaced * PLACED_BYTES
+    return iBytes
+
+
+def format_seconds(dSeconds):
+    if dSeconds < 1:
+        return "{0:.2f} ms".format(dSeconds * 1000)
+    if dSeconds < 120:
+        return "{0:.1f} s".format(dSeconds)
+    if dSeconds < 7200:
+        return "{0:.1f} min".format(dSeconds / 60)
+    return "{0:.1f} h".format(dSeconds / 3600)
+
+
+def format_bytes(dBytes):
+    for strUnit in ["B", "KB", "MB", "GB"]:
+        if dBytes < 1024:
+            return "{0:.1f} {1}".format(dBytes, strUnit)
+        dBytes /= 1024.0
+    return "{0:.1f} TB".format(dBytes)
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the run cost estimator in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+'''
+Module to implement the circular-shift null model (--null shift) in randomoverlaps.py
+
+The genome space intervals are laid end to end as one coordinate line (or one line per chromosome), and each UCE is
+given the position of its start on the line. A random set is made by rotating every UCE on a line by the same random
+offset, wrapping around the end of the line, and mapping the shifted starts back to the genome. The spacing between
+UCEs is kept wherever they stay within one genome space interval. A shifted UCE that would run past the end of its
+interval into a gap carries the overshoot into the next interval on the line that can hold it, scaled from the
+1 to length - 1 bases a UCE can overshoot by to the starts the interval has room for. Carried UCEs are spread evenly
+over the interval rather than stacked at its start, but may land on a neighbour, so a set with more overlapping or
+touching UCEs than the UCEs themselves is drawn again from the next of CANDIDATES offsets drawn for its iteration
+(then from a stream seeded by those offsets), and every random set has one interval per UCE without new overlaps.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import hashlib
+import random
+import sys
+import numpy as np
+
+SHIFT_MODES = ["genome", "chromosome"]
+CANDIDATES = 8  # Offsets drawn for each iteration, tried in turn until one shifts the UCEs without new overlaps
+MAX_TRIES = 10000  # Further offsets tried for an iteration before giving up
+CHROMOSOME_SPAN = 2 ** 40  # Larger than any chromosome, used to give each chromosome its own coordinate range
+
+
+class CircularShift(object):
+    """ UCEs placed on the coordinate line of the genome space, shifted together to make each random set """
+
+    def __init__(self, aUCEs, aGenomeSpaceIntervals, strBy="genome"):
+        if strBy not in SHIFT_MODES:
+            raise ValueError("Unknown shift mode {0}".format(strBy))
+        self.strBy = strBy
+        self.name = "shift-" + strBy
+        aSpace = sorted(aGenomeSpaceIntervals, key=lambda x: (x[0], x[1]))
+        self.aChromosomes = sorted(set([aInterval[0] for aInterval in aSpace]))
+        hCodes = dict([(strChr, i) for i, strChr in enumerate(self.aChromosomes)])
+        self.npArSegCodes = np.array([hCodes[aInterval[0]] for aInterval in aSpace], dtype=np.uint16)
+        self.npArSegStarts = np.array([aInterval[1] for aInterval in aSpace], dtype=np.int64)
+        self.npArSegStops = np.array([aInterval[2] for aInterval in aSpace], dtype=np.int64)
+        npArSegLengths = self.npArSegStops - self.npArSegStarts + 1
+        # Position of the first base of each interval on the concatenated line
+        self.npArSegOffsets = np.concatenate(([0], np.cumsum(npArSegLengths)[:-1]))
+        # Lines are runs of intervals: all of them, or those of each chromosome
+        if strBy == "genome":
+            self.npArSegLines = np.zeros(len(aSpace), dtype=np.int64)
+        else:
+            self.npArSegLines = self.npArSegCodes.astype(np.int64)
+        iLines = int(self.npArSegLines.max()) + 1 if len(aSpace) else 0
+        self.npArLineFirst = np.searchsorted(self.npArSegLines, np.arange(iLines), side='left')
+        self.npArLineLast = np.searchsorted(self.npArSegLines, np.arange(iLines), side='right') - 1
+        self.npArLineStarts = self.npArSegOffsets[self.npArLineFirst]
+        self.npArLineLengths = self.npArSegOffsets[self.npArLineLast] + npArSegLengths[self.npArLineLast] - \
+            self.npArLineStarts
+        # Next interval on the same line, wrapping to the first after the last
+        self.npArSegNext = np.arange(len(aSpace)) + 1
+        self.npArSegNext[self.npArLineLast] = self.npArLineFirst
+        self.npArSegLengths = npArSegLengths
+        self.place_uces(aUCEs, npArSegLengths)
+        # UCEs overlapping or touching each other in place, which shifted sets may keep but not add to
+        self.iClashes = 0
+        if len(aUCEs):
+            aSorted = sorted([(self.aChromosomes.index(aUCE[0]) if aUCE[0] in self.aChromosomes else -1, aUCE[1],
+                               aUCE[2]) for aUCE in aUCEs])
+            npArSorted = np.array(aSorted, dtype=np.int64).reshape(1, len(aSorted), 3)
+            self.iClashes = int(self.clashes(npArSorted[:, :, 0], npArSorted[:, :, 1], npArSorted[:, :, 2])[0])
+
+    def place_uces(self, aUCEs, npArSegLengths):
+        """ Line, position and length of each UCE. A UCE starting outside the genome space takes the next position """
+        aPositions = []
+        aLines = []
+        for aUCE in aUCEs:
+            iStart = aUCE[1]
+            if aUCE[0] in self.aChromosomes:
+                aiSegs = np.flatnonzero(self.npArSegCodes == self.aChromosomes.index(aUCE[0]))
+                iSeg = aiSegs[0] + np.searchsorted(self.npArSegStops[aiSegs], iStart, side='left')
+                if iSeg > aiSegs[-1]:
+                    # Past the last interval of its chromosome, so at the start of the next interval on the line
+                    iSeg = self.npArSegNext[aiSegs[-1]]
+                    iStart = self.npArSegStarts[iSeg]
+            elif self.strBy == "chromosome":
+                sys.exit("{0} has no genome space to shift UCEs along, exiting...".format(aUCE[0]))
+            else:
+                # At the start of the first interval of the chromosomes sorting after its own
+                iSeg = np.searchsorted(self.npArSegCodes, np.searchsorted(self.aChromosomes, aUCE[0]), side='left')
+                iSeg = iSeg if iSeg < len(self.npArSegStarts) else 0
+                iStart = self.npArSegStarts[iSeg]
+            aLines.append(self.npArSegLines[iSeg])
+            aPositions.append(self.npArSegOffsets[iSeg] + max(0, iStart - self.npArSegStarts[iSeg]))
+        self.npArLines = np.array(aLines, dtype=np.int64)
+        self.npArPositions = np.array(aPositions, dtype=np.int64)
+        self.npArLengths = np.array([aUCE[2] - aUCE[1] + 1 for aUCE in aUCEs], dtype=np.int64)
+        # Every UCE must fit in some interval of its line, or moving it past gaps would never end
+        npArLongest = np.zeros(len(self.npArLineFirst), dtype=np.int64)
+        np.maximum.at(npArLongest, self.npArSegLines, npArSegLengths)
+        abTooLong = self.npArLengths > npArLongest[self.npArLines]
+        if abTooLong.any():
+            sys.exit("{0} UCEs are longer than any genome space interval they could be shifted to, "
+                     "exiting...".format(int(abTooLong.sum())))
+
+    def offsets(self, iIterations):
+        """ CANDIDATES random offsets of each line for each iteration, drawn from the random module """
+        return np.array([[random.randrange(int(iLength)) for iLength in self.npArLineLengths]
+                         for j in xrange(iIterations * CANDIDATES)],
+                        dtype=np.int64).reshape(iIterations, CANDIDATES, len(self.npArLineLengths))
+
+    @staticmethod
+    def clashes(npArCodes, npArStarts, npArStops):
+        """ Number of UCEs overlapping or touching an earlier one in each row of sets sorted by chromosome and start """
+        npArGlobalStops = np.maximum.accumulate(npArCodes * CHROMOSOME_SPAN + npArStops, axis=1)
+        return ((npArCodes[:, 1:] * CHROMOSOME_SPAN + npArStarts[:, 1:]) <= (npArGlobalStops[:, :-1] + 1)).sum(axis=1)
+
+    def place(self, npArOffsets):
+        """
+        Chromosome codes, starts and stops of the sets shifted by each row of line offsets, one row per set sorted by
+        chromosome and start, with the index of the UCE in each column
+
+        """
+        iIterations = len(npArOffsets)
+        npArLineStarts = self.npArLineStarts[self.npArLines]
+        npArLinePos = (self.npArPositions - npArLineStarts + npArOffsets[:, self.npArLines]) % \
+            self.npArLineLengths[self.npArLines] + npArLineStarts
+        aiSegs = np.searchsorted(self.npArSegOffsets, npArLinePos, side='right') - 1
+        npArStarts = self.npArSegStarts[aiSegs] + npArLinePos - self.npArSegOffsets[aiSegs]
+        npArLengths = np.broadcast_to(self.npArLengths, npArStarts.shape)
+        npArStops = npArStarts + npArLengths - 1
+        abCrossing = npArStops > self.npArSegStops[aiSegs]
+        # Bases run past the end of the interval, carried into the next interval that can hold the UCE
+        npArCarry = np.where(abCrossing, npArStops - self.npArSegStops[aiSegs], 0)
+        while abCrossing.any():
+            aiSegs[abCrossing] = self.npArSegNext[aiSegs[abCrossing]]
+            abFits = abCrossing & (self.npArSegLengths[aiSegs] >= npArLengths)
+            npArRoom = self.npArSegLengths[aiSegs[abFits]] - npArLengths[abFits] + 1
+            npArStarts[abFits] = self.npArSegStarts[aiSegs[abFits]] + \
+                (npArCarry[abFits] - 1) * npArRoom // (npArLengths[abFits] - 1)
+            abCrossing &= ~abFits
+        npArStops = npArStarts + npArLengths - 1
+        npArCodes = self.npArSegCodes[aiSegs]
+        aiOrder = np.lexsort((npArStops, npArStarts, npArCodes), axis=1)
+        aiRows = np.arange(iIterations)[:, None]
+        return npArCodes[aiRows, aiOrder], npArStarts[aiRows, aiOrder], npArStops[aiRows, aiOrder], aiOrder
+
+    def retry(self, npArCandidates):
+        """ A set shifted by offsets from a stream seeded by an iteration's candidates, none of which could be used """
+        oRandom = random.Random(int(hashlib.sha256(npArCandidates.tostring()).hexdigest()[:16], 16))
+        for iTry in xrange(MAX_TRIES):
+            npArOffsets = np.array([[oRandom.randrange(int(iLength)) for iLength in self.npArLineLengths]],
+                                   dtype=np.int64)
+            tSet = self.place(npArOffsets)
+            if self.clashes(*tSet[:3])[0] <= self.iClashes:
+                return tSet
+        print "Cannot find {0} non-overlapping shifted UCEs after {1} tries".format(len(self.npArLengths),
+                                                                                  MAX_TRIES + CANDIDATES)
+        print "Exiting..."
+        sys.exit(1)
+
+    def shift(self, npArCandidates):
+        """
+        Chromosome codes, starts and stops of the sets shifted by the first candidate offsets of each iteration (rows of
+        offsets()) adding no overlaps, one row per set sorted by chromosome and start, with the index of the UCE in
+        each column
+
+        """
+        iIterations = len(npArCandidates)
+        npArCodes, npArStarts, npArStops, aiOrder = self.place(npArCandidates[:, 0])
+        abPending = self.clashes(npArCodes, npArStarts, npArStops) > self.iClashes
+        for iCandidate in xrange(1, CANDIDATES):
+            if not abPending.any():
+                break
+            aiPending = np.flatnonzero(abPending)
+            tSets = self.place(npArCandidates[aiPending, iCandidate])
+            abOK = self.clashes(*tSets[:3]) <= self.iClashes
+            for npArAll, npArSet in zip((npArCodes, npArStarts, npArStops, aiOrder), tSets):
+                npArAll[aiPending[abOK]] = npArSet[abOK]
+            abPending[aiPending[abOK]] = False
+        for j in np.flatnonzero(abPending):
+            for npArAll, npArSet in zip((npArCodes, npArStarts, npArStops, aiOrder), self.retry(npArCandidates[j])):
+                npArAll[j] = npArSet[0]
+        return npArCodes, npArStarts, npArStops, aiOrder
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the circular-shift null model in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")
@@ -6,6 +6,12 @@ Given one or more 1-based interval files, this script sums up the coordinates co
 the intervals and returns the number of lines and number of bases covered.
 Collapses file to prevent double-counting of intervals.
 
+Files are streamed, so files sorted by chromosome and start are counted in constant memory. Unsorted files are
+detected as they are read and counted again through an external sort that holds at most --sort-buffer intervals in
+memory. Input streamed from stdin (-) cannot be read twice, so it is always counted through the external sort. Several
+files may be counted in parallel worker processes, and results are printed in the order the files were given,
+optionally followed by one line per chromosome (file, chromosome, intervals, bases).
+
 Chamith Fonseka
 10 April 2013
 
@@ -24,7 +30,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import argparse
+import heapq
+import multiprocessing
 import sys
+import tempfile
+import intervalio
+
+try:
+    import genomemask
+except ImportError:
+    genomemask = None
 
 
 def getArgs(strInput=None):
@@ -33,64 +48,167 @@ def getArgs(strInput=None):
                                                  "double-counting")
     parser.add_argument('-u','--uncollapse', action='store_true',
                         help="Sum coordinates of given files without collapsing overlapping intervals")
-    parser.add_argument("file", type=argparse.FileType('rU'), nargs='+',
-                        help="One or more 3-column interval files")
+    parser.add_argument('-c', '--chromosomes', action='store_true',
+                        help="Also report the intervals and bases of each chromosome")
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help="Number of files to count at once in worker processes [default=1]")
+    parser.add_argument('-b', '--sort-buffer', type=int, default=1000000,
+                        help="Maximum number of intervals held in memory when sorting an unsorted file "
+                             "[default=1000000]")
+    parser.add_argument("file", type=intervalio.input_file, nargs='+',
+                        help="One or more 3-column interval files or genomemask.py mask files")
     if strInput:
         print "Given debug argument string: {0}".format(strInput)
         return parser.parse_args(strInput.split())
     return parser.parse_args()
 
 
-def counter(aIntervals):
-    """ Count bases in every interval and sum across them """
+class UnsortedError(Exception): pass
+
+
+def parse(fileobj):
+    """ Yield the intervals of a 3-column interval file """
+    for line in fileobj:
+        if line.strip():
+            aLine = line.strip().split('\t')
+            yield [aLine[0], int(aLine[1]), int(aLine[2])]
+
+
+def sorted_intervals(aIntervals):
+    """ Pass on intervals, raising UnsortedError if they are not sorted by chromosome and start """
+    previous = None
+    for interval in aIntervals:
+        if previous is not None and (interval[0], interval[1]) < previous:
+            raise UnsortedError
+        previous = (interval[0], interval[1])
+        yield interval
+
+
+def external_sort(aIntervals, iBuffer):
+    """ Yield intervals sorted by chromosome, start and stop, holding at most iBuffer of them in memory at a time """
+    aChunks = []
+    aBuffer = []
+    for interval in aIntervals:
+        aBuffer.append(interval)
+        if len(aBuffer) >= iBuffer:
+            aBuffer.sort(key=lambda x: (x[0], x[1], x[2]))
+            # Sorted runs are spilled to temporary files and merged once all have been written
+            fh = tempfile.TemporaryFile()
+            fh.writelines(["{0}\t{1}\t{2}\n".format(*interval) for interval in aBuffer])
+            fh.seek(0)
+            aChunks.append(parse(fh))
+            aBuffer = []
+    aBuffer.sort(key=lambda x: (x[0], x[1], x[2]))
+    if not aChunks:
+        return iter(aBuffer)
+    aChunks.append(iter(aBuffer))
+    return heapq.merge(*aChunks)
+
+
+def stream_collapse(aIntervals):
+    """ Yield the intervals of a sorted stream, merging those that overlap or touch """
+    current = None
+    for interval in aIntervals:
+        if current is not None and interval[0] == current[0] and interval[1] <= current[2] + 1:
+            current[2] = max(current[2], interval[2])
+            continue
+        if current is not None:
+            yield current
+        current = list(interval)
+    if current is not None:
+        yield current
+
+
+def tally(aIntervals):
+    """ Intervals and bases covered in total and by chromosome, in order of first appearance """
     iBaseCoverage = iIntervalCount = 0
+    aChromosomes = []
+    hChromosomes = {}
     for interval in aIntervals:
+        if interval[0] not in hChromosomes:
+            hChromosomes[interval[0]] = [0, 0]
+            aChromosomes.append(interval[0])
         # Add one to correct 0-based count
-        iBaseCoverage += (interval[2] - interval[1] + 1)
+        iBases = interval[2] - interval[1] + 1
+        hChromosomes[interval[0]][0] += 1
+        hChromosomes[interval[0]][1] += iBases
         iIntervalCount += 1
-    return iBaseCoverage, iIntervalCount
-
-
-def collapse(aIntervals):
-    # Initialize variables
-    strChr = iStart = iStop = 0
-    aOut = []
-    for aInterval in aIntervals:
-        # Test if an interval has been stored (always past first loop)
-        if strChr:
-            # Test if next interval is on a different chr OR if start of
-            # next interval is larger than stop of previous interval 
-            if strChr != aInterval[0] or int(aInterval[1]) > (iStop + 1):
-                # Write interval and clear start/stop coordinates
-                aOut.append([strChr, iStart, iStop])
-                iStart = iStop = 0
-        strChr = aInterval[0]
-        # Advance to next interval if iStart is empty
-        if not iStart:
-            iStart = int(aInterval[1])
-            # If next interval overlaps, adjust stop to larger coordinate
-        if int(aInterval[2]) > iStop:
-            iStop = int(aInterval[2])
-        # Write last line
-    aOut.append([strChr, iStart, iStop])
-    return aOut
+        iBaseCoverage += iBases
+    return iIntervalCount, iBaseCoverage, [(strChr,) + tuple(hChromosomes[strChr]) for strChr in aChromosomes]
+
+
+def summarise(strPath, bUncollapse=False, iBuffer=1000000):
+    """
+    Return (file, intervals, bases, per-chromosome (chromosome, intervals, bases)) for one file, streaming it and
+    falling back to an external sort if it turns out to be unsorted
+
+    """
+    if genomemask and genomemask.is_mask(strPath):
+        # Masks are already collapsed, so count runs and popcount directly
+        oMask = genomemask.GenomeMask(strPath)
+        aChromosomes = [(strChr, len(oMask.chromosome_intervals(strChr)), oMask.coverage(strChr))
+                        for strChr in oMask.aChromosomes]
+        return (strPath, sum([line[1] for line in aChromosomes]), oMask.coverage(), aChromosomes)
+    with intervalio.open_input(strPath) as fh:
+        if bUncollapse:
+            return (strPath,) + tally(parse(fh))
+        try:
+            return (strPath,) + tally(stream_collapse(sorted_intervals(parse(fh))))
+        except UnsortedError:
+            sys.stderr.write("{0} is not sorted, sorting...\n".format(strPath))
+    with intervalio.open_input(strPath) as fh:
+        return (strPath,) + tally(stream_collapse(external_sort(parse(fh), iBuffer)))
+
+
+def summarise_stream(fileobj, bUncollapse=False, iBuffer=1000000):
+    """ summarise for a stream that can only be read once, such as stdin, sorting it unless it is uncollapsed """
+    if bUncollapse:
+        return (fileobj.name,) + tally(parse(fileobj))
+    return (fileobj.name,) + tally(stream_collapse(external_sort(parse(fileobj), iBuffer)))
+
+
+def worker(tJob, fnSummarise=summarise):
+    """ summarise for a worker process, returning the error message instead of a result if a file cannot be read """
+    try:
+        return fnSummarise(*tJob)
+    except (IndexError, ValueError):
+        return "Unable to parse lines in {0}, exiting...".format(getattr(tJob[0], "name", tJob[0]))
+    except IOError as err:
+        return "Unable to read {0}: {1}, exiting...".format(getattr(tJob[0], "name", tJob[0]), err.strerror or err)
 
 
 if __name__ == "__main__":
     args = getArgs()
     if not args.uncollapse:
         sys.stderr.write('Collapsing overlapping intervals...\n')
+    # Files are reopened by name in each worker, while stdin is counted here as it is read
+    aJobs = []
+    oStdinResult = None
     for inFile in args.file:
-        try:
-            aIntervals = map(lambda x: [x[0], int(x[1]), int(x[2])],
-                         [line.strip().split('\t') for line in inFile if line.strip()])
-            aIntervals.sort(key=lambda x: (x[0], x[1], x[2]))
-        except IndexError, ValueError:
-            print "Unable to parse lines in {0}, exiting...".format(inFile.name)
-            sys.exit(1)
-        if not args.uncollapse:
-            aCollapsed = collapse(aIntervals)
-        else:
-            aCollapsed = list(aIntervals)
-        iCoverage, iCount = counter(aCollapsed)
-        print "{0}\t{1}\t{2}".format(inFile.name, iCount, iCoverage)
+        if inFile is sys.stdin:
+            oStdinResult = worker((inFile, args.uncollapse, args.sort_buffer), summarise_stream)
+            continue
+        inFile.close()
+        aJobs.append((inFile.name, args.uncollapse, args.sort_buffer))
+    oPool = None
+    if args.processes > 1 and len(aJobs) > 1:
+        oPool = multiprocessing.Pool(min(args.processes, len(aJobs)))
+        aFileResults = oPool.imap(worker, aJobs)
+    else:
+        aFileResults = (worker(tJob) for tJob in aJobs)
+    try:
+        for inFile in args.file:
+            oResult = oStdinResult if inFile is sys.stdin else next(aFileResults)
+            if isinstance(oResult, str):
+                print oResult
+                sys.exit(1)
+            strName, iCount, iCoverage, aChromosomes = oResult
+            print "{0}\t{1}\t{2}".format(strName, iCount, iCoverage)
+            if args.chromosomes:
+                for strChr, iChrCount, iChrCoverage in aChromosomes:
+                    print "{0}\t{1}\t{2}\t{3}".format(strName, strChr, iChrCount, iChrCoverage)
+    finally:
+        if oPool is not None:
+            # Stop any workers still counting if a file could not be read
+            oPool.terminate()
+            oPool.join()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''
+Module to implement the windowed depletion scan (--scan) in randomoverlaps.py
+
+Windows of a fixed width are slid along each chromosome of the genome space. A UCE belongs to the window holding its
+start, so the UCEs of a window are a run of the UCEs sorted by chr, start, stop, found by binary search of their
+starts, and the overlap of any window is the difference of two entries of a cumulative sum over the UCEs.
+
+Windows are scored against the random sets simulated for the whole UCE set, which keep the UCE each interval was
+drawn for. The bases covered by the against set inside each random interval are summed over the UCEs in UCE order,
+so the null overlap of every window in every random set is again the difference of two cumulative sums. Only running
+sums are kept for each window, giving the null mean and s.d., and the count of random sets overlapping the window by
+no more than the UCEs. The p-value of each window is this empirical lower tail (depletion), (1 + count) /
+(1 + iterations), and needs no assumption on the shape of the null, which for a window of one or two UCEs is far from
+normal. Benjamini-Hochberg q-values are given over all windows holding a UCE.
+
+Copyright 2017 Harvard University, Wu Lab
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+'''
+
+import sys
+import numpy as np
+
+HEADER = ["chr", "start", "stop", "uces", "uce_bp", "overlap_bp", "expected_bp", "s.d.", "Obs/Exp", "p-value",
+          "q-value"]
+
+
+class WindowScan(object):
+    """
+    Windows holding UCEs with their observed overlap, and running sums of the overlap of each window in the random
+    sets added. aUCEs must be sorted by chr, start, stop
+
+    """
+
+    def __init__(self, aUCEs, oTrack, hEnds, iWidth, iStep):
+        self.oTrack = oTrack
+        self.iUCEs = len(aUCEs)
+        npArUCEStarts = np.array([aUCE[1] for aUCE in aUCEs], dtype=np.int64)
+        npArUCEStops = np.array([aUCE[2] for aUCE in aUCEs], dtype=np.int64)
+        npArUCEChr = np.array([aUCE[0] for aUCE in aUCEs])
+        # Index 0 is padding so that the sum over UCEs i to j - 1 is entry j minus entry i
+        npArLengths = np.concatenate(([0], np.cumsum(npArUCEStops - npArUCEStarts + 1)))
+        npArCovered = np.concatenate(([0], np.cumsum(oTrack.covered_each(npArUCEChr, npArUCEStarts, npArUCEStops))))
+        self.aChr = []
+        aColumns = []
+        for strChr in sorted(hEnds):
+            npArStarts, npArStops = window_bounds(hEnds[strChr], iWidth, iStep)
+            aiUCEs = np.flatnonzero(npArUCEChr == strChr)
+            iOffset = aiUCEs[0] if len(aiUCEs) else 0
+            aiFirst = iOffset + np.searchsorted(npArUCEStarts[aiUCEs], npArStarts, side='left')
+            aiLast = iOffset + np.searchsorted(npArUCEStarts[aiUCEs], npArStops, side='right')
+            abKeep = aiLast > aiFirst
+            self.aChr.extend([strChr] * int(abKeep.sum()))
+            aColumns.append([npAr[abKeep] for npAr in (npArStarts, npArStops, aiFirst, aiLast)])
+        if self.aChr:
+            self.npArStarts, self.npArStops, self.aiFirst, self.aiLast = [np.concatenate(aColumn) for aColumn in
+                                                                          zip(*aColumns)]
+        else:
+            self.npArStarts = self.npArStops = self.aiFirst = self.aiLast = np.zeros(0, dtype=np.int64)
+        self.npArBP = npArLengths[self.aiLast] - npArLengths[self.aiFirst]
+        self.npArOverlap = npArCovered[self.aiLast] - npArCovered[self.aiFirst]
+        self.iIterations = 0
+        self.npArSum = np.zeros(len(self.aChr))
+        self.npArSumSquares = np.zeros(len(self.aChr))
+        self.npArLower = np.zeros(len(self.aChr), dtype=np.int64)
+
+    def add(self, oPlacements):
+        """
+        Add the window overlaps of a block of random sets (randomoverlaps.PlacementArrays keeping the UCE of each
+        interval) to the null, returning the [count, bp] union overlap of each set
+
+        """
+        npArOrders = oPlacements.orders()
+        if npArOrders is None:
+            raise ValueError("Random sets must keep the UCE of each interval to be scanned")
+        npArPlaced = self.oTrack.covered_each(*oPlacements.arrays())
+        aiRows = np.arange(len(npArPlaced))[:, None]
+        npArCumulative = np.zeros((len(npArPlaced), self.iUCEs + 1), dtype=np.int64)
+        npArCumulative[aiRows, npArOrders + 1] = npArPlaced
+        np.cumsum(npArCumulative, axis=1, out=npArCumulative)
+        npArNull = npArCumulative[:, self.aiLast] - npArCumulative[:, self.aiFirst]
+        self.iIterations += len(npArNull)
+        self.npArSum += npArNull.sum(axis=0)
+        self.npArSumSquares += (npArNull.astype(np.float64) ** 2).sum(axis=0)
+        self.npArLower += (npArNull <= self.npArOverlap).sum(axis=0)
+        return [[int(iCount), int(iBP)] for iCount, iBP in zip((npArPlaced > 0).sum(axis=1), npArPlaced.sum(axis=1))]
+
+    def windows(self):
+        """ A row of HEADER for each window holding a UCE, in chromosome order """
+        if not self.aChr or self.iIterations < 2:
+            return []
+        iN = self.iIterations
+        npArExpected = self.npArSum / iN
+        npArSD = np.sqrt(np.maximum(self.npArSumSquares - iN * npArExpected ** 2, 0) / (iN - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            npArObsExp = np.where(npArExpected > 0, self.npArOverlap / npArExpected, np.nan)
+        npArP = (1.0 + self.npArLower) / (1.0 + iN)
+        npArQ = bh_qvalues(npArP)
+        npArUCEs = self.aiLast - self.aiFirst
+        return [[strChr, int(iStart), int(iStop), int(iUCEs), int(iBP), int(iOverlap), dExpected, dSD, dObsExp, dP, dQ]
+                for strChr, iStart, iStop, iUCEs, iBP, iOverlap, dExpected, dSD, dObsExp, dP, dQ in
+                zip(self.aChr, self.npArStarts, self.npArStops, npArUCEs, self.npArBP, self.npArOverlap, npArExpected,
+                    npArSD, npArObsExp, npArP, npArQ)]
+
+
+def window_bounds(iEnd, iWidth, iStep):
+    """ 1-based starts and stops of the windows along a chromosome ending at iEnd """
+    npArStarts = np.arange(1, max(iEnd - iWidth, 0) + iStep + 1, iStep, dtype=np.int64)
+    return npArStarts, np.minimum(npArStarts + iWidth - 1, iEnd)
+
+
+def bh_qvalues(npArP):
+    """ Benjamini-Hochberg adjusted p-values """
+    iN = len(npArP)
+    if not iN:
+        return npArP
+    aiOrder = np.argsort(npArP)
+    npArQ = npArP[aiOrder] * iN / np.arange(1, iN + 1, dtype=np.float64)
+    npArQ = np.minimum.accumulate(npArQ[::-1])[::-1]
+    npArOut = np.empty(iN)
+    npArOut[aiOrder] = np.minimum(npArQ, 1.0)
+    return npArOut
+
+
+def write(aWindows, strFileName):
+    with open(strFileName, "w") as out:
+        out.write("\t".join(HEADER) + "\n")
+        for aWindow in aWindows:
+            out.write("\t".join(map(str, aWindow)) + "\n")
+
+
+if __name__ == "__main__":
+    print("This is a module designed to implement the windowed depletion scan in "
+          "the randomoverlaps.py script. It is not meant to be run "
+          "independently.")
+    sys.exit("Exiting...")